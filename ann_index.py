@@ -0,0 +1,135 @@
+import argparse
+import math
+
+import numpy as np
+
+from index_store import INDEX_DIR, add_arrays, load_array, load_index
+from retriever import top_k_indices
+
+# Inverted-file (IVF) index: spherical k-means splits the catalog into
+# `n_lists` clusters; a query scans only the rows of its `nprobe` closest
+# clusters instead of the whole matrix. Stored next to the vectors as:
+#   ivf_centroids (n_lists x dim float32), ivf_offsets (n_lists + 1 int64),
+#   ivf_ids (rows int32, row ids grouped by list)
+IVF_ARRAYS = ("ivf_centroids", "ivf_offsets", "ivf_ids")
+DEFAULT_NPROBE = 8
+
+
+def default_n_lists(n_rows):
+    return max(1, min(n_rows, int(round(4 * math.sqrt(n_rows)))))
+
+
+def _assign(embeddings, centroids, chunk_size=65536):
+    labels = np.empty(len(embeddings), dtype=np.int64)
+    for start in range(0, len(embeddings), chunk_size):
+        block = np.asarray(embeddings[start:start + chunk_size], dtype=np.float32)
+        labels[start:start + chunk_size] = np.argmax(block @ centroids.T, axis=1)
+    return labels
+
+
+def spherical_kmeans(embeddings, n_lists, n_iter=20, seed=0, sample_size=None):
+    rng = np.random.default_rng(seed)
+    n_rows = len(embeddings)
+    # Train on a sample for big catalogs; assignment later covers every row
+    if sample_size and n_rows > sample_size:
+        train = np.asarray(embeddings[np.sort(rng.choice(n_rows, sample_size, replace=False))], dtype=np.float32)
+    else:
+        train = np.asarray(embeddings, dtype=np.float32)
+
+    centroids = train[rng.choice(len(train), n_lists, replace=False)].copy()
+    for _ in range(n_iter):
+        labels = _assign(train, centroids)
+        counts = np.bincount(labels, minlength=n_lists)
+        empty = counts == 0
+        # Per-cluster sums via one sort + reduceat (np.add.at is far slower)
+        order = np.argsort(labels, kind="stable")
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        sums = np.zeros_like(centroids)
+        sums[~empty] = np.add.reduceat(train[order], starts[~empty], axis=0)
+        if empty.any():
+            # Re-seed empty clusters with random training rows
+            sums[empty] = train[rng.choice(len(train), int(empty.sum()), replace=False)]
+        centroids = sums / (np.linalg.norm(sums, axis=1, keepdims=True) + 1e-9)
+    return centroids.astype(np.float32)
+
+
+def build_ivf(embeddings, n_lists=None, n_iter=20, seed=0, sample_size=100_000, centroids=None):
+    # Passing centroids skips k-means and only assigns rows (incremental rebuilds)
+    if centroids is None:
+        n_lists = n_lists or default_n_lists(len(embeddings))
+        n_lists = min(n_lists, len(embeddings))
+        centroids = spherical_kmeans(embeddings, n_lists, n_iter=n_iter, seed=seed, sample_size=sample_size)
+    centroids = np.asarray(centroids, dtype=np.float32)
+    n_lists = len(centroids)
+    labels = _assign(embeddings, centroids)
+    ids = np.argsort(labels, kind="stable").astype(np.int32)
+    offsets = np.zeros(n_lists + 1, dtype=np.int64)
+    np.cumsum(np.bincount(labels, minlength=n_lists), out=offsets[1:])
+    return {"ivf_centroids": centroids, "ivf_offsets": offsets, "ivf_ids": ids}
+
+
+def ivf_manifest(arrays, n_iter, seed):
+    return {"ivf": {"n_lists": len(arrays["ivf_centroids"]), "n_iter": n_iter, "seed": seed}}
+
+
+class IVFIndex:
+    def __init__(self, centroids, offsets, ids):
+        self.centroids = centroids
+        self.offsets = offsets
+        self.ids = ids
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        return cls(*(arrays[name] for name in IVF_ARRAYS))
+
+    @classmethod
+    def load(cls, index_dir=INDEX_DIR, manifest=None):
+        arrays = {name: load_array(name, index_dir, manifest) for name in IVF_ARRAYS}
+        if any(a is None for a in arrays.values()):
+            return None
+        return cls.from_arrays(arrays)
+
+    @property
+    def n_lists(self):
+        return len(self.centroids)
+
+    def candidates(self, list_order, nprobe, min_count):
+        # Probe the nprobe best lists, and keep probing until k rows are covered
+        chunks, count = [], 0
+        for rank, lst in enumerate(list_order):
+            if rank >= nprobe and count >= min_count:
+                break
+            start, end = self.offsets[lst], self.offsets[lst + 1]
+            chunks.append(self.ids[start:end])
+            count += end - start
+        return np.concatenate(chunks) if chunks else np.empty(0, dtype=np.int32)
+
+    def search(self, query_vecs, embeddings, k=10, nprobe=DEFAULT_NPROBE):
+        query_vecs = np.atleast_2d(query_vecs)
+        k = min(k, len(embeddings))
+        # One GEMM against the centroids ranks the lists for every query
+        list_order = np.argsort(-(query_vecs @ self.centroids.T), axis=1)
+        indices = np.empty((len(query_vecs), k), dtype=np.intp)
+        scores = np.empty((len(query_vecs), k), dtype=np.float32)
+        for qi, query_vec in enumerate(query_vecs):
+            cand = np.sort(self.candidates(list_order[qi], nprobe, k))
+            cand_scores = np.asarray(embeddings[cand]) @ query_vec
+            top = top_k_indices(cand_scores[None, :], k)[0]
+            indices[qi] = cand[top]
+            scores[qi] = cand_scores[top]
+        return indices, scores
+
+
+if __name__ == "__main__":
+    # Build (or rebuild) the IVF lists for an existing index without re-encoding
+    parser = argparse.ArgumentParser(description="Build an IVF index for an existing product index.")
+    parser.add_argument("index_dir", nargs="?", default=INDEX_DIR)
+    parser.add_argument("--lists", type=int, default=None, help="number of clusters (default: 4*sqrt(rows))")
+    parser.add_argument("--iters", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    _, embeddings, _ = load_index(args.index_dir)
+    arrays = build_ivf(embeddings, n_lists=args.lists, n_iter=args.iters, seed=args.seed)
+    add_arrays(arrays, args.index_dir, extra=ivf_manifest(arrays, args.iters, args.seed))
+    print(f"Built IVF with {len(arrays['ivf_centroids'])} lists for {len(embeddings)} rows in {args.index_dir}/.")
@@ -1,21 +1,129 @@
 
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel, Field
-from sentence_transformers import SentenceTransformer
-import pickle
+from fastapi import FastAPI, Header, HTTPException, Query
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse, Response
+from pydantic import BaseModel, Field, ValidationError, field_validator
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+from typing import List, Literal, Optional
 import numpy as np
+import asyncio
+import hmac
 import os
-from typing import List, Optional
+import threading
+import time
+
+from filters import filter_key, normalize_test_types
+from encoders import ENCODER_BACKEND, get_encoder
+from index_store import (DEFAULT_BACKEND, INDEX_DIR, MANIFEST_FILE, index_exists, index_version, load_manifest,
+                         product_slug)
+from lexical_index import final_order, normalize_name
+import metrics
+from metrics import BATCH_BUCKETS, Counter, Gauge, Histogram, MetricsMiddleware, stage
+from query_cache import LRUCache, normalize_query
+from retriever import Retriever, encode_queries
 
 app = FastAPI(title="SHL Assessment Recommender")
 
+# Per-request stage timings as a Server-Timing header (metrics on /metrics are always on)
+SERVER_TIMING = os.environ.get("RECOMMEND_SERVER_TIMING", "0") == "1"
+app.add_middleware(MetricsMiddleware, server_timing=SERVER_TIMING)
+
 # Global variables
 model = None
-products_data = None
-embeddings_matrix = None
+batcher = None
+# The served index (IndexSnapshot); replaced as a whole on reload
+snapshot = None
+
+# Hot reload of a rebuilt index without a restart: POST /admin/reload (with
+# X-Admin-Token: $RECOMMEND_ADMIN_TOKEN; disabled when unset) or polling
+# manifest.json every RECOMMEND_RELOAD_POLL_S seconds (0 = off)
+ADMIN_TOKEN = os.environ.get("RECOMMEND_ADMIN_TOKEN")
+RELOAD_POLL_S = float(os.environ.get("RECOMMEND_RELOAD_POLL_S", "0"))
+reload_lock = threading.Lock()
+
+# Multi-worker serving (gunicorn.conf.py): the master runs preload() before
+# forking and each worker runs init_worker() right after. Workers get
+# RECOMMEND_WORKER_THREADS encoder threads each (default: cores / workers).
+WORKER_THREADS = int(os.environ["RECOMMEND_WORKER_THREADS"]) if os.environ.get("RECOMMEND_WORKER_THREADS") else None
+encoder_threads = None
+preloaded_model = None
+
+# Background load progress, reported by /health/ready
+STARTED_AT = time.time()
+load_state = {"stage": "starting", "ready": False, "error": None, "items": 0, "index_version": None,
+              "encoder_backend": None, "timings": {}}
+WARMUP_QUERY = "Java developer who collaborates with business teams"
+
+DEFAULT_TOP_K = 10
+MAX_TOP_K = 50
+MAX_BATCH_QUERIES = 1000
+
+# Micro-batching of concurrent /recommend calls (see QueryBatcher)
+BATCH_WINDOW_MS = float(os.environ.get("RECOMMEND_BATCH_WINDOW_MS", "2"))
+BATCH_MAX_SIZE = int(os.environ.get("RECOMMEND_BATCH_MAX_SIZE", "32"))
+
+# Query cache: normalized query text -> {"vector", "indices": {filter key: ranking}};
+# size 0 disables it
+CACHE_SIZE = int(os.environ.get("RECOMMEND_CACHE_SIZE", "1024"))
+CACHE_TTL = float(os.environ["RECOMMEND_CACHE_TTL"]) if os.environ.get("RECOMMEND_CACHE_TTL") else None
+query_cache = LRUCache(max_size=CACHE_SIZE, ttl=CACHE_TTL)
+
+# IVF lists to probe when the index has one (0 = exact brute-force search)
+NPROBE = int(os.environ.get("RECOMMEND_NPROBE", "0"))
+# Rows re-scored at full precision when the index carries a quantized matrix
+RERANK_DEPTH = int(os.environ.get("RECOMMEND_RERANK_DEPTH", "64"))
+# Candidates taken from each of the dense and BM25 rankings before fusion
+FUSION_DEPTH = int(os.environ.get("RECOMMEND_FUSION_DEPTH", "50"))
+
+# Prometheus metrics on /metrics (see metrics.py); stage timings are recorded along the request path
+BATCH_SIZE = Histogram("recommender_batch_size", "Queries per encoder batch (batcher) or per /recommend/batch call.",
+                       buckets=BATCH_BUCKETS, labels=("source",))
+Gauge("recommender_batcher_queue_depth", "Queries waiting for the encoder thread.",
+      lambda: batcher.queue.qsize() if batcher is not None and batcher.queue is not None else 0)
+Gauge("recommender_query_cache_hits_total", "Query cache hits.", lambda: query_cache.hits, kind="counter")
+Gauge("recommender_query_cache_misses_total", "Query cache misses.", lambda: query_cache.misses, kind="counter")
+Gauge("recommender_query_cache_hit_ratio", "Query cache hits / lookups since start.",
+      lambda: query_cache.stats()["hit_rate"])
+Gauge("recommender_query_cache_entries", "Entries in the query cache.", lambda: len(query_cache))
+Gauge("recommender_ready", "1 once the index and model are loaded.", lambda: int(load_state["ready"]))
+Gauge("recommender_index_rows", "Products in the loaded index.", lambda: load_state["items"])
+Gauge("recommender_index_info", "Version of the index being served.",
+      lambda: {(snapshot.version,): 1} if snapshot is not None else None, labels=("version",))
+RELOADS = Counter("recommender_index_reloads_total", "Index reload attempts by result.", ("result",))
+Gauge("recommender_load_duration_seconds", "Startup time per load step (index, model, warmup, total).",
+      lambda: {(name[:-2],): value for name, value in load_state["timings"].items()}, labels=("step",))
+Gauge("recommender_encoder_texts_total", "Texts encoded, and how many were truncated or chunked.",
+      lambda: {(k,): model.counters[k] for k in ("texts", "truncated", "chunked")} if model is not None else None,
+      labels=("kind",), kind="counter")
 
-class QueryRequest(BaseModel):
+class SearchOptions(BaseModel):
+    # Retrieval mode: "dense" (embeddings), "lexical" (BM25) or "hybrid"
+    # (reciprocal rank fusion of both)
+    mode: Literal["dense", "lexical", "hybrid"] = "dense"
+    # Optional structured filters, applied before scoring (see filters.py)
+    remote_support: Optional[bool] = None
+    adaptive_support: Optional[bool] = None
+    max_duration: Optional[int] = Field(None, ge=1, description="Minutes; products without a listed duration are excluded.")
+    test_types: Optional[List[str]] = Field(None, description="Match any of these test types (names or letter codes).")
+
+    @field_validator("test_types")
+    @classmethod
+    def check_test_types(cls, value):
+        return normalize_test_types(value) if value else None
+
+    def filter_key(self):
+        return filter_key(self.remote_support, self.adaptive_support, self.max_duration, self.test_types)
+
+class QueryRequest(SearchOptions):
+    query: str
+
+class BatchQueryItem(SearchOptions):
     query: str
+    k: Optional[int] = Field(None, ge=1, le=MAX_TOP_K)
+
+class BatchQueryRequest(BaseModel):
+    queries: List[BatchQueryItem] = Field(..., min_length=1, max_length=MAX_BATCH_QUERIES)
 
 class RecommendationItem(BaseModel):
     url: str
@@ -29,79 +137,599 @@ class RecommendationItem(BaseModel):
 class RecommendationResponse(BaseModel):
     recommended_assessments: List[RecommendationItem] = Field(..., serialization_alias="recommended assessments")
 
-@app.on_event("startup")
-async def load_resources():
-    global model, products_data, embeddings_matrix
-    import gc
+class BatchRecommendationResponse(BaseModel):
+    results: List[RecommendationResponse]
+
+class QueryBatcher:
+    # Coalesces queries that arrive within `window_ms` (or until `max_size` are
+    # waiting) into one call of `process_fn(list_of_items) -> list_of_results`.
+    # All model work runs on a single dedicated encoder thread, so concurrent
+    # requests no longer fight over torch's intra-op threads.
+    def __init__(self, process_fn, window_ms=BATCH_WINDOW_MS, max_size=BATCH_MAX_SIZE):
+        self.process_fn = process_fn
+        self.window = max(window_ms, 0) / 1000.0
+        self.max_size = max(max_size, 1)
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="encoder")
+        self.queue = None
+        self.task = None
+
+    def start(self):
+        self.queue = asyncio.Queue()
+        self.task = asyncio.get_running_loop().create_task(self._worker())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        self.executor.shutdown(wait=False)
+
+    async def submit(self, item):
+        future = asyncio.get_running_loop().create_future()
+        # Enqueue time and the request's stage timings, for queue wait / Server-Timing
+        await self.queue.put((item, future, time.perf_counter(), metrics.current_timings()))
+        return await future
+
+    async def run(self, fn, *args):
+        # Run other model work (e.g. /recommend/batch) on the same encoder thread;
+        # the copied context carries the caller's stage timings over
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(self.executor, context.run, fn, *args)
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        deadline = loop.time() + self.window
+        while len(batch) < self.max_size:
+            # Take whatever is already queued, then wait out the rest of the window
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _worker(self):
+        while True:
+            batch = await self._collect()
+            items = [item for item, _, _, _ in batch]
+            BATCH_SIZE.observe(len(batch), "batcher")
+            now = time.perf_counter()
+            for _, _, enqueued, request_timings in batch:
+                metrics.observe_stage("queue", now - enqueued, request_timings)
+            # Every request in the batch waited for the whole batch's stages
+            timings = {}
+            try:
+                results = await self.run(metrics.collect_into, timings, self.process_fn, items)
+            except Exception as e:
+                for _, future, _, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future, _, request_timings), result in zip(batch, results):
+                metrics.merge_timings(timings, request_timings)
+                if not future.done():
+                    future.set_result(result)
+
+class IndexSnapshot:
+    # Everything served from one index build: the retriever (vectors,
+    # records, filter columns, BM25) and the response fragments. Reloads
+    # swap the whole object; a request takes it once and uses it throughout,
+    # so a response never mixes two catalogs.
+    def __init__(self, retriever, fragments, version):
+        self.retriever = retriever
+        self.fragments = fragments
+        # Fragments of deduplicated variants, shown when only a variant passes a filter
+        self.variant_fragments = {i: build_fragments(p['variants'])
+                                  for i, p in enumerate(retriever.products) if p.get('variants')}
+        self.version = version
+        self.loaded_at = time.time()
+        # URL slug -> row, for /similar/{product}; slugs of deduplicated
+        # variants resolve to their canonical row
+        self.slugs = {}
+        for i, p in enumerate(retriever.products):
+            self.slugs.setdefault(product_slug(p), i)
+        for i, p in enumerate(retriever.products):
+            for v in p.get('variants', ()):
+                self.slugs.setdefault(product_slug(v), i)
+
+    def render_items(self, rows, fkey=None):
+        shown = self.retriever.attributes.shown_variants(fkey)
+        return ITEMS_PREFIX + b",".join([self.variant_fragments[i][shown[i]] if i in shown else self.fragments[i]
+                                         for i in rows]) + ITEMS_SUFFIX
+
+    def find(self, product):
+        # Row of a product given its URL slug or its exact name (any case)
+        row = self.slugs.get(product.strip().lower())
+        if row is None and self.retriever.lexical is not None:
+            rows = self.retriever.lexical.names.get(normalize_name(product))
+            row = rows[0] if rows else None
+        return row
+
+def encode_and_search(snap, queries, k=DEFAULT_TOP_K, vectors=None, filter_keys=None):
+    # Returns one (vector, top_indices) pair per query. `vectors` may carry
+    # already-known embeddings (None entries are encoded in one call).
+    vectors = list(vectors) if vectors is not None else [None] * len(queries)
+    filter_keys = filter_keys or [None] * len(queries)
+    missing = [i for i, vec in enumerate(vectors) if vec is None]
+    if missing:
+        with stage("encode"):
+            encoded = encode_queries(model, [queries[i] for i in missing])
+        for vec, i in zip(encoded, missing):
+            vectors[i] = vec
+    query_vecs = np.vstack(vectors)
     
-    # Load model with minimal memory footprint strategy if possible
-    # We are using a small model (80MB), but the overhead can be high.
-    print("Loading model...")
-    model = SentenceTransformer('all-MiniLM-L6-v2', device='cpu')
+    # One matrix product per distinct filter in the batch, over eligible rows only
+    groups = {}
+    for i, fkey in enumerate(filter_keys):
+        groups.setdefault(fkey, []).append(i)
+    top_indices = [None] * len(queries)
+    retriever = snap.retriever
+    for fkey, members in groups.items():
+        rows, _ = retriever.search(query_vecs[members], k=k, rows=retriever.attributes.rows(fkey))
+        for i, row in zip(members, rows):
+            top_indices[i] = row
+    return list(zip(query_vecs, top_indices))
+
+def search_batched(items):
+    # QueryBatcher entry point: items are (query, filter key, depth, snapshot,
+    # cached vector or None) tuples; only queries without a vector are encoded.
+    # A batch that straddles a reload is searched per snapshot.
+    groups = {}
+    for i, item in enumerate(items):
+        groups.setdefault(id(item[3]), []).append(i)
+    results = [None] * len(items)
+    for members in groups.values():
+        batch = [items[i] for i in members]
+        depth = max(d for _, _, d, _, _ in batch)
+        found = encode_and_search(batch[0][3], [q for q, _, _, _, _ in batch], depth,
+                                  vectors=[v for _, _, _, _, v in batch], filter_keys=[f for _, f, _, _, _ in batch])
+        for i, result in zip(members, found):
+            results[i] = result
+    return results
+
+def cached_indices(snap, entry, k, fkey=None):
+    # A cached ranking answers any k up to the depth it was computed at
+    if entry is None or fkey not in entry["indices"]:
+        return None
+    indices = entry["indices"][fkey]
+    retriever = snap.retriever
+    eligible = len(retriever) if fkey is None else len(retriever.attributes.rows(fkey))
+    if len(indices) >= min(k, eligible):
+        return indices[:k]
+    return None
+
+def remember(text_key, entry, fkey, query_vec, indices, max_filters=8):
+    entry = entry if entry is not None else {"vector": query_vec, "indices": {}}
+    if fkey not in entry["indices"] and len(entry["indices"]) >= max_filters:
+        entry["indices"].pop(next(iter(entry["indices"])))
+    entry["indices"][fkey] = indices
+    query_cache.put(text_key, entry)
+
+def load_model(threads=None):
+    # ENCODER_BACKEND=torch|onnx|onnx-int8 (see encoders.py); only torch imports torch
+    encoder = get_encoder(threads=threads or encoder_threads)
+    load_state["encoder_backend"] = encoder.backend
+    return encoder
+
+def encoder_mismatch(retriever, encoder):
+    # Why the index's vectors are not comparable with the encoder's, or None.
+    # Model names compare by last path component ("sentence-transformers/x" == "x").
+    manifest = retriever.manifest or {}
+    dimension = retriever.embeddings.shape[1]
+    if encoder.dimension and dimension != encoder.dimension:
+        return f"Index has {dimension}-dim vectors but the encoder produces {encoder.dimension}."
+    index_model = manifest.get("model_name")
+    if index_model and encoder.model_name and \
+            os.path.basename(index_model.rstrip("/")) != os.path.basename(encoder.model_name.rstrip("/")):
+        return f"Index was encoded with {index_model} but the encoder is {encoder.model_name}."
+    index_backend = manifest.get("encoder_backend", DEFAULT_BACKEND)
+    if index_backend != encoder.backend:
+        return f"Index was encoded with the {index_backend} backend but the encoder is {encoder.backend}."
+    return None
+
+def load_snapshot(timings=None):
+    if not index_exists(INDEX_DIR):
+        raise FileNotFoundError(f"{INDEX_DIR}/ not found. Run create_embeddings.py first.")
+    timings = timings if timings is not None else {}
+    t0 = time.perf_counter()
+    loaded = Retriever.from_index(INDEX_DIR, nprobe=NPROBE, rerank_depth=RERANK_DEPTH)
+    timings["index_s"] = round(time.perf_counter() - t0, 3)
+    t0 = time.perf_counter()
+    fragments = build_fragments(loaded.products)
+    timings["fragments_s"] = round(time.perf_counter() - t0, 3)
+    return IndexSnapshot(loaded, fragments, index_version(loaded.manifest))
+
+def publish(snap):
+    # Single assignment: requests that already hold the old snapshot finish on
+    # it, every later request sees the new one
+    global snapshot
+    query_cache.bind_version(snap.version)
+    snapshot = snap
+    load_state["items"] = len(snap.retriever)
+    load_state["index_version"] = snap.version
+
+def load_index():
+    load_state["stage"] = "loading_index"
+    print("Loading embeddings...")
+    publish(load_snapshot(load_state["timings"]))
+    print(f"Loaded {load_state['items']} items (index {snapshot.version}).")
+
+def reload_index():
+    # Loads the index currently on disk next to the served one and swaps it
+    # in; returns (reloaded, message). Failures keep the old index serving.
+    if not reload_lock.acquire(blocking=False):
+        return False, "A reload is already running."
+    try:
+        version = index_version(load_manifest(INDEX_DIR))
+        if snapshot is not None and version == snapshot.version:
+            return False, f"Index {version} is already being served."
+        started = time.perf_counter()
+        snap = load_snapshot()
+        problem = encoder_mismatch(snap.retriever, model) if model is not None else None
+        if problem:
+            raise ValueError(problem)
+        previous = snapshot.version if snapshot is not None else None
+        publish(snap)
+        RELOADS.inc("ok")
+        message = f"Reloaded index {previous} -> {snap.version} ({len(snap.retriever)} items) in {time.perf_counter() - started:.1f}s."
+        print(message)
+        return True, message
+    except Exception as e:
+        RELOADS.inc("failed")
+        message = f"Reload failed, still serving {load_state['index_version']}: {type(e).__name__}: {e}"
+        print(message)
+        return False, message
+    finally:
+        reload_lock.release()
+
+def watch_index():
+    # manifest.json is replaced atomically by every rebuild (index_store.py)
+    path = os.path.join(INDEX_DIR, MANIFEST_FILE)
+    seen = None
+    while True:
+        try:
+            stat = os.stat(path)
+            stamp = (stat.st_mtime_ns, stat.st_ino, stat.st_size)
+        except OSError:
+            stamp = None
+        if stamp is not None and stamp != seen and snapshot is not None:
+            reload_index()
+        seen = stamp
+        time.sleep(RELOAD_POLL_S)
+
+def load_resources():
+    global model
+    import gc
     
-    # Load embeddings
-    if os.path.exists("product_embeddings.pkl"):
-        print("Loading embeddings...")
-        with open("product_embeddings.pkl", "rb") as f:
-            products_data = pickle.load(f)
-            embeddings_matrix = np.array([p['vector'] for p in products_data])
-            norm = np.linalg.norm(embeddings_matrix, axis=1, keepdims=True)
-            embeddings_matrix = embeddings_matrix / (norm + 1e-9)
-        print(f"Loaded {len(products_data)} items.")
-    else:
-        print("product_embeddings.pkl not found.")
+    started = time.perf_counter()
+    try:
+        # Index first: it is memory-mapped and quick, and lexical-only queries
+        # can be served from it while the model is still loading
+        if snapshot is None:
+            load_index()
+        
+        loaded_model = preloaded_model
+        if loaded_model is None:
+            # Load model with minimal memory footprint strategy if possible
+            # We are using a small model (80MB), but the overhead can be high.
+            load_state["stage"] = "loading_model"
+            print("Loading model...")
+            t0 = time.perf_counter()
+            loaded_model = load_model()
+            load_state["timings"]["model_s"] = round(time.perf_counter() - t0, 3)
+        
+        # One throwaway encode so the first real request doesn't pay for lazy init
+        load_state["stage"] = "warming_up"
+        t0 = time.perf_counter()
+        encode_queries(loaded_model, [WARMUP_QUERY])
+        load_state["timings"]["warmup_s"] = round(time.perf_counter() - t0, 3)
+        model = loaded_model
+        problem = encoder_mismatch(snapshot.retriever, model)
+        if problem:
+            # No other index to fall back to at startup; reloads reject this
+            print(f"Warning: {problem} Rebuild the index with create_embeddings.py.")
         
+        load_state["timings"]["total_s"] = round(time.perf_counter() - started, 3)
+        load_state["stage"] = "ready"
+        load_state["ready"] = True
+        print(f"Ready in {load_state['timings']['total_s']}s.")
+    except Exception as e:
+        load_state["stage"] = "failed"
+        load_state["error"] = f"{type(e).__name__}: {e}"
+        print(f"Startup failed: {load_state['error']}")
+        
+    gc.collect()
+
+def preload():
+    # gunicorn master, before forking: the product records, response
+    # fragments, filter columns and BM25 postings, plus the torch model, are
+    # built once and shared copy-on-write by every worker. The embeddings are
+    # a read-only mmap, shared through the page cache either way.
+    global preloaded_model
+    import gc
+    
+    os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+    started = time.perf_counter()
+    load_index()
+    if ENCODER_BACKEND == "torch":
+        # One thread while loading, so no OpenMP pool exists at fork time;
+        # no warm-up encode here for the same reason
+        print("Loading model...")
+        t0 = time.perf_counter()
+        preloaded_model = load_model(threads=1)
+        load_state["timings"]["model_s"] = round(time.perf_counter() - t0, 3)
+    # ONNX Runtime sessions own thread pools that do not survive fork, so
+    # with the ONNX backends each worker loads its own (small) session
+    load_state["stage"] = "preloaded"
+    print(f"Preloaded in {time.perf_counter() - started:.1f}s.")
+    # Keep the GC from writing to (and so un-sharing) the preloaded objects
     gc.collect()
+    gc.freeze()
+
+def init_worker(workers):
+    # gunicorn post_fork: split the cores between workers
+    global encoder_threads
+    encoder_threads = WORKER_THREADS or max(1, (os.cpu_count() or 1) // max(workers, 1))
+    if preloaded_model is not None:
+        preloaded_model.set_threads(encoder_threads)
+
+@app.on_event("startup")
+async def start_background_load():
+    global batcher
+    batcher = QueryBatcher(search_batched)
+    batcher.start()
+    # Bind the port immediately; model and index load in the background
+    threading.Thread(target=load_resources, name="loader", daemon=True).start()
+    if RELOAD_POLL_S > 0:
+        threading.Thread(target=watch_index, name="index-watcher", daemon=True).start()
+
+def require_loaded(need_model=False):
+    # Returns the snapshot to serve this request from
+    snap = snapshot
+    if snap is None or (need_model and model is None):
+        raise HTTPException(
+            status_code=503,
+            detail=f"Service is warming up ({load_state['stage']}). Check /health/ready.",
+            headers={"Retry-After": "5"},
+        )
+    return snap
+
+@app.on_event("shutdown")
+async def shutdown():
+    if batcher is not None:
+        await batcher.stop()
 
 @app.get("/")
 def home():
     return {
         "message": "SHL Assessment Recommender API is Live!",
         "docs_url": "/docs",
-        "health_check": "/health"
+        "health_check": "/health",
+        "readiness": "/health/ready"
     }
 
 @app.get("/health")
 def health_check():
-    return {"status": "healthy"}
+    return {"status": "healthy", "ready": load_state["ready"]}
+
+@app.get("/health/live")
+def liveness():
+    # The process is up and serving HTTP; says nothing about the model
+    return {"status": "alive", "uptime_s": round(time.time() - STARTED_AT, 3)}
+
+@app.get("/health/ready")
+def readiness():
+    # 200 only once the index and model are loaded and warmed up
+    body = {"status": "ready" if load_state["ready"] else load_state["stage"], **load_state}
+    return JSONResponse(body, status_code=200 if load_state["ready"] else 503)
+
+@app.get("/cache/stats")
+def cache_stats():
+    return query_cache.stats()
+
+@app.post("/admin/reload")
+def admin_reload(x_admin_token: Optional[str] = Header(None)):
+    # Runs in the threadpool: other requests keep being served while the new index loads
+    if not ADMIN_TOKEN or not hmac.compare_digest(x_admin_token or "", ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Set RECOMMEND_ADMIN_TOKEN and send it as X-Admin-Token.")
+    reloaded, message = reload_index()
+    return {"reloaded": reloaded, "message": message, "index_version": load_state["index_version"]}
+
+@app.get("/metrics")
+def prometheus_metrics():
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.get("/encoder/stats")
+def encoder_stats():
+    # Truncation / chunking counts and padding efficiency of the encoder
+    require_loaded(need_model=True)
+    return model.stats()
+
+def needs_dense(snap, query, mode, fkey):
+    # Pure product-name lookups ("OPQ32r", "Java 8 (New)") skip the transformer
+    if mode == "lexical":
+        return False
+    if mode == "hybrid":
+        retriever = snap.retriever
+        return len(retriever.lexical.exact_match(query, retriever.attributes.rows(fkey))) == 0
+    return True
+
+async def dense_ranking(snap, query, fkey, depth):
+    # Repeated queries skip model inference entirely; cache keys carry the
+    # index version, so rankings from an old snapshot are never reused
+    key = (snap.version, normalize_query(query))
+    entry = query_cache.get(key)
+    top_indices = cached_indices(snap, entry, depth, fkey)
+    if top_indices is None:
+        # Encode + cosine similarity + top k, coalesced with other in-flight
+        # requests into one batch; a cached query vector is only searched
+        vector = entry["vector"] if entry is not None else None
+        query_vec, top_indices = await batcher.submit((query, fkey, depth, snap, vector))
+        remember(key, entry, fkey, query_vec, top_indices)
+    return top_indices
+
+async def dense_rankings(snap, queries, fkeys, depth):
+    keys = [(snap.version, normalize_query(q)) for q in queries]
+    entries = [query_cache.get(key) for key in keys]
+    top_indices = [cached_indices(snap, entry, depth, fkey) for entry, fkey in zip(entries, fkeys)]
+    misses = [i for i, row in enumerate(top_indices) if row is None]
+    
+    if misses:
+        # One encode call and one matrix product per filter for all misses
+        miss_vectors = [entries[i]["vector"] if entries[i] is not None else None for i in misses]
+        computed = await batcher.run(encode_and_search, snap, [queries[i] for i in misses], depth,
+                                     miss_vectors, [fkeys[i] for i in misses])
+        for i, (query_vec, row) in zip(misses, computed):
+            remember(keys[i], entries[i], fkeys[i], query_vec, row)
+            top_indices[i] = row
+    return top_indices
+
+def lexical_rankings(snap, queries, fkeys, depth):
+    # One sparse (queries x terms) @ (terms x products) product per filter
+    retriever = snap.retriever
+    groups = {}
+    for i, fkey in enumerate(fkeys):
+        groups.setdefault(fkey, []).append(i)
+    rankings = [None] * len(queries)
+    for fkey, members in groups.items():
+        with stage("lexical"):
+            rows = retriever.lexical.search([queries[i] for i in members], depth, retriever.attributes.rows(fkey))
+        for i, row in zip(members, rows):
+            rankings[i] = row
+    return rankings
+
+def final_ranking(snap, query, mode, fkey, k, dense_row=None, lexical_row=None):
+    retriever = snap.retriever
+    return final_order(retriever.lexical, query, mode, k, dense_row, lexical_row, retriever.attributes.rows(fkey))
+
+def build_item(p):
+    # Handle cases where new fields might not exist yet during transition
+    return RecommendationItem(
+        url=p.get('url', ''),
+        name=p.get('name', p.get('title', 'Unknown')),
+        adaptive_support=p.get('adaptive_support', 'No'),
+        description=p.get('description', '')[:200], # Trucate if too long? No, spec says string.
+        duration=p.get('duration', 0),
+        remote_support=p.get('remote_support', 'Yes'),
+        test_type=p.get('test_type', p.get('test_types', []))
+    )
+
+def build_fragment(p):
+    # The item exactly as FastAPI would serialize it for the response model
+    # (pydantic JSON, aliased keys)
+    try:
+        return build_item(p).model_dump_json(by_alias=True).encode("utf-8")
+    except (TypeError, ValueError) as e:
+        # Keep serving the rest of the catalog; responses that include this row fail
+        print(f"Cannot build response item for {p.get('url')!r}: {e}")
+        return None
+
+def build_fragments(products):
+    # A response is then only the top-k fragments joined
+    return [build_fragment(p) for p in products]
+
+# {"recommended assessments":[...]} around the joined item fragments
+ITEMS_PREFIX = b'{"%s":[' % RecommendationResponse.model_fields["recommended_assessments"].serialization_alias.encode()
+ITEMS_SUFFIX = b"]}"
+
+def json_response(body, snap):
+    # X-Index-Version: the index build this response was computed from
+    return Response(body, media_type="application/json", headers={"X-Index-Version": snap.version})
 
 @app.post("/recommend", response_model=RecommendationResponse)
-def recommend(request: QueryRequest):
-    if model is None or embeddings_matrix is None:
-        raise HTTPException(status_code=503, detail="Model or data not loaded.")
+async def recommend(request: QueryRequest):
+    snap = require_loaded()
     
-    # Encode query
-    query_vec = model.encode([request.query])[0]
-    query_vec = query_vec / (np.linalg.norm(query_vec) + 1e-9)
+    # Top k is fixed to 10 max per requirement
+    fkey = request.filter_key()
+    dense_row = lexical_row = None
+    if needs_dense(snap, request.query, request.mode, fkey):
+        require_loaded(need_model=True)
+        depth = DEFAULT_TOP_K if request.mode == "dense" else FUSION_DEPTH
+        dense_row = await dense_ranking(snap, request.query, fkey, depth)
+    if request.mode != "dense":
+        lexical_row = lexical_rankings(snap, [request.query], [fkey], max(DEFAULT_TOP_K, FUSION_DEPTH))[0]
+    top_indices = final_ranking(snap, request.query, request.mode, fkey, DEFAULT_TOP_K, dense_row, lexical_row)
     
-    # Cosine similarity
-    scores = np.dot(embeddings_matrix, query_vec)
+    with stage("build"):
+        body = snap.render_items(top_indices, fkey)
+    metrics.handler_done()
+    return json_response(body, snap)
+
+@app.post("/recommend/batch", response_model=BatchRecommendationResponse)
+async def recommend_batch(request: BatchQueryRequest):
+    snap = require_loaded()
     
-    # Get top k (fixed to 10 max per requirement)
-    top_indices = np.argsort(scores)[::-1][:10]
+    queries = [item.query for item in request.queries]
+    BATCH_SIZE.observe(len(queries), "batch_endpoint")
+    modes = [item.mode for item in request.queries]
+    ks = [item.k or DEFAULT_TOP_K for item in request.queries]
+    fkeys = [item.filter_key() for item in request.queries]
+    depths = [k if mode == "dense" else max(k, FUSION_DEPTH) for k, mode in zip(ks, modes)]
     
-    results = []
-    # If no results found (unlikely), return at least 1? The logic below returns whatever is top.
+    dense_rows = [None] * len(queries)
+    dense = [i for i in range(len(queries)) if needs_dense(snap, queries[i], modes[i], fkeys[i])]
+    if dense:
+        require_loaded(need_model=True)
+        depth = max(max(depths[i] for i in dense), DEFAULT_TOP_K)
+        rankings = await dense_rankings(snap, [queries[i] for i in dense], [fkeys[i] for i in dense], depth)
+        for i, row in zip(dense, rankings):
+            dense_rows[i] = row
     
-    for idx in top_indices:
-        p = products_data[idx]
-        # Handle cases where new fields might not exist yet during transition
-        item = RecommendationItem(
-            url=p.get('url', ''),
-            name=p.get('name', p.get('title', 'Unknown')),
-            adaptive_support=p.get('adaptive_support', 'No'),
-            description=p.get('description', '')[:200], # Trucate if too long? No, spec says string.
-            duration=p.get('duration', 0),
-            remote_support=p.get('remote_support', 'Yes'),
-            test_type=p.get('test_type', p.get('test_types', []))
-        )
-        results.append(item)
+    lexical_rows = [None] * len(queries)
+    lexical = [i for i in range(len(queries)) if modes[i] != "dense"]
+    if lexical:
+        depth = max(depths[i] for i in lexical)
+        rankings = lexical_rankings(snap, [queries[i] for i in lexical], [fkeys[i] for i in lexical], depth)
+        for i, row in zip(lexical, rankings):
+            lexical_rows[i] = row
+    
+    rows = [final_ranking(snap, queries[i], modes[i], fkeys[i], k, dense_rows[i], lexical_rows[i])
+            for i, k in enumerate(ks)]
+    with stage("build"):
+        body = b'{"results":[' + b",".join([snap.render_items(row, fkey) for row, fkey in zip(rows, fkeys)]) + b"]}"
+    metrics.handler_done()
+    return json_response(body, snap)
+
+@app.get("/similar/{product}", response_model=RecommendationResponse)
+async def similar(
+    product: str,
+    k: int = Query(DEFAULT_TOP_K, ge=1, le=MAX_TOP_K),
+    remote_support: Optional[bool] = None,
+    adaptive_support: Optional[bool] = None,
+    max_duration: Optional[int] = None,
+    test_types: Optional[List[str]] = Query(None),
+):
+    # Assessments similar to one product, given by URL slug or exact name
+    # (e.g. /similar/Occupational Personality Questionnaire OPQ32r?max_duration=20).
+    # Needs no model: neighbours come from the index's precomputed table, or
+    # one scan when the index has none.
+    snap = require_loaded()
+    try:
+        options = SearchOptions(remote_support=remote_support, adaptive_support=adaptive_support,
+                                max_duration=max_duration, test_types=test_types)
+    except ValidationError as e:
+        # Same locations FastAPI reports for its own query parameters
+        raise RequestValidationError([{**error, "loc": ("query", *error["loc"])}
+                                      for error in e.errors(include_url=False)])
+    row = snap.find(product)
+    if row is None:
+        raise HTTPException(status_code=404, detail=f"No product with slug or name {product!r}.")
     
-    if not results and len(products_data) > 0:
-         # Fallback if similarity failed completely?? Shouldn't happen.
-         pass
-         
-    return RecommendationResponse(recommended_assessments=results)
+    fkey = options.filter_key()
+    top_indices = snap.retriever.similar(row, k, snap.retriever.attributes.rows(fkey))
+    with stage("build"):
+        body = snap.render_items(top_indices, fkey)
+    metrics.handler_done()
+    return json_response(body, snap)
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,69 @@
+import argparse
+import glob
+import os
+import sys
+import time
+
+from catalog_parser import lxml_html, parse_product_page, parse_product_page_soup
+from http_cache import CACHE_DIR, HTTPCache
+
+# Parses a corpus of saved product pages with the BeautifulSoup reference
+# parser and the lxml fast path, reports pages/sec for both and fails if any
+# page yields different fields. The corpus is the scraper's HTTP cache
+# (product pages only) or a directory of .html files.
+PRODUCT_PATH = "/product-catalog/view/"
+
+
+def load_corpus(cache_dir=CACHE_DIR, pages_dir=None):
+    if pages_dir:
+        pages = []
+        for path in sorted(glob.glob(os.path.join(pages_dir, "*.html"))):
+            with open(path, "r", encoding="utf-8", errors="replace") as f:
+                pages.append((os.path.basename(path), f.read()))
+        return pages
+    entries = [e for e in HTTPCache(cache_dir).entries() if PRODUCT_PATH in e["url"]]
+    return sorted((e["url"], e["body"]) for e in entries)
+
+
+def run(parse, pages, repeat):
+    # Best of `repeat` passes over the corpus
+    best, results = None, None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        results = [parse(html, {}) for _, html in pages]
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark product-page parsing (BeautifulSoup vs lxml).")
+    parser.add_argument("--cache-dir", default=CACHE_DIR, help="scraper HTTP cache to take product pages from")
+    parser.add_argument("--pages-dir", default=None, help="directory of saved .html product pages instead")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    pages = load_corpus(args.cache_dir, args.pages_dir)
+    if not pages:
+        print("No product pages found. Run scrape_catalog.py first or pass --pages-dir.")
+        sys.exit(1)
+    if lxml_html is None:
+        print("lxml is not installed; the fast path falls back to BeautifulSoup.")
+
+    size_mb = sum(len(html) for _, html in pages) / 1e6
+    print(f"Corpus: {len(pages)} product pages ({size_mb:.1f} MB), best of {args.repeat}")
+    soup_s, expected = run(parse_product_page_soup, pages, args.repeat)
+    fast_s, got = run(parse_product_page, pages, args.repeat)
+
+    print(f"{'parser':<22} {'seconds':>8} {'pages/sec':>10}")
+    print(f"{'BeautifulSoup':<22} {soup_s:>8.3f} {len(pages) / soup_s:>10.1f}")
+    print(f"{'lxml fast path':<22} {fast_s:>8.3f} {len(pages) / fast_s:>10.1f}")
+    print(f"Speed-up: {soup_s / fast_s:.1f}x")
+
+    mismatches = [(name, a, b) for (name, _), a, b in zip(pages, expected, got) if a != b]
+    for name, a, b in mismatches[:10]:
+        print(f"MISMATCH {name}:\n  soup: {a}\n  lxml: {b}")
+    if mismatches:
+        print(f"{len(mismatches)} of {len(pages)} pages differ.")
+        sys.exit(1)
+    print(f"Extracted fields identical on all {len(pages)} pages.")
@@ -0,0 +1,314 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+
+from filters import TEST_TYPE_CODES, filter_key
+from index_store import MODEL_NAME, index_exists, save_index
+from lexical_index import bm25_manifest, build_bm25
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Performance benchmarks for the hot paths: index load, query encoding, top-k
+# search and /recommend through FastAPI's TestClient under concurrency, on
+# synthetic catalogs of increasing size. Each catalog size (and the encoder)
+# runs in its own process so peak RSS is per size. Results are written as
+# JSON; with --baseline they are compared against a stored run and the script
+# exits 1 when a metric regressed by more than --tolerance.
+#   python benchmark.py --sizes 1000,100000 --save-baseline
+#   python benchmark.py --sizes 1000,100000      # compare with bench_baseline.json
+DATA_DIR = "bench_data"
+RESULTS_FILE = "bench_results.json"
+BASELINE_FILE = "bench_baseline.json"
+DEFAULT_SIZES = "1000,10000,100000"
+DIMENSION = 384
+TOLERANCE = 0.25
+# Latency changes smaller than this are timer noise, whatever the ratio
+MIN_DELTA_MS = 0.05
+SEED = 0
+
+WORDS = ("java python sql cloud sales manager leadership numerical verbal reasoning customer service graduate "
+         "engineer analyst developer personality simulation situational judgement coding agile data finance "
+         "banking retail contact centre administrative clerical technical support mechanical safety").split()
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    # ru_maxrss is in KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1 << 20 if sys.platform == "darwin" else 1 << 10), 1)
+
+
+def current_rss_mb():
+    # Resident set size right now (Linux only); unlike the peak it does not
+    # include memory already freed by earlier steps
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return round(resident_pages * os.sysconf("SC_PAGE_SIZE") / (1 << 20), 1)
+
+
+def summarize(samples, wall_s=None, items=None):
+    # Latency percentiles of per-call timings; qps counts `items` (default one
+    # per call) over the wall time (default the sum of the calls)
+    ms = np.asarray(samples, dtype=np.float64) * 1000
+    wall_s = wall_s if wall_s is not None else float(np.sum(samples))
+    return {
+        "n": len(ms),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "mean_ms": round(float(ms.mean()), 3),
+        "qps": round((items if items is not None else len(ms)) / wall_s, 1) if wall_s else None,
+    }
+
+
+def timed(fn, *args):
+    started = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - started
+
+
+def synthetic_queries(n, seed=SEED):
+    rng = np.random.default_rng(seed)
+    return [f"{' '.join(rng.choice(WORDS, 6))} assessment {i}" for i in range(n)]
+
+
+def synthetic_catalog(n_rows, dimension=DIMENSION, data_dir=DATA_DIR, seed=SEED):
+    # Generated once per (rows, dimension) and reused by later runs
+    index_dir = os.path.join(data_dir, f"catalog-{n_rows}-d{dimension}")
+    if index_exists(index_dir):
+        return index_dir
+    print(f"Generating {n_rows}-row synthetic catalog in {index_dir}/...")
+    rng = np.random.default_rng(seed)
+    type_names = list(TEST_TYPE_CODES.values())
+    words = rng.integers(0, len(WORDS), (n_rows, 24), dtype=np.uint8)
+    durations = rng.integers(0, 90, n_rows)
+    flags = rng.random((n_rows, 2))
+    types = rng.random((n_rows, len(type_names))) < 0.25
+    products = [{
+        "name": f"{' '.join(WORDS[w] for w in words[i, :3]).title()} {i}",
+        "url": f"https://example.com/product-catalog/view/synthetic-{i}/",
+        "remote_support": "Yes" if flags[i, 0] < 0.8 else "No",
+        "adaptive_support": "Yes" if flags[i, 1] < 0.2 else "No",
+        "test_type": [t for t, on in zip(type_names, types[i]) if on],
+        "description": " ".join(WORDS[w] for w in words[i, 3:]),
+        "duration": int(durations[i]),
+    } for i in range(n_rows)]
+    bm25 = build_bm25(products)
+    # Generated as float16 in blocks to keep 1M-row catalogs within a few GB;
+    # save_index stores them normalized as float32
+    embeddings = np.empty((n_rows, dimension), dtype=np.float16)
+    for start in range(0, n_rows, 65536):
+        block = embeddings[start:start + 65536]
+        block[:] = rng.standard_normal(block.shape, dtype=np.float32)
+    save_index(products, embeddings, model_name=MODEL_NAME, index_dir=index_dir, arrays=bm25,
+               extra=bm25_manifest(bm25))
+    return index_dir
+
+
+def bench_encoder(iterations, batch_size):
+    from encoders import get_encoder
+    from retriever import encode_queries
+
+    started = time.perf_counter()
+    model = get_encoder()
+    load_s = time.perf_counter() - started
+    queries = synthetic_queries(iterations * (batch_size + 1) + 1)
+    encode_queries(model, queries[:1])
+    single = [timed(encode_queries, model, [q]) for q in queries[1:iterations + 1]]
+    rest = queries[iterations + 1:]
+    batched = [timed(encode_queries, model, rest[i:i + batch_size]) for i in range(0, len(rest), batch_size)]
+    return {
+        "backend": model.backend,
+        "load_s": round(load_s, 3),
+        "encode_single": summarize(single),
+        f"encode_batch_{batch_size}": summarize(batched, items=len(rest)),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def bench_api(index_dir, n_requests, concurrency):
+    # Query cache off and distinct queries, so every request encodes and searches
+    os.environ["RECOMMEND_CACHE_SIZE"] = "0"
+    from fastapi.testclient import TestClient
+    import app as api
+
+    api.INDEX_DIR = index_dir
+    queries = synthetic_queries(n_requests + concurrency, seed=SEED + 1)
+    with TestClient(api.app) as client:
+        while not api.load_state["ready"]:
+            if api.load_state["stage"] == "failed":
+                raise RuntimeError(f"API failed to load: {api.load_state['error']}")
+            time.sleep(0.05)
+        if api.model.encode(["x"]).shape[1] != api.snapshot.retriever.embeddings.shape[1]:
+            raise RuntimeError("Encoder dimension does not match the synthetic catalog; pass --dimension.")
+
+        def post(query):
+            started = time.perf_counter()
+            response = client.post("/recommend", json={"query": query})
+            response.raise_for_status()
+            return time.perf_counter() - started
+
+        with ThreadPoolExecutor(concurrency) as pool:
+            list(pool.map(post, queries[:concurrency]))
+            started = time.perf_counter()
+            samples = list(pool.map(post, queries[concurrency:]))
+            wall_s = time.perf_counter() - started
+    return summarize(samples, wall_s=wall_s)
+
+
+def bench_catalog(n_rows, options):
+    from retriever import Retriever
+
+    index_dir = synthetic_catalog(n_rows, options["dimension"], options["data_dir"])
+    result = {"rows": n_rows}
+    load = [timed(Retriever.from_index, index_dir) for _ in range(options["load_repeat"])]
+    result["index_load"] = summarize(load)
+    retriever = Retriever.from_index(index_dir)
+    result["rss_after_load_mb"] = current_rss_mb()
+
+    rng = np.random.default_rng(SEED)
+    iterations, batch_size = options["iterations"], options["batch_size"]
+    query_vecs = rng.standard_normal((iterations * batch_size, options["dimension"]), dtype=np.float32)
+    query_vecs /= np.linalg.norm(query_vecs, axis=1, keepdims=True)
+    retriever.search(query_vecs[:1], k=10)
+    result["search_single"] = summarize([timed(retriever.search, query_vecs[i], 10) for i in range(iterations)])
+    batches = [query_vecs[i:i + batch_size] for i in range(0, len(query_vecs), batch_size)]
+    result[f"search_batch_{batch_size}"] = summarize([timed(retriever.search, b, 10) for b in batches],
+                                                     items=len(query_vecs))
+    rows = retriever.attributes.rows(filter_key(remote_support=True, max_duration=30))
+    result["search_filtered"] = summarize(
+        [timed(retriever.search, query_vecs[i], 10, None, rows) for i in range(iterations)])
+    del retriever
+
+    if not options["skip_api"]:
+        result["recommend"] = bench_api(index_dir, options["requests"], options["concurrency"])
+    result["peak_rss_mb"] = peak_rss_mb()
+    return result
+
+
+def in_subprocess(fn, *args):
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+        return pool.submit(fn, *args).result()
+
+
+def flatten(results):
+    # {"catalogs/1000/search_single/p95_ms": value, ...} for the compared metrics
+    metrics = {}
+
+    def walk(prefix, node):
+        for key, value in node.items():
+            path = f"{prefix}/{key}"
+            if isinstance(value, dict):
+                walk(path, value)
+            elif isinstance(value, (int, float)) and (key.endswith(("_ms", "_s", "_mb")) or key == "qps"):
+                metrics[path] = value
+
+    if results.get("encoder"):
+        walk("encoder", results["encoder"])
+    for size, catalog in results.get("catalogs", {}).items():
+        walk(f"catalogs/{size}", catalog)
+    return metrics
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    # Latencies, times and memory must not grow, qps must not drop, by more than `tolerance`
+    current, previous = flatten(results), flatten(baseline)
+    regressions = []
+    for name in sorted(current.keys() & previous.keys()):
+        new, old = current[name], previous[name]
+        if not old:
+            continue
+        change = (new - old) / old
+        worse = -change if name.endswith("/qps") else change
+        if name.endswith("_ms") and abs(new - old) < MIN_DELTA_MS:
+            continue
+        if worse > tolerance:
+            regressions.append({"metric": name, "baseline": old, "current": new, "change": round(change, 3)})
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark index load, encoding, search and /recommend.")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="comma-separated catalog sizes, e.g. 1000,1000000")
+    parser.add_argument("--dimension", type=int, default=DIMENSION, help="must match the encoder for /recommend")
+    parser.add_argument("--data-dir", default=DATA_DIR, help="where synthetic catalogs are generated and kept")
+    parser.add_argument("--iterations", type=int, default=200, help="timed calls per search/encode benchmark")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--load-repeat", type=int, default=5)
+    parser.add_argument("--requests", type=int, default=500, help="/recommend calls per catalog size")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent /recommend clients")
+    parser.add_argument("--skip-encoder", action="store_true")
+    parser.add_argument("--skip-api", action="store_true")
+    parser.add_argument("--output", default=RESULTS_FILE)
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the baseline")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE, help="allowed relative slowdown")
+    args = parser.parse_args()
+
+    options = {k: getattr(args, k) for k in ("dimension", "data_dir", "iterations", "batch_size", "load_repeat",
+                                             "requests", "concurrency", "skip_api")}
+    results = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "encoder_backend": os.environ.get("ENCODER_BACKEND", "torch"),
+        },
+        "options": options,
+        "encoder": None,
+        "catalogs": {},
+    }
+    if not args.skip_encoder:
+        print("Benchmarking the encoder...")
+        results["encoder"] = in_subprocess(bench_encoder, args.iterations, args.batch_size)
+    for size in [int(s) for s in args.sizes.split(",") if s]:
+        # Generated in a separate process so it does not count towards peak RSS
+        in_subprocess(synthetic_catalog, size, args.dimension, args.data_dir)
+        print(f"Benchmarking a {size}-row catalog...")
+        results["catalogs"][str(size)] = in_subprocess(bench_catalog, size, options)
+
+    print(f"\n{'benchmark':<34} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'qps':>10}")
+    sections = [("encoder", results["encoder"] or {})] + [(f"{s} rows", c) for s, c in results["catalogs"].items()]
+    for label, section in sections:
+        for name, stats in section.items():
+            if isinstance(stats, dict):
+                print(f"{label + ' ' + name:<34} {stats['p50_ms']:>9.3f} {stats['p95_ms']:>9.3f} "
+                      f"{stats['p99_ms']:>9.3f} {stats['qps'] or 0:>10.1f}")
+        if section.get("peak_rss_mb") is not None:
+            print(f"{label + ' peak RSS':<34} {section['peak_rss_mb']:>9.1f} MB")
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nSaved baseline to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, "r") as f:
+            results["regressions"] = compare(results, json.load(f), args.tolerance)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Wrote {args.output}")
+
+    regressions = results.get("regressions")
+    if regressions is not None:
+        for r in regressions:
+            print(f"REGRESSION {r['metric']}: {r['baseline']} -> {r['current']} ({r['change']:+.0%})")
+        if regressions:
+            print(f"{len(regressions)} metrics regressed by more than {args.tolerance:.0%} against {args.baseline}.")
+            sys.exit(1)
+        print(f"No regressions against {args.baseline}.")
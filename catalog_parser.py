@@ -0,0 +1,231 @@
+import re
+
+from bs4 import BeautifulSoup
+
+from filters import TEST_TYPE_CODES
+
+try:
+    from lxml import etree
+    from lxml import html as lxml_html
+except ImportError:
+    lxml_html = None
+
+# Parsers for the catalog list pages and product detail pages.
+# parse_product_page uses lxml when it is installed: it looks up only the
+# h4 / p / div / meta nodes it needs and builds the full page text only when
+# the "Assessment length" block gave no duration. parse_product_page_soup is
+# the original BeautifulSoup version. It is used when lxml is missing, and
+# bench_parser.py checks that both return identical fields.
+SITE_URL = "https://www.shl.com"
+
+DURATION_H4_RE = re.compile(r'Assessment length|Time', re.I)
+DESCRIPTION_H4_RE = re.compile(r'Description', re.I)
+DIGITS_RE = re.compile(r'(\d+)')
+DURATION_TEXT_RE = re.compile(r'(?:Time|Duration).*?(\d+)\s*(?:min|minute)', re.I)
+DESCRIPTION_DIV_CLASS = "product-catalogue-training-calendar__row typ"
+
+# BeautifulSoup's get_text() leaves out comments and the strings of these tags
+_HIDDEN_TEXT_TAGS = frozenset(("script", "style", "template", "rt", "rp"))
+
+def parse_list_page(html):
+    products = []
+    soup = BeautifulSoup(html, 'html.parser')
+    rows = soup.find_all('tr', attrs={'data-entity-id': True})
+
+    for row in rows:
+        # 1. Title & URL
+        title_td = row.find('td', class_='custom__table-heading__title')
+        if not title_td: continue
+        link = title_td.find('a')
+        if not link: continue
+
+        title = link.get_text(strip=True)
+        href = link['href']
+        if not href.startswith('http'):
+            href = SITE_URL + href
+
+        # 2. Remote Support (2nd column, index 1)
+        cells = row.find_all('td')
+        remote_support = "No"
+        if len(cells) > 1:
+            circle = cells[1].find('span', class_='catalogue__circle -yes')
+            if circle:
+                remote_support = "Yes"
+
+        # 3. Adaptive Support (3rd column, index 2)
+        adaptive_support = "No"
+        if len(cells) > 2:
+            circle = cells[2].find('span', class_='catalogue__circle -yes')
+            if circle:
+                adaptive_support = "Yes"
+
+        # 4. Test Types
+        test_types = []
+        keys_td = row.find('td', class_='product-catalogue__keys')
+        if keys_td:
+            keys = keys_td.find_all('span', class_='product-catalogue__key')
+            test_types = [k.get_text(strip=True) for k in keys if k.get_text(strip=True)]
+
+        # Map key letters to full names (A=Ability, K=Knowledge, P=Personality, ...)
+        full_test_types = [TEST_TYPE_CODES.get(t, t) for t in test_types]
+
+        products.append({
+            "name": title,
+            "url": href,
+            "remote_support": remote_support,
+            "adaptive_support": adaptive_support,
+            "test_type": full_test_types,
+            "description": "", # To be filled
+            "duration": 0      # To be filled
+        })
+    return products
+
+def parse_product_page_soup(html, product):
+    soup = BeautifulSoup(html, 'html.parser')
+
+    # Duration
+    # <h4>Assessment length</h4> <p>... 49 ...</p>
+    duration = 0
+    h4_dur = soup.find('h4', string=DURATION_H4_RE)
+    if h4_dur:
+        p_next = h4_dur.find_next_sibling('p')
+        if p_next:
+            match = DIGITS_RE.search(p_next.get_text(strip=True))
+            if match:
+                duration = int(match.group(1))
+
+    if duration == 0:
+        # Fallback to regex in full text
+        match = DURATION_TEXT_RE.search(soup.get_text())
+        if match:
+            duration = int(match.group(1))
+
+    product['duration'] = duration
+
+    # Description
+    # <h4>Description</h4> <p>...</p>
+    desc = ""
+    h4_desc = soup.find('h4', string=DESCRIPTION_H4_RE)
+    if h4_desc:
+        p_next = h4_desc.find_next_sibling('p')
+        if p_next:
+            desc = p_next.get_text(strip=True)
+
+    if not desc:
+        # Fallback to .product-catalogue-training-calendar__row typ p (first paragraph)
+        container = soup.find('div', class_=DESCRIPTION_DIV_CLASS)
+        if container:
+            p_tag = container.find('p')
+            if p_tag:
+                 desc = p_tag.get_text(strip=True)
+
+    if not desc:
+        # Fallback to meta description
+        meta = soup.find('meta', attrs={'name': 'description'})
+        if meta:
+            desc = meta.get('content', '')
+
+    product['description'] = desc
+    return product
+
+def _strings(el):
+    # Text nodes in document order, skipping comments and hidden-text tags
+    if el.text:
+        yield el.text
+    for child in el:
+        if isinstance(child.tag, str) and child.tag not in _HIDDEN_TEXT_TAGS:
+            yield from _strings(child)
+        if child.tail:
+            yield child.tail
+
+def _text(el, strip=False):
+    # Tag.get_text() / get_text(strip=True); inside a hidden-text tag (e.g. a
+    # <p> in a <template>) BeautifulSoup returns nothing
+    if any(a.tag in _HIDDEN_TEXT_TAGS for a in el.iterancestors()):
+        return ""
+    if strip:
+        return "".join(s.strip() for s in _strings(el))
+    return "".join(_strings(el))
+
+def _string(el):
+    # Tag.string: the text of the only child node, looking through single-child tags
+    children = list(el)
+    if el.text:
+        return None if children else el.text
+    if len(children) != 1 or children[0].tail:
+        return None
+    child = children[0]
+    if not isinstance(child.tag, str):
+        return child.text
+    return _string(child)
+
+def _find_h4(root, pattern):
+    for h4 in root.iter('h4'):
+        string = _string(h4)
+        if string is not None and pattern.search(string):
+            return h4
+    return None
+
+def _next_sibling_p(el):
+    for sibling in el.itersiblings():
+        if sibling.tag == 'p':
+            return sibling
+    return None
+
+def _parse_document(html):
+    try:
+        return lxml_html.document_fromstring(html)
+    except ValueError:
+        # lxml refuses str input that carries an XML encoding declaration
+        return lxml_html.document_fromstring(html.encode("utf-8"))
+
+def parse_product_page(html, product):
+    if lxml_html is None:
+        return parse_product_page_soup(html, product)
+    try:
+        root = _parse_document(html)
+    except etree.ParserError:
+        # Empty or unparseable document
+        return parse_product_page_soup(html, product)
+
+    duration = 0
+    h4_dur = _find_h4(root, DURATION_H4_RE)
+    if h4_dur is not None:
+        p_next = _next_sibling_p(h4_dur)
+        if p_next is not None:
+            match = DIGITS_RE.search(_text(p_next, strip=True))
+            if match:
+                duration = int(match.group(1))
+
+    if duration == 0:
+        # Full page text only when the structured block gave nothing
+        match = DURATION_TEXT_RE.search(_text(root))
+        if match:
+            duration = int(match.group(1))
+
+    product['duration'] = duration
+
+    desc = ""
+    h4_desc = _find_h4(root, DESCRIPTION_H4_RE)
+    if h4_desc is not None:
+        p_next = _next_sibling_p(h4_desc)
+        if p_next is not None:
+            desc = _text(p_next, strip=True)
+
+    if not desc:
+        for div in root.iter('div'):
+            # class_ with a space matches the whole (whitespace-normalized) attribute
+            if " ".join(div.get('class', '').split()) == DESCRIPTION_DIV_CLASS:
+                p_tag = next(div.iter('p'), None)
+                if p_tag is not None:
+                    desc = _text(p_tag, strip=True)
+                break
+
+    if not desc:
+        for meta in root.iter('meta'):
+            if meta.get('name') == 'description':
+                desc = meta.get('content', '')
+                break
+
+    product['description'] = desc
+    return product
@@ -1,13 +1,132 @@
-
+import argparse
 import json
-from sentence_transformers import SentenceTransformer
-import pickle
 import os
 
+import numpy as np
+
+from ann_index import build_ivf, ivf_manifest
+from dedup import DUP_THRESHOLD, SLUG_THRESHOLD, collapse_duplicates, dedup_manifest, find_duplicates
+from encoders import ENCODER_BACKEND, get_encoder
+from index_store import (CONTENT_HASH_ARRAY, INDEX_DIR, MODEL_NAME, VARIANT_HASH_ARRAY, content_hashes, load_array,
+                         normalize_rows, product_text, reusable_vectors, save_index)
+from knn_graph import KNN_ARRAYS, build_knn, knn_manifest
+from lexical_index import bm25_manifest, build_bm25
+from quantize import QUANTIZED_DTYPES, quantize, quantize_manifest
+
 INPUT_FILE = "shl_products.json"
-OUTPUT_FILE = "product_embeddings.pkl"
+OUTPUT_DIR = INDEX_DIR
 
-def create_embeddings():
+def embed_products(products, full=False, spooled=None):
+    # Returns (embeddings, hashes, backend, previous) where previous is the
+    # (matrix, manifest) of the index being replaced, or (None, None).
+    # Reuse vectors of products whose embedding text is unchanged (an index
+    # from another model or encoder backend is not reused at all);
+    # only new or edited products go through the encoder. `spooled` is an
+    # optional ({hash: row}, matrix) of vectors encoded earlier (pipeline.py).
+    hashes = content_hashes(products, MODEL_NAME)
+    if full:
+        known, previous, previous_manifest = {}, None, None
+    else:
+        known, previous, previous_manifest = reusable_vectors(OUTPUT_DIR, MODEL_NAME, ENCODER_BACKEND)
+    spool_rows, spool = spooled or ({}, None)
+    keys = hashes.tolist()
+    from_spool = np.array([spool_rows.get(h, -1) for h in keys], dtype=np.int64)
+    reuse = np.array([-1 if s >= 0 else known.get(h, -1) for h, s in zip(keys, from_spool)], dtype=np.int64)
+    todo = np.flatnonzero((reuse < 0) & (from_spool < 0))
+    removed = len(known) - len(set(reuse[reuse >= 0].tolist()))
+    print(f"Reusing {int((reuse >= 0).sum())} vectors, {int((from_spool >= 0).sum())} already encoded, "
+          f"encoding {len(todo)}, dropping {removed}.")
+    
+    dimension = previous.shape[1] if previous is not None else (spool.shape[1] if spool is not None else None)
+    backend = ENCODER_BACKEND
+    new_vectors = None
+    if len(todo):
+        model = get_encoder()
+        backend = model.backend
+        print("Generating embeddings...")
+        new_vectors = normalize_rows(model.encode([product_text(products[i]) for i in todo], show_progress_bar=True))
+        print("Embeddings generated.")
+        dimension = new_vectors.shape[1]
+    
+    embeddings = np.empty((len(products), dimension or 0), dtype=np.float32)
+    kept = np.flatnonzero(reuse >= 0)
+    if len(kept):
+        # Sorted source rows keep the read from the memory-mapped matrix sequential
+        order = np.argsort(reuse[kept], kind="stable")
+        embeddings[kept[order]] = previous[reuse[kept][order]]
+    spooled_rows = np.flatnonzero(from_spool >= 0)
+    if len(spooled_rows):
+        embeddings[spooled_rows] = spool[from_spool[spooled_rows]]
+    if new_vectors is not None:
+        embeddings[todo] = new_vectors
+    return embeddings, hashes, backend, (previous, previous_manifest)
+
+def write_index(products, embeddings, hashes, backend, previous=(None, None), ivf=False, ivf_lists=None, ivf_iters=20,
+                quantize_dtype=None, full=False, knn_neighbors=0, dedup=False,
+                dedup_threshold=DUP_THRESHOLD):
+    previous, previous_manifest = previous
+    variant_arrays, dedup_extra = {}, {}
+    if dedup:
+        # Fold near-duplicate products into one canonical row each (see dedup.py)
+        clusters = find_duplicates(products, embeddings, dedup_threshold, SLUG_THRESHOLD)
+        products, embeddings, hashes, variant_arrays = collapse_duplicates(products, embeddings, hashes, clusters)
+        dedup_extra = dedup_manifest(clusters, dedup_threshold, SLUG_THRESHOLD)
+        print(f"Collapsed {len(variant_arrays[VARIANT_HASH_ARRAY])} near-duplicates into {len(clusters)} products.")
+    arrays, extra = {CONTENT_HASH_ARRAY: hashes, **variant_arrays}, {"encoder_backend": backend, **dedup_extra}
+    if ivf:
+        # Optional IVF coarse clustering for large catalogs (see ann_index.py)
+        # Existing centroids are kept (rows are only re-assigned) unless the
+        # list count changes or --full is given
+        centroids = None
+        if previous is not None and not full:
+            centroids = load_array("ivf_centroids", OUTPUT_DIR, previous_manifest, mmap=False)
+            if centroids is not None and ivf_lists and len(centroids) != ivf_lists:
+                centroids = None
+        print("Building IVF index..." if centroids is None else "Re-assigning rows to existing IVF lists...")
+        ivf_arrays = build_ivf(embeddings, n_lists=ivf_lists, n_iter=ivf_iters, centroids=centroids)
+        arrays.update(ivf_arrays)
+        extra.update(ivf_manifest(ivf_arrays, ivf_iters, 0))
+        print(f"IVF built with {len(ivf_arrays['ivf_centroids'])} lists.")
+    
+    # BM25 keyword postings for lexical / hybrid search
+    bm25 = build_bm25(products)
+    arrays.update(bm25)
+    extra.update(bm25_manifest(bm25))
+    
+    if knn_neighbors:
+        # Top neighbours of every product for GET /similar (see knn_graph.py).
+        # O(rows^2), so the previous table is kept when the rows are unchanged:
+        # same content hashes in the same order means the same reused vectors.
+        knn = None
+        if previous is not None and not full:
+            old_hashes = load_array(CONTENT_HASH_ARRAY, OUTPUT_DIR, previous_manifest)
+            if old_hashes is not None and np.array_equal(old_hashes, hashes):
+                knn = {name: load_array(name, OUTPUT_DIR, previous_manifest, mmap=False) for name in KNN_ARRAYS}
+                if any(a is None for a in knn.values()) or \
+                        knn["knn_ids"].shape[1] != max(0, min(knn_neighbors, len(embeddings) - 1)):
+                    knn = None
+        if knn is None:
+            print("Building nearest-neighbour table...")
+            knn = build_knn(embeddings, knn_neighbors)
+        else:
+            print("Rows unchanged; keeping the nearest-neighbour table.")
+        arrays.update(knn)
+        extra.update(knn_manifest(knn))
+    
+    if quantize_dtype:
+        # Compressed copy for the first-pass scan; float32 is kept for re-ranking
+        arrays.update(quantize(embeddings, quantize_dtype))
+        extra.update(quantize_manifest(quantize_dtype))
+        print(f"Added {quantize_dtype} matrix.")
+    
+    # Save normalized float32 matrix + metadata + manifest
+    manifest = save_index(products, embeddings, model_name=MODEL_NAME, index_dir=OUTPUT_DIR, arrays=arrays, extra=extra)
+        
+    print(f"Saved {manifest['rows']} x {manifest['dimension']} index to {OUTPUT_DIR}/")
+    return manifest
+
+def create_embeddings(ivf=False, ivf_lists=None, ivf_iters=20, quantize_dtype=None, full=False,
+                      knn_neighbors=0, dedup=False, dedup_threshold=DUP_THRESHOLD):
     if not os.path.exists(INPUT_FILE):
         print(f"File {INPUT_FILE} not found. Please run scrape_catalog_full.py first.")
         return
@@ -17,38 +136,26 @@ def create_embeddings():
     
     print(f"Loaded {len(products)} products.")
     
-    model = SentenceTransformer('all-MiniLM-L6-v2')
-    
-    sentences = []
-    for p in products:
-        # Create a rich representation for embedding
-        # Title + Test Types + Description (truncated)
-        text = p.get('name', '')
-        
-        types = p.get('test_type', [])
-        if types:
-            text += " " + " ".join(types)
-            
-        desc = p.get('description', '')
-        if desc:
-            text += " " + desc
-            
-        sentences.append(text)
-        
-    print("Generating embeddings...")
-    embeddings = model.encode(sentences, show_progress_bar=True)
-    print("Embeddings generated.")
-    
-    # Save combined data
-    data_with_embeddings = []
-    for i, p in enumerate(products):
-        p['vector'] = embeddings[i]
-        data_with_embeddings.append(p)
-        
-    with open(OUTPUT_FILE, "wb") as f:
-        pickle.dump(data_with_embeddings, f)
-        
-    print(f"Saved to {OUTPUT_FILE}")
+    embeddings, hashes, backend, previous = embed_products(products, full=full)
+    write_index(products, embeddings, hashes, backend, previous, ivf=ivf, ivf_lists=ivf_lists, ivf_iters=ivf_iters,
+                quantize_dtype=quantize_dtype, full=full, knn_neighbors=knn_neighbors, dedup=dedup,
+                dedup_threshold=dedup_threshold)
 
 if __name__ == "__main__":
-    create_embeddings()
+    parser = argparse.ArgumentParser(description="Encode shl_products.json into the product index.")
+    parser.add_argument("--ivf", action="store_true", help="also build an IVF index for approximate search")
+    parser.add_argument("--ivf-lists", type=int, default=None, help="IVF clusters (default: 4*sqrt(rows))")
+    parser.add_argument("--ivf-iters", type=int, default=20, help="k-means iterations")
+    parser.add_argument("--quantize", choices=QUANTIZED_DTYPES, default=None, help="also store an int8 matrix (4x smaller, about as fast as float32) or a "
+                        "float16 one (2x smaller, memory-only: slower scans) to scan instead of float32")
+    parser.add_argument("--full", action="store_true", help="re-encode every product instead of reusing unchanged vectors")
+    parser.add_argument("--knn-neighbors", type=int, default=0,
+                        help="store this many similar products per product for /similar, e.g. 50 "
+                             "(default 0: no table, /similar scans)")
+    parser.add_argument("--dedup", action="store_true", help="collapse near-duplicate products into one row each")
+    parser.add_argument("--dedup-threshold", type=float, default=DUP_THRESHOLD,
+                        help="cosine similarity at which two products count as duplicates")
+    args = parser.parse_args()
+    create_embeddings(ivf=args.ivf, ivf_lists=args.ivf_lists, ivf_iters=args.ivf_iters, quantize_dtype=args.quantize,
+                      full=args.full, knn_neighbors=args.knn_neighbors, dedup=args.dedup,
+                      dedup_threshold=args.dedup_threshold)
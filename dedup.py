@@ -0,0 +1,177 @@
+import argparse
+import re
+
+import numpy as np
+
+from index_store import INDEX_DIR, VARIANT_EMBEDDINGS_ARRAY, VARIANT_HASH_ARRAY, load_index, product_slug
+
+# Near-duplicate collapsing at index build time (create_embeddings.py --dedup).
+# Candidate pairs come from two blocking keys instead of all pairs:
+#   - random-hyperplane LSH: the sign bits of `bands` x `bits` random
+#     projections of each vector, split into bands; rows that agree on every
+#     bit of some band share a bucket
+#   - the normalized URL slug, with variant suffixes such as "-new", "-v1",
+#     "-uk" or "-4-5" stripped
+# Only pairs inside a bucket are compared, with one small matrix product per
+# bucket, so the cost stays near-linear in the catalog size. A pair is a
+# duplicate when its cosine similarity reaches `threshold`, or `slug_threshold`
+# if the normalized slugs match. Clusters (complete linkage over those pairs)
+# collapse into one canonical row whose record lists the others under
+# "variants"; their vectors are kept as variant_embeddings / variant_hashes so
+# rebuilds reuse them.
+# Thresholds were tuned on the shipped 377-product catalog (MiniLM vectors).
+# Similarity alone does not separate duplicates there: distinct products such
+# as "Automata" / "Automata Pro" or "Graduate Scenarios" / "... Profile
+# Report" reach 0.98-0.995, while regional copies and editions sit at
+# 0.75-0.99. So the similarity-only threshold is kept for near-identical
+# texts, and folding relies on matching normalized slugs. The dry run then
+# folds 4 pairs (1.0 / 2.0 report editions, UK / US "Following
+# Instructions"); UK / US "Visual Comparison" (0.88) and "OPQ Premium Plus
+# Report" / "... 2.0" (0.79) stay separate, as do same-slug products that
+# differ more, e.g. "Reading Comprehension - English v1" / "... v2" (0.74).
+DUP_THRESHOLD = 0.999
+SLUG_THRESHOLD = 0.90
+LSH_BITS = 16
+LSH_BANDS = 16
+SIGNATURE_BLOCK_ROWS = 65536
+BUCKET_BLOCK_CELLS = 1 << 24
+
+VARIANT_TOKENS = {"new", "legacy", "old", "uk", "us", "usa", "au", "international", "english", "global"}
+# Short numbers only: long numeric suffixes ("c-programming-new-4039") are
+# catalog ids of different products, not versions
+VERSION_RE = re.compile(r"v?\d{1,2}|r\d+")
+
+
+def normalized_slug(p):
+    # "java-8-new" -> "java", "following-instructions-v1-uk-r1" -> "following-instructions"
+    tokens = product_slug(p).split("-")
+    while len(tokens) > 1 and (tokens[-1] in VARIANT_TOKENS or VERSION_RE.fullmatch(tokens[-1])):
+        tokens.pop()
+    return "-".join(tokens)
+
+
+def lsh_codes(embeddings, bits=LSH_BITS, bands=LSH_BANDS, seed=0):
+    # (rows, bands) bucket id of every row in every band
+    rng = np.random.default_rng(seed)
+    planes = rng.standard_normal((bands * bits, embeddings.shape[1])).astype(np.float32)
+    weights = np.int64(1) << np.arange(bits, dtype=np.int64)
+    codes = np.empty((len(embeddings), bands), dtype=np.int64)
+    for start in range(0, len(embeddings), SIGNATURE_BLOCK_ROWS):
+        block = np.asarray(embeddings[start:start + SIGNATURE_BLOCK_ROWS], dtype=np.float32)
+        signs = (block @ planes.T > 0).reshape(len(block), bands, bits)
+        codes[start:start + len(block)] = (signs * weights).sum(axis=2)
+    return codes
+
+
+def _buckets(keys):
+    # Groups (arrays of rows, size >= 2) of equal keys
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    bounds = np.flatnonzero(sorted_keys[1:] != sorted_keys[:-1]) + 1
+    return [g for g in np.split(order, bounds) if len(g) > 1]
+
+
+def _canonical_key(products, row):
+    # Prefer complete records, then "(New)" editions, then short slugs, then catalog order
+    p = products[row]
+    slug = product_slug(p)
+    return (bool(p.get('description')), "new" in slug.split("-"), bool(p.get('duration')), -len(slug), -row)
+
+
+def find_duplicates(products, embeddings, threshold=DUP_THRESHOLD, slug_threshold=SLUG_THRESHOLD,
+                    bits=LSH_BITS, bands=LSH_BANDS, seed=0):
+    # Returns clusters as lists of rows, canonical row first
+    groups = [(g, threshold) for band in lsh_codes(embeddings, bits, bands, seed).T for g in _buckets(band)]
+    slug_ids = {}
+    slug_keys = np.array([slug_ids.setdefault(normalized_slug(p), len(slug_ids)) for p in products], dtype=np.int64)
+    groups += [(g, min(threshold, slug_threshold)) for g in _buckets(slug_keys)]
+
+    # {(i, j): similarity} of every pair that cleared its bucket's threshold
+    pairs = {}
+    for members, min_sim in groups:
+        members = np.sort(members)
+        block = np.asarray(embeddings[members], dtype=np.float32)
+        # Row slabs keep memory bounded when a bucket is unexpectedly large
+        step = max(1, BUCKET_BLOCK_CELLS // len(members))
+        for start in range(0, len(members), step):
+            sims = block[start:start + step] @ block.T
+            rows, cols = np.nonzero(sims >= min_sim)
+            upper = rows + start < cols
+            for a, b in zip(rows[upper], cols[upper]):
+                pairs[(int(members[a + start]), int(members[b]))] = float(sims[a, b])
+
+    # Complete linkage, strongest pairs first: two clusters merge only if every
+    # cross pair clears its own threshold (slug_threshold only where the
+    # normalized slugs match), so chains of "similar to a similar product"
+    # cannot snowball into one large cluster
+    slug_min = min(threshold, slug_threshold)
+    root, clusters = {}, {}
+    for i, j in sorted(pairs, key=lambda pair: -pairs[pair]):
+        ri, rj = root.get(i, i), root.get(j, j)
+        if ri == rj:
+            continue
+        a, b = clusters.get(ri, [ri]), clusters.get(rj, [rj])
+        if len(a) * len(b) > 1:
+            cross = np.asarray(embeddings[a], dtype=np.float32) @ np.asarray(embeddings[b], dtype=np.float32).T
+            same_slug = slug_keys[a][:, None] == slug_keys[b][None, :]
+            if (cross < np.where(same_slug, slug_min, threshold)).any():
+                continue
+        clusters.pop(ri, None)
+        clusters.pop(rj, None)
+        merged = clusters[min(ri, rj)] = a + b
+        for row in merged:
+            root[row] = min(ri, rj)
+
+    result = []
+    for rows in clusters.values():
+        rows = sorted(rows)
+        canonical = max(rows, key=lambda r: _canonical_key(products, r))
+        result.append([canonical] + [r for r in rows if r != canonical])
+    return sorted(result, key=lambda c: c[0])
+
+
+def collapse_duplicates(products, embeddings, hashes, clusters):
+    # Keeps canonical rows in catalog order; returns (products, embeddings,
+    # hashes, variant arrays) with the folded rows' records under "variants"
+    variant_of = {}
+    for cluster in clusters:
+        for row in cluster[1:]:
+            variant_of[row] = cluster[0]
+    variants = {}
+    for row in sorted(variant_of):
+        record = {k: v for k, v in products[row].items() if k != 'variants'}
+        variants.setdefault(variant_of[row], []).append(record)
+
+    keep = np.array([row for row in range(len(products)) if row not in variant_of], dtype=np.intp)
+    folded = np.array(sorted(variant_of), dtype=np.intp)
+    collapsed = []
+    for row in keep.tolist():
+        p = products[row]
+        if row in variants:
+            p = {**p, 'variants': variants[row]}
+        collapsed.append(p)
+    arrays = {
+        VARIANT_HASH_ARRAY: np.asarray(hashes)[folded],
+        VARIANT_EMBEDDINGS_ARRAY: np.asarray(embeddings[folded], dtype=np.float32).reshape(len(folded), embeddings.shape[1]),
+    }
+    return collapsed, np.asarray(embeddings[keep], dtype=np.float32), np.asarray(hashes)[keep], arrays
+
+
+def dedup_manifest(clusters, threshold, slug_threshold):
+    return {"dedup": {"clusters": len(clusters), "variants": sum(len(c) - 1 for c in clusters),
+                      "threshold": threshold, "slug_threshold": slug_threshold}}
+
+
+if __name__ == "__main__":
+    # Dry run against an existing index: list the clusters --dedup would collapse
+    parser = argparse.ArgumentParser(description="List near-duplicate product clusters in a product index.")
+    parser.add_argument("index_dir", nargs="?", default=INDEX_DIR)
+    parser.add_argument("--threshold", type=float, default=DUP_THRESHOLD)
+    parser.add_argument("--slug-threshold", type=float, default=SLUG_THRESHOLD)
+    args = parser.parse_args()
+
+    products, embeddings, _ = load_index(args.index_dir)
+    clusters = find_duplicates(products, embeddings, args.threshold, args.slug_threshold)
+    for cluster in clusters:
+        print(" | ".join(products[r].get('name', '?') for r in cluster))
+    print(f"{len(clusters)} clusters, {sum(len(c) - 1 for c in clusters)} of {len(products)} rows would be folded.")
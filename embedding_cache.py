@@ -0,0 +1,62 @@
+import hashlib
+import os
+
+import numpy as np
+
+from encoders import CHUNK_OVERLONG, CHUNK_STRIDE, ENCODER_BACKEND, MAX_CHUNKS, ONNX_MODEL_DIR, get_encoder
+from index_store import MODEL_NAME, normalize_rows
+from pipeline import VectorSpool
+
+# Persistent text -> unit vector store for offline experiments
+# (evaluate_model.py, evaluate_sweep.py). Vectors are appended to a
+# VectorSpool (the pipeline's crash-safe vectors.f32 + vectors.idx files) in
+# one subdirectory per encoder, keyed by a hash of the text, so queries and
+# product texts are encoded once per encoder and re-runs skip the model.
+CACHE_DIR = "embedding_cache"
+
+
+def encoder_key(backend=None):
+    # Everything that changes the vector of a given text
+    backend = backend or ENCODER_BACKEND
+    key = f"{MODEL_NAME}/{backend}"
+    if backend != "torch":
+        key += f"/{os.path.abspath(ONNX_MODEL_DIR)}"
+    if CHUNK_OVERLONG:
+        key += f"/chunks-{CHUNK_STRIDE}-{MAX_CHUNKS}"
+    return key
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:32].encode("ascii")
+
+
+class EmbeddingCache:
+    def __init__(self, cache_dir=CACHE_DIR, backend=None):
+        self.backend = backend or ENCODER_BACKEND
+        self.key = encoder_key(self.backend)
+        self.path = os.path.join(cache_dir, hashlib.sha256(self.key.encode("utf-8")).hexdigest()[:12])
+        os.makedirs(self.path, exist_ok=True)
+        self.spool = VectorSpool(self.path, self.key)
+        self.model = None
+        self.hits = 0
+        self.misses = 0
+
+    def encode(self, texts):
+        # (len(texts), dim) unit vectors; only texts not seen before hit the model
+        texts = list(texts)
+        hashes = [text_hash(t) for t in texts]
+        todo = {}
+        for h, t in zip(hashes, texts):
+            if h not in self.spool.rows and h not in todo:
+                todo[h] = t
+        self.misses += len(todo)
+        self.hits += len(texts) - len(todo)
+        if todo:
+            if self.model is None:
+                self.model = get_encoder(self.backend)
+            vectors = normalize_rows(self.model.encode(list(todo.values()), show_progress_bar=len(todo) > 256))
+            self.spool.append(list(todo), vectors)
+        matrix = self.spool.matrix()
+        if matrix is None:
+            return np.empty((0, 0), dtype=np.float32)
+        return matrix[[self.spool.rows[h] for h in hashes]]
@@ -0,0 +1,246 @@
+import json
+import os
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+from index_store import MODEL_NAME
+
+# Query/product encoders behind one interface: encode(texts, batch_size=32,
+# show_progress_bar=False, convert_to_numpy=True) -> (n, dim) float32, or
+# with return_truncated=True also a per-text list of truncation flags.
+# Selected with ENCODER_BACKEND:
+#   torch      - sentence-transformers on PyTorch (default)
+#   onnx       - the same MiniLM exported by export_onnx.py, on ONNX Runtime
+#   onnx-int8  - dynamically int8-quantized export, on ONNX Runtime
+# The ONNX backends import neither torch nor sentence-transformers.
+ENCODER_BACKENDS = ("torch", "onnx", "onnx-int8")
+ENCODER_BACKEND = os.environ.get("ENCODER_BACKEND", "torch")
+ONNX_MODEL_DIR = os.environ.get("ONNX_MODEL_DIR", "onnx_model")
+
+# Texts longer than the model's token budget are truncated (and counted) by
+# default. With ENCODER_CHUNK_OVERLONG=1 they are split into overlapping
+# windows of max_seq_length tokens (ENCODER_CHUNK_STRIDE tokens of overlap,
+# at most ENCODER_MAX_CHUNKS windows) whose vectors are averaged.
+CHUNK_OVERLONG = os.environ.get("ENCODER_CHUNK_OVERLONG", "0") == "1"
+CHUNK_STRIDE = int(os.environ.get("ENCODER_CHUNK_STRIDE", "32"))
+MAX_CHUNKS = int(os.environ.get("ENCODER_MAX_CHUNKS", "8"))
+
+ONNX_MODEL_FILE = "model.onnx"
+ONNX_INT8_MODEL_FILE = "model_int8.onnx"
+ENCODER_CONFIG_FILE = "encoder_config.json"
+TOKENIZER_FILE = "tokenizer.json"
+
+
+def pre_truncate(text, max_words):
+    # Every whitespace-separated word is at least one token, so keeping the
+    # first max_words words never cuts into the token budget; the tokenizer
+    # then never sees the rest of a pasted job description.
+    words = str(text).split(None, max_words)
+    if len(words) <= max_words:
+        return str(text), False
+    return " ".join(words[:max_words]), True
+
+
+class Encoder(ABC):
+    # Shared batching: tokenize once, sort windows by token length, encode in
+    # batches padded only to their own longest window, restore input order.
+    backend = None
+    model_name = None
+    max_seq_length = 256
+    pad_token_id = 0
+    dimension = 0
+
+    def __init__(self, chunk_overlong=CHUNK_OVERLONG, chunk_stride=CHUNK_STRIDE, max_chunks=MAX_CHUNKS):
+        self.chunk_overlong = chunk_overlong
+        self.chunk_stride = chunk_stride
+        self.max_chunks = max_chunks
+        self.counters = {"texts": 0, "truncated": 0, "chunked": 0, "windows": 0, "tokens": 0, "padded_tokens": 0}
+
+    @abstractmethod
+    def tokenize(self, texts, stride):
+        # -> per text, a list of (ids, type_ids) windows; the first is the truncated text
+        ...
+
+    @abstractmethod
+    def forward(self, input_ids, attention_mask, token_type_ids):
+        # -> (batch, dim) pooled sentence embeddings
+        ...
+
+    def encode(self, texts, batch_size=32, show_progress_bar=False, convert_to_numpy=True, return_truncated=False):
+        # return_truncated: also return which of *these* texts were cut; the
+        # counters are process-wide and shared by concurrent callers
+        texts = list(texts)
+        if not texts:
+            vectors = np.empty((0, self.dimension), dtype=np.float32)
+            return (vectors, []) if return_truncated else vectors
+
+        max_windows = self.max_chunks if self.chunk_overlong else 1
+        cut = [pre_truncate(t, self.max_seq_length * max_windows) for t in texts]
+        windows = self.tokenize([t for t, _ in cut], self.chunk_stride if self.chunk_overlong else 0)
+
+        owners, flat, flags = [], [], []
+        chunked = 0
+        for i, text_windows in enumerate(windows):
+            flags.append(cut[i][1] or len(text_windows) > max_windows)
+            keep = text_windows[:max_windows]
+            chunked += len(keep) > 1
+            owners.extend([i] * len(keep))
+            flat.extend(keep)
+
+        lengths = np.array([len(ids) for ids, _ in flat], dtype=np.int64)
+        order = np.argsort(lengths, kind="stable")
+        vectors = np.empty((len(flat), self.dimension), dtype=np.float32)
+        batches = range(0, len(order), batch_size)
+        if show_progress_bar:
+            try:
+                from tqdm import tqdm
+                batches = tqdm(batches, desc="Batches")
+            except ImportError:
+                pass
+        padded = 0
+        for start in batches:
+            rows = order[start:start + batch_size]
+            width = int(lengths[rows].max())
+            input_ids = np.full((len(rows), width), self.pad_token_id, dtype=np.int64)
+            token_type_ids = np.zeros((len(rows), width), dtype=np.int64)
+            attention_mask = np.zeros((len(rows), width), dtype=np.int64)
+            for r, row in enumerate(rows):
+                ids, type_ids = flat[row]
+                input_ids[r, :len(ids)] = ids
+                token_type_ids[r, :len(ids)] = type_ids
+                attention_mask[r, :len(ids)] = 1
+            vectors[rows] = self.forward(input_ids, attention_mask, token_type_ids)
+            padded += input_ids.size
+
+        truncated = sum(flags)
+        self.counters["texts"] += len(texts)
+        self.counters["truncated"] += truncated
+        self.counters["chunked"] += chunked
+        self.counters["windows"] += len(flat)
+        self.counters["tokens"] += int(lengths.sum())
+        self.counters["padded_tokens"] += padded
+        if truncated:
+            print(f"Truncated {truncated} of {len(texts)} texts to {max_windows} x {self.max_seq_length} tokens.")
+
+        if chunked:
+            # Chunked texts: token-weighted mean of their window vectors, re-normalized
+            owners = np.array(owners, dtype=np.int64)
+            weights = lengths.astype(np.float32)
+            pooled = np.zeros((len(texts), self.dimension), dtype=np.float32)
+            np.add.at(pooled, owners, vectors * weights[:, None])
+            pooled /= np.bincount(owners, weights=weights, minlength=len(texts)).astype(np.float32)[:, None]
+            vectors = pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+        return (vectors, flags) if return_truncated else vectors
+
+    def stats(self):
+        padded = self.counters["padded_tokens"]
+        return {
+            "backend": self.backend,
+            "max_seq_length": self.max_seq_length,
+            "chunk_overlong": self.chunk_overlong,
+            **self.counters,
+            # Share of computed token positions that were real tokens, not padding
+            "padding_efficiency": round(self.counters["tokens"] / padded, 4) if padded else None,
+        }
+
+
+class TorchEncoder(Encoder):
+    backend = "torch"
+
+    def __init__(self, model_name=MODEL_NAME, device='cpu', threads=None, **kwargs):
+        super().__init__(**kwargs)
+        # sentence_transformers pulls in torch; import it only for this backend
+        import torch
+        from sentence_transformers import SentenceTransformer
+        self.torch = torch
+        if threads:
+            torch.set_num_threads(threads)
+        self.device = device
+        self.model_name = model_name
+        self.model = SentenceTransformer(model_name, device=device).eval()
+        self.max_seq_length = self.model.max_seq_length
+        self.tokenizer = self.model.tokenizer
+        self.pad_token_id = self.tokenizer.pad_token_id or 0
+        self.dimension = self.model[0].auto_model.config.hidden_size
+
+    def tokenize(self, texts, stride):
+        features = self.tokenizer(texts, truncation=True, max_length=self.max_seq_length, stride=stride,
+                                  return_overflowing_tokens=True, return_token_type_ids=True)
+        windows = [[] for _ in texts]
+        for ids, type_ids, owner in zip(features["input_ids"], features["token_type_ids"],
+                                        features["overflow_to_sample_mapping"]):
+            windows[owner].append((ids, type_ids))
+        return windows
+
+    def forward(self, input_ids, attention_mask, token_type_ids):
+        torch = self.torch
+        features = {
+            "input_ids": torch.from_numpy(input_ids).to(self.device),
+            "attention_mask": torch.from_numpy(attention_mask).to(self.device),
+            "token_type_ids": torch.from_numpy(token_type_ids).to(self.device),
+        }
+        with torch.inference_mode():
+            return self.model(features)["sentence_embedding"].float().cpu().numpy()
+
+    def set_threads(self, threads):
+        # Intra-op threads for this process (torch's setting is process-wide)
+        self.torch.set_num_threads(threads)
+
+
+class OnnxEncoder(Encoder):
+    def __init__(self, model_dir=ONNX_MODEL_DIR, quantized=False, intra_op_threads=None, warn=True, **kwargs):
+        super().__init__(**kwargs)
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        with open(os.path.join(model_dir, ENCODER_CONFIG_FILE), "r") as f:
+            self.config = json.load(f)
+        self.backend = "onnx-int8" if quantized else "onnx"
+        parity = self.config.get("parity", {}).get(self.backend)
+        if warn and not (parity and parity.get("passed")):
+            print(f"Warning: no passing parity check recorded for {self.backend} in {model_dir}. "
+                  f"Run 'python export_onnx.py --check'.")
+
+        self.model_name = self.config.get("model_name")
+        self.max_seq_length = self.config["max_seq_length"]
+        self.dimension = self.config["dimension"]
+        self.pad_token_id = self.config.get("pad_token_id", 0)
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, TOKENIZER_FILE))
+        self.tokenizer.no_padding()
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads:
+            options.intra_op_num_threads = intra_op_threads
+        model_file = ONNX_INT8_MODEL_FILE if quantized else ONNX_MODEL_FILE
+        self.session = ort.InferenceSession(os.path.join(model_dir, model_file), options,
+                                            providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    def tokenize(self, texts, stride):
+        self.tokenizer.enable_truncation(max_length=self.max_seq_length, stride=stride)
+        return [[(e.ids, e.type_ids) for e in [encoding] + encoding.overflowing]
+                for encoding in self.tokenizer.encode_batch(texts)]
+
+    def forward(self, input_ids, attention_mask, token_type_ids):
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self.input_names:
+            feeds["token_type_ids"] = token_type_ids
+        token_embeddings = self.session.run(None, feeds)[0]
+        # Mean pooling over real tokens + L2 normalize, as the sentence-transformers pipeline does
+        mask = attention_mask[:, :, None].astype(np.float32)
+        pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        if self.config.get("normalize", True):
+            pooled = pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+        return pooled.astype(np.float32)
+
+
+def get_encoder(backend=None, model_name=MODEL_NAME, onnx_dir=ONNX_MODEL_DIR, threads=None):
+    # threads: intra-op threads (None = the runtime's default, all cores)
+    backend = backend or ENCODER_BACKEND
+    if backend == "torch":
+        return TorchEncoder(model_name, threads=threads)
+    if backend in ("onnx", "onnx-int8"):
+        return OnnxEncoder(onnx_dir, quantized=backend == "onnx-int8", intra_op_threads=threads)
+    raise ValueError(f"Unknown ENCODER_BACKEND {backend!r}; expected one of {ENCODER_BACKENDS}.")
@@ -1,12 +1,15 @@
 
 import pandas as pd
-from sentence_transformers import SentenceTransformer
-import pickle
 import numpy as np
-import os
+import time
 from collections import defaultdict
 
-EMBEDDINGS_FILE = "product_embeddings.pkl"
+from ann_index import DEFAULT_NPROBE, IVFIndex, build_ivf
+from embedding_cache import EmbeddingCache
+from index_store import INDEX_DIR, index_exists
+from quantize import QUANTIZED_DTYPES, QuantizedMatrix, quantize
+from retriever import Retriever
+
 DATASET_FILE = "Gen_AI Dataset.xlsx"
 
 def get_slug(url):
@@ -15,30 +18,16 @@ def get_slug(url):
     url = url.strip().rstrip('/')
     return url.split('/')[-1].lower()
 
-def evaluate_recall():
-    if not os.path.exists(EMBEDDINGS_FILE):
-        print("Embeddings file not found.")
-        return
+def product_slugs(p):
+    # A row collapsed by create_embeddings.py --dedup also answers for its variants
+    return {get_slug(v['url']) for v in [p] + p.get('variants', [])}
 
-    print("Loading resources...")
-    with open(EMBEDDINGS_FILE, "rb") as f:
-        products = pickle.load(f)
-    
-    # Precompute slugs for products
-    for p in products:
-        p['slug'] = get_slug(p['url'])
-        
-    embeddings_matrix = np.array([p['vector'] for p in products])
-    norm = np.linalg.norm(embeddings_matrix, axis=1, keepdims=True)
-    embeddings_matrix = embeddings_matrix / (norm + 1e-9)
-    
-    model = SentenceTransformer('all-MiniLM-L6-v2') 
-    
-    print("Loading Train Set...")
+def load_query_groups(dataset_file=DATASET_FILE):
+    # {query: set of relevant product slugs} from the labelled train set
     try:
-        df = pd.read_excel(DATASET_FILE, sheet_name='Train-Set')
+        df = pd.read_excel(dataset_file, sheet_name='Train-Set')
     except:
-        df = pd.read_excel(DATASET_FILE, sheet_name='Train Set')
+        df = pd.read_excel(dataset_file, sheet_name='Train Set')
 
     # Group by Query
     query_groups = defaultdict(set)
@@ -48,41 +37,104 @@ def evaluate_recall():
         slug = get_slug(url)
         if slug:
             query_groups[q].add(slug)
-            
+    return query_groups
+
+def label_recall(products, true_slugs, top_indices):
+    retrieved_slugs = set().union(*(products[i]['slugs'] for i in top_indices))
+    return len(true_slugs.intersection(retrieved_slugs)) / len(true_slugs)
+
+def evaluate_ivf(retriever, queries, query_groups, query_vecs, exact_indices, k=10):
+    # Approximate (IVF) search vs exact brute force on the same queries
+    ivf = retriever.ivf
+    if ivf is None:
+        print("\nNo IVF index stored (create_embeddings.py --ivf); building a temporary one...")
+        ivf = IVFIndex.from_arrays(build_ivf(retriever.embeddings))
+    
+    exact_start = time.perf_counter()
+    Retriever(retriever.embeddings, retriever.products).search(query_vecs, k=k)
+    exact_ms = (time.perf_counter() - exact_start) * 1000 / len(queries)
+    
+    print(f"\n--- IVF vs Exact ({ivf.n_lists} lists, {len(retriever)} rows) ---")
+    print(f"{'nprobe':>6} | {'Overlap@' + str(k):>10} | {'Recall@' + str(k):>9} | {'ms/query':>8}")
+    print(f"{'exact':>6} | {1.0:>10.4f} | {np.mean([label_recall(retriever.products, query_groups[q], row) for q, row in zip(queries, exact_indices)]):>9.4f} | {exact_ms:>8.3f}")
+    
+    nprobes = sorted({n for n in (1, 2, 4, DEFAULT_NPROBE, 16, 32) if n <= ivf.n_lists} | {ivf.n_lists})
+    for nprobe in nprobes:
+        start = time.perf_counter()
+        approx_indices, _ = ivf.search(query_vecs, retriever.embeddings, k=k, nprobe=nprobe)
+        ms = (time.perf_counter() - start) * 1000 / len(queries)
+        overlap = np.mean([len(set(a) & set(e)) / len(e) for a, e in zip(approx_indices, exact_indices)])
+        recall = np.mean([label_recall(retriever.products, query_groups[q], row) for q, row in zip(queries, approx_indices)])
+        print(f"{nprobe:>6} | {overlap:>10.4f} | {recall:>9.4f} | {ms:>8.3f}")
+
+def evaluate_quantized(retriever, queries, query_groups, query_vecs, exact_indices, k=10):
+    # Quantized scan + full-precision re-rank must not change Recall@k
+    print(f"\n--- Quantized vs Exact ({len(retriever)} rows) ---")
+    print(f"{'dtype':>8} | {'MB':>7} | {'Overlap@' + str(k):>10} | {'Recall@' + str(k):>9} | {'ms/query':>8}")
+    exact_recall = np.mean([label_recall(retriever.products, query_groups[q], row) for q, row in zip(queries, exact_indices)])
+    print(f"{'float32':>8} | {retriever.embeddings.nbytes / 1e6:>7.2f} | {1.0:>10.4f} | {exact_recall:>9.4f} | {'-':>8}")
+    
+    for dtype in QUANTIZED_DTYPES:
+        if retriever.quantized is not None and retriever.quantized.dtype == dtype:
+            quantized = retriever.quantized
+        else:
+            quantized = QuantizedMatrix.from_arrays(quantize(retriever.embeddings, dtype))
+        start = time.perf_counter()
+        approx_indices, _ = quantized.search(query_vecs, retriever.embeddings, k=k)
+        ms = (time.perf_counter() - start) * 1000 / len(queries)
+        overlap = np.mean([len(set(a) & set(e)) / len(e) for a, e in zip(approx_indices, exact_indices)])
+        recall = np.mean([label_recall(retriever.products, query_groups[q], row) for q, row in zip(queries, approx_indices)])
+        print(f"{dtype:>8} | {quantized.nbytes / 1e6:>7.2f} | {overlap:>10.4f} | {recall:>9.4f} | {ms:>8.3f}")
+
+def evaluate_recall():
+    if not index_exists(INDEX_DIR):
+        print("Embeddings index not found.")
+        return
+
+    print("Loading resources...")
+    # Baseline ranking is exact full-precision search; IVF/quantized are compared below
+    retriever = Retriever.from_index(INDEX_DIR)
+    products = retriever.products
+    exact = Retriever(retriever.embeddings, products, retriever.manifest)
+    
+    # Precompute slugs for products
+    for p in products:
+        p['slugs'] = product_slugs(p)
+    
+    print("Loading Train Set...")
+    query_groups = load_query_groups()
     print(f"Loaded {len(query_groups)} unique queries.")
     
     recalls = []
     
+    # Batch encode + search all queries at once
+    queries = [q for q, true_slugs in query_groups.items() if true_slugs]
+    # Query vectors come from the on-disk embedding cache; the model only loads for new queries
+    query_vecs = EmbeddingCache().encode(queries)
+    all_top_indices, _ = exact.search(query_vecs, k=10)
+    
     print("\n--- Evaluation ---")
-    for query, true_slugs in query_groups.items():
-        if not true_slugs:
-            continue
-            
-        # Encode query
-        query_vec = model.encode([query])[0]
-        query_vec = query_vec / (np.linalg.norm(query_vec) + 1e-9)
-        
-        # Search
-        scores = np.dot(embeddings_matrix, query_vec)
-        top_indices = np.argsort(scores)[::-1][:10]
-        
-        retrieved_slugs = {products[i]['slug'] for i in top_indices}
+    for query, top_indices in zip(queries, all_top_indices):
+        true_slugs = query_groups[query]
         
         # Calculate Recall
-        intersection = true_slugs.intersection(retrieved_slugs)
-        recall = len(intersection) / len(true_slugs)
+        recall = label_recall(products, true_slugs, top_indices)
         recalls.append(recall)
         
         print(f"Query: {query[:50]}... | Recall: {recall:.2f}")
         # Debug top 1 match
         top_product = products[top_indices[0]]
-        print(f"  Top 1: {top_product.get('name', 'N/A')} ({top_product['slug']})")
+        print(f"  Top 1: {top_product.get('name', 'N/A')} ({get_slug(top_product['url'])})")
         # Check description presence
         desc_len = len(top_product.get('description', ''))
         print(f"  Desc Len: {desc_len}")
 
     mean_recall = np.mean(recalls) if recalls else 0
     print(f"\nMean Recall@10: {mean_recall:.4f}")
+    
+    if queries:
+        evaluate_ivf(retriever, queries, query_groups, query_vecs, all_top_indices)
+        evaluate_quantized(retriever, queries, query_groups, query_vecs, all_top_indices)
 
 if __name__ == "__main__":
     evaluate_recall()
@@ -0,0 +1,259 @@
+import argparse
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+
+from ann_index import IVFIndex, build_ivf
+from embedding_cache import CACHE_DIR, EmbeddingCache
+from evaluate_model import DATASET_FILE, load_query_groups, product_slugs
+from index_store import INDEX_DIR, index_exists, product_text
+from lexical_index import final_order
+from quantize import DEFAULT_RERANK_DEPTH, QUANTIZED_DTYPES, QuantizedMatrix, quantize
+from retriever import Retriever
+
+# Offline parameter sweeps over the labelled train set. Query and product
+# vectors come from the persistent embedding cache (embedding_cache.py), so
+# only texts never encoded before reach the model. Each configuration (text
+# recipe x search setting, or the lexical baseline) runs in a worker process
+# and ranks all queries with one batched search; Recall@k and MAP@k for every
+# requested k come from that single ranking, and per-query latency is timed
+# on single-query calls.
+#   python evaluate_sweep.py --k 5,10 --recipes full,name_desc --modes dense,hybrid --search exact,ivf:4,int8
+RESULTS_FILE = "eval_results.json"
+# Same default as the API's RECOMMEND_FUSION_DEPTH
+FUSION_DEPTH = 50
+MODES = ("dense", "lexical", "hybrid")
+
+
+def _types(p):
+    return " ".join(p.get('test_type', []))
+
+
+# Embedding text per product. BM25 (lexical / hybrid) always uses the
+# index's postings, which are built from product_text.
+RECIPES = {
+    "full": product_text,
+    "name": lambda p: p.get('name', ''),
+    "name_types": lambda p: f"{p.get('name', '')} {_types(p)}".strip(),
+    "name_desc": lambda p: f"{p.get('name', '')} {p.get('description', '')}".strip(),
+}
+
+
+def parse_search(setting):
+    # "exact", "ivf:<nprobe>", "int8" / "float16", optionally ":<rerank depth>"
+    name, _, arg = setting.partition(":")
+    if name == "exact" and not arg:
+        return name, None
+    if name == "ivf" and arg.isdigit():
+        return name, int(arg)
+    if name in QUANTIZED_DTYPES and (not arg or arg.isdigit()):
+        return name, int(arg) if arg else DEFAULT_RERANK_DEPTH
+    raise argparse.ArgumentTypeError(f"Unknown search setting {setting!r}; use exact, ivf:N, int8[:D] or float16[:D].")
+
+
+def average_precision(ranked_slugs, true_slugs, k):
+    # AP@k over distinct slugs, normalized by min(relevant, k); each ranked
+    # entry is the slug set of one row (several after dedup)
+    hits, total, seen = 0, 0.0, set()
+    for rank, slugs in enumerate(ranked_slugs[:k], 1):
+        for _ in (slugs & true_slugs) - seen:
+            hits += 1
+            total += hits / rank
+        seen |= slugs
+    return total / min(len(true_slugs), k)
+
+
+def score_rankings(rankings, slugs, true_sets, ks):
+    scores = {}
+    for k in ks:
+        recalls, aps = [], []
+        for row, true_slugs in zip(rankings, true_sets):
+            ranked = [slugs[i] for i in row]
+            recalls.append(len(true_slugs & set().union(*ranked[:k])) / len(true_slugs))
+            aps.append(average_precision(ranked, true_slugs, k))
+        scores[f"recall@{k}"] = round(float(np.mean(recalls)), 4)
+        scores[f"map@{k}"] = round(float(np.mean(aps)), 4)
+    return scores
+
+
+# Per worker process: catalog, queries and labels (see init_worker)
+_worker = {}
+
+
+def init_worker(index_dir, queries, query_path, matrix_paths, true_sets, ivf_lists):
+    reference = Retriever.from_index(index_dir, use_quantized=False)
+    _worker.update(
+        products=reference.products,
+        slugs=[product_slugs(p) for p in reference.products],
+        lexical=reference.lexical,
+        queries=queries,
+        query_vecs=np.load(query_path, mmap_mode="r"),
+        matrix_paths=matrix_paths,
+        true_sets=true_sets,
+        ivf_lists=ivf_lists,
+    )
+
+
+def searcher(recipe, search):
+    if recipe is None:
+        return None
+    embeddings = np.load(_worker["matrix_paths"][recipe], mmap_mode="r")
+    name, arg = parse_search(search)
+    if name == "ivf":
+        ivf = IVFIndex.from_arrays(build_ivf(np.asarray(embeddings), n_lists=_worker["ivf_lists"]))
+        return Retriever(embeddings, _worker["products"], ivf=ivf, nprobe=arg)
+    if name in QUANTIZED_DTYPES:
+        quantized = QuantizedMatrix.from_arrays(quantize(embeddings, name))
+        return Retriever(embeddings, _worker["products"], quantized=quantized, rerank_depth=arg)
+    return Retriever(embeddings, _worker["products"])
+
+
+def rank(retriever, mode, rows, depth):
+    # Rankings for the queries at `rows`, ordered by the API's own
+    # lexical_index.final_order
+    lexical = _worker["lexical"]
+    texts = [_worker["queries"][i] for i in rows]
+    dense = retriever.search(_worker["query_vecs"][rows], k=depth)[0] if mode != "lexical" else None
+    bm25 = lexical.search(texts, depth) if mode != "dense" else None
+    return [final_order(lexical, text, mode, depth, dense[j] if dense is not None else None,
+                        bm25[j] if bm25 is not None else None) for j, text in enumerate(texts)]
+
+
+def evaluate_config(recipe, search, modes, ks, fusion_depth, latency_queries):
+    started = time.perf_counter()
+    retriever = searcher(recipe, search)
+    setup_s = time.perf_counter() - started
+    n_queries = len(_worker["queries"])
+    results = []
+    for mode in modes:
+        depth = max(ks) if mode == "dense" else max(max(ks), fusion_depth)
+        all_rows = np.arange(n_queries)
+        t0 = time.perf_counter()
+        rankings = rank(retriever, mode, all_rows, depth)
+        batched_ms = (time.perf_counter() - t0) * 1000 / n_queries
+        single = []
+        for i in all_rows[:latency_queries]:
+            t0 = time.perf_counter()
+            rank(retriever, mode, all_rows[i:i + 1], depth)
+            single.append((time.perf_counter() - t0) * 1000)
+        results.append({
+            "recipe": recipe or "-",
+            "mode": mode,
+            "search": search or "-",
+            **score_rankings(rankings, _worker["slugs"], _worker["true_sets"], ks),
+            "batched_ms": round(batched_ms, 4),
+            "p50_ms": round(float(np.percentile(single, 50)), 4),
+            "p95_ms": round(float(np.percentile(single, 95)), 4),
+            "setup_s": round(setup_s, 3),
+        })
+    return results
+
+
+def configs(recipes, modes, searches):
+    # (recipe, search, modes) tasks; the lexical baseline does not depend on either
+    dense_modes = [m for m in modes if m != "lexical"]
+    tasks = [(recipe, search, dense_modes) for recipe, search in itertools.product(recipes, searches) if dense_modes]
+    if "lexical" in modes:
+        tasks.append((None, None, ["lexical"]))
+    return tasks
+
+
+def print_table(rows, ks):
+    columns = ["recipe", "mode", "search"] + [f"{m}@{k}" for k in ks for m in ("recall", "map")] + \
+              ["batched_ms", "p50_ms", "p95_ms"]
+    widths = [max(len(c), *(len(str(r[c])) for r in rows)) for c in columns]
+    print(" | ".join(c.rjust(w) for c, w in zip(columns, widths)))
+    print("-+-".join("-" * w for w in widths))
+    for r in rows:
+        print(" | ".join(str(r[c]).rjust(w) for c, w in zip(columns, widths)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sweep embedding texts, retrieval modes and ANN/quantization "
+                                                 "settings on the train set.")
+    parser.add_argument("--k", default="10", help="comma-separated cutoffs, e.g. 3,5,10")
+    parser.add_argument("--recipes", default=",".join(RECIPES), help=f"embedding texts: {', '.join(RECIPES)}")
+    parser.add_argument("--modes", default="dense", help=f"comma-separated: {', '.join(MODES)}")
+    parser.add_argument("--search", default="exact", help="comma-separated: exact, ivf:<nprobe>, int8[:depth], "
+                                                          "float16[:depth]")
+    parser.add_argument("--ivf-lists", type=int, default=None, help="IVF lists (default: 4*sqrt(rows))")
+    parser.add_argument("--fusion-depth", type=int, default=FUSION_DEPTH)
+    parser.add_argument("--latency-queries", type=int, default=200, help="queries timed one at a time per config")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--index-dir", default=INDEX_DIR)
+    parser.add_argument("--dataset", default=DATASET_FILE)
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    parser.add_argument("--output", default=RESULTS_FILE)
+    args = parser.parse_args()
+
+    ks = sorted({int(k) for k in args.k.split(",") if k})
+    recipes = [r for r in args.recipes.split(",") if r]
+    modes = [m for m in args.modes.split(",") if m]
+    searches = [s for s in args.search.split(",") if s]
+    for recipe in recipes:
+        if recipe not in RECIPES:
+            parser.error(f"unknown recipe {recipe!r}")
+    for mode in modes:
+        if mode not in MODES:
+            parser.error(f"unknown mode {mode!r}")
+    for search in searches:
+        try:
+            parse_search(search)
+        except argparse.ArgumentTypeError as e:
+            parser.error(str(e))
+    if not index_exists(args.index_dir):
+        parser.error(f"{args.index_dir}/ not found. Run create_embeddings.py first.")
+
+    started = time.perf_counter()
+    query_groups = load_query_groups(args.dataset)
+    queries = [q for q, true_slugs in query_groups.items() if true_slugs]
+    true_sets = [query_groups[q] for q in queries]
+    products = Retriever.from_index(args.index_dir, use_quantized=False).products
+    print(f"{len(queries)} queries, {len(products)} products.")
+
+    # Encode through the cache; the matrices are handed to workers as .npy files they memory-map
+    cache = EmbeddingCache(args.cache_dir)
+    sweep_dir = os.path.join(cache.path, "sweep")
+    os.makedirs(sweep_dir, exist_ok=True)
+    t0 = time.perf_counter()
+    query_path = os.path.join(sweep_dir, "queries.npy")
+    np.save(query_path, cache.encode(queries))
+    matrix_paths = {}
+    needs_vectors = any(m != "lexical" for m in modes)
+    for recipe in recipes if needs_vectors else []:
+        matrix_paths[recipe] = os.path.join(sweep_dir, f"products_{recipe}.npy")
+        np.save(matrix_paths[recipe], cache.encode([RECIPES[recipe](p) for p in products]))
+    print(f"Embeddings: {cache.hits} cached, {cache.misses} encoded ({time.perf_counter() - t0:.1f}s).")
+
+    tasks = configs(recipes, modes, searches)
+    workers = max(1, min(args.workers, len(tasks)))
+    if workers > 1:
+        # One BLAS thread per worker process instead of every worker using every core
+        for var in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+            os.environ.setdefault(var, "1")
+    print(f"Running {len(tasks)} configurations on {workers} worker(s)...")
+    initargs = (args.index_dir, queries, query_path, matrix_paths, true_sets, args.ivf_lists)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn"),
+                             initializer=init_worker, initargs=initargs) as pool:
+        futures = [pool.submit(evaluate_config, recipe, search, task_modes, ks, args.fusion_depth,
+                               args.latency_queries) for recipe, search, task_modes in tasks]
+        rows = [row for future in futures for row in future.result()]
+
+    print()
+    print_table(rows, ks)
+    with open(args.output, "w") as f:
+        json.dump({
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "encoder": cache.key,
+            "index_dir": args.index_dir,
+            "queries": len(queries),
+            "products": len(products),
+            "k": ks,
+            "results": rows,
+        }, f, indent=2)
+    print(f"\nWrote {len(rows)} results to {args.output} in {time.perf_counter() - started:.1f}s.")
@@ -0,0 +1,119 @@
+import numpy as np
+
+# Catalog key letters as shown on shl.com, mapped to the names scrape_catalog.py stores
+TEST_TYPE_CODES = {
+    "A": "Ability & Aptitude",
+    "B": "Biodata & Situational Judgement",
+    "C": "Competencies",
+    "D": "Development & 360",
+    "E": "Assessment Exercises",
+    "K": "Knowledge & Skills",
+    "P": "Personality & Behavior",
+    "S": "Simulations"
+}
+_TEST_TYPES_BY_NAME = {name.lower(): name for name in TEST_TYPE_CODES.values()}
+
+
+def normalize_test_types(values):
+    # Accepts full names (any case) or single-letter codes; rejects unknown types
+    names = []
+    for value in values:
+        value = str(value).strip()
+        name = TEST_TYPE_CODES.get(value.upper()) or _TEST_TYPES_BY_NAME.get(value.lower())
+        if name is None:
+            raise ValueError(f"Unknown test type {value!r}. Use one of: {', '.join(TEST_TYPE_CODES.values())}.")
+        names.append(name)
+    return names
+
+
+def filter_key(remote_support=None, adaptive_support=None, max_duration=None, test_types=None):
+    # Hashable description of a filter set; None means "no filtering"
+    key = (
+        remote_support,
+        adaptive_support,
+        max_duration,
+        tuple(sorted(set(test_types))) if test_types else None,
+    )
+    return None if key == (None, None, None, None) else key
+
+
+class AttributeIndex:
+    # Columnar view of the filterable catalog fields, built once at index load:
+    # boolean columns for remote/adaptive, int durations (0 = not listed) and a
+    # bitmask of test types per row. A filter becomes a handful of vectorized
+    # comparisons and yields the row ids to score.
+    # Rows collapsed by dedup.py carry their variants' records; the columns
+    # hold one entry per record (canonical first) and `owner` maps it back to
+    # its row, so a row matches when its canonical record or any one variant
+    # passes the filter. Responses then show the record that passed.
+    def __init__(self, products, max_cached=256):
+        counts = np.array([1 + len(p.get('variants', ())) for p in products], dtype=np.intp)
+        records = [r for p in products for r in [p] + p.get('variants', [])]
+        self.owner = np.repeat(np.arange(len(products)), counts) if len(records) > len(products) else None
+        self.start = np.cumsum(counts) - counts
+        self.remote = np.array([p.get('remote_support', 'Yes') == 'Yes' for p in records], dtype=bool)
+        self.adaptive = np.array([p.get('adaptive_support', 'No') == 'Yes' for p in records], dtype=bool)
+        self.duration = np.array([int(p.get('duration', 0) or 0) for p in records], dtype=np.int32)
+
+        self.type_bits = {}
+        for p in records:
+            for t in p.get('test_type', p.get('test_types', [])):
+                if t not in self.type_bits:
+                    self.type_bits[t] = len(self.type_bits)
+        if len(self.type_bits) > 64:
+            raise ValueError(f"Too many distinct test types for a 64-bit mask: {len(self.type_bits)}.")
+        self.types = np.zeros(len(records), dtype=np.uint64)
+        for i, p in enumerate(records):
+            for t in p.get('test_type', p.get('test_types', [])):
+                self.types[i] |= np.uint64(1 << self.type_bits[t])
+
+        self.max_cached = max_cached
+        self._rows = {}
+
+    def mask(self, key):
+        remote_support, adaptive_support, max_duration, test_types = key
+        mask = np.ones(len(self.remote), dtype=bool)
+        if remote_support is not None:
+            mask &= self.remote == remote_support
+        if adaptive_support is not None:
+            mask &= self.adaptive == adaptive_support
+        if max_duration is not None:
+            # Unlisted durations (0) can't be shown to fit, so they are excluded
+            mask &= (self.duration > 0) & (self.duration <= max_duration)
+        if test_types:
+            wanted = 0
+            for t in test_types:
+                if t in self.type_bits:
+                    wanted |= 1 << self.type_bits[t]
+            # Any of the requested types
+            mask &= (self.types & np.uint64(wanted)) != 0
+        return mask
+
+    def _lookup(self, key):
+        entry = self._rows.get(key)
+        if entry is None:
+            matched = np.flatnonzero(self.mask(key))
+            if self.owner is None:
+                entry = (matched, {})
+            else:
+                # First matching record of each row: the canonical one if it passes
+                rows, first = np.unique(self.owner[matched], return_index=True)
+                variant = matched[first] - self.start[rows] - 1
+                entry = (rows, {int(r): int(v) for r, v in zip(rows, variant) if v >= 0})
+            if len(self._rows) >= self.max_cached:
+                self._rows.clear()
+            self._rows[key] = entry
+        return entry
+
+    def rows(self, key):
+        # Eligible row ids for a filter key (None -> every row, returned as None)
+        if key is None:
+            return None
+        return self._lookup(key)[0]
+
+    def shown_variants(self, key):
+        # {row: index into its 'variants'} for collapsed rows whose canonical
+        # record fails the filter but a variant passes; they are shown as that variant
+        if key is None:
+            return {}
+        return self._lookup(key)[1]
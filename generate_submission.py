@@ -1,29 +1,23 @@
 
 import pandas as pd
-from sentence_transformers import SentenceTransformer
-import pickle
-import numpy as np
-import os
 
-EMBEDDINGS_FILE = "product_embeddings.pkl"
+from encoders import get_encoder
+from index_store import INDEX_DIR, index_exists
+from retriever import Retriever, encode_queries
+
 DATASET_FILE = "Gen_AI Dataset.xlsx"
 OUTPUT_FILE = "submission.csv"
 
 def generate_submission():
-    if not os.path.exists(EMBEDDINGS_FILE):
-        print("Embeddings file not found.")
+    if not index_exists(INDEX_DIR):
+        print("Embeddings index not found.")
         return
 
     print("Loading resources...")
-    with open(EMBEDDINGS_FILE, "rb") as f:
-        products = pickle.load(f)
-    
-    embeddings_matrix = np.array([p['vector'] for p in products])
-    # Normalize
-    norm = np.linalg.norm(embeddings_matrix, axis=1, keepdims=True)
-    embeddings_matrix = embeddings_matrix / (norm + 1e-9)
+    retriever = Retriever.from_index(INDEX_DIR)
+    products = retriever.products
     
-    model = SentenceTransformer('all-MiniLM-L6-v2') 
+    model = get_encoder()
     
     print("Loading Test Set...")
     # Sheet names: 'Train-Set', 'Test-Set'?
@@ -46,18 +40,13 @@ def generate_submission():
     
     print(f"Generating predictions for {len(df)} queries...")
     
-    for _, row in df.iterrows():
-        query = row['Query']
-        
-        # Encode query
-        query_vec = model.encode([query])[0]
-        query_vec = query_vec / (np.linalg.norm(query_vec) + 1e-9)
-        
-        # Search
-        scores = np.dot(embeddings_matrix, query_vec)
-        top_indices = np.argsort(scores)[::-1][:10] # Top 10
-        
-        for idx in top_indices:
+    # Encode every query in one batch and score them with one matrix product
+    queries = df['Query'].tolist()
+    query_vecs = encode_queries(model, queries)
+    top_indices, _ = retriever.search(query_vecs, k=10) # Top 10
+    
+    for query, row_indices in zip(queries, top_indices):
+        for idx in row_indices:
             p_url = products[idx]['url']
             results.append({
                 "Query": query,
@@ -0,0 +1,26 @@
+import os
+
+# Multi-worker serving:
+#   gunicorn -c gunicorn.conf.py app:app
+# The master imports the app and loads the index (and the torch model) once
+# before forking, so workers share those pages copy-on-write instead of each
+# holding its own copy. Each worker then gets cores / workers encoder threads
+# (RECOMMEND_WORKER_THREADS overrides) and warms up before /health/ready
+# reports ready. Metrics on /metrics are per worker.
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("WEB_CONCURRENCY", "2"))
+worker_class = "uvicorn_worker.UvicornWorker"
+preload_app = True
+# Warm-up happens after fork; give slow cold starts time before the first heartbeat check
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "120"))
+
+
+def when_ready(server):
+    # Runs in the master once the socket is bound, before any worker is forked
+    import app
+    app.preload()
+
+
+def post_fork(server, worker):
+    import app
+    app.init_worker(server.cfg.workers)
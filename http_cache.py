@@ -0,0 +1,63 @@
+import hashlib
+import json
+import os
+import time
+
+# On-disk HTTP cache for the scraper, one <sha256(url)>.json file per URL with
+# the body and its validators (ETag / Last-Modified). Re-scrapes send them back
+# as If-None-Match / If-Modified-Since and reuse the stored body on a 304, so
+# only pages that changed are downloaded. replay_server.py serves the same
+# directory as a local stand-in for the catalog site.
+CACHE_DIR = os.environ.get("SCRAPE_CACHE_DIR", "scrape_cache")
+
+
+def url_key(url):
+    return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+
+class HTTPCache:
+    def __init__(self, cache_dir=CACHE_DIR):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def path(self, url):
+        return os.path.join(self.cache_dir, url_key(url) + ".json")
+
+    def get(self, url):
+        try:
+            with open(self.path(url), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, url, body, headers=None):
+        headers = headers or {}
+        entry = {
+            "url": url,
+            "etag": headers.get("etag"),
+            "last_modified": headers.get("last-modified"),
+            "fetched_at": time.time(),
+            "body": body,
+        }
+        # Write-then-rename so an interrupted scrape never leaves a torn entry
+        path = self.path(url)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        return entry
+
+    @staticmethod
+    def validators(entry):
+        headers = {}
+        if entry and entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry and entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def entries(self):
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".json"):
+                with open(os.path.join(self.cache_dir, name), "r", encoding="utf-8") as f:
+                    yield json.load(f)
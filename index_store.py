@@ -0,0 +1,292 @@
+import hashlib
+import json
+import os
+import pickle
+import sys
+
+import numpy as np
+
+# On-disk index layout (one directory):
+#   manifest.json         - format version, model name, dimension, row count,
+#                           checksum and the names of the files below
+#   embeddings-<hash>.npy - L2-normalized, C-contiguous float32 matrix (rows x dim)
+#   metadata-<hash>.json  - product records in row order, without vectors
+#   <name>-<hash>.npy     - optional auxiliary arrays (e.g. IVF lists), listed in
+#                           manifest["arrays"] with their own checksums
+# Data files are content-addressed and never rewritten in place; replacing
+# manifest.json is the single atomic step that publishes a new index. Files
+# referenced by neither the new nor the previous manifest are then removed.
+# Format 1 indexes used fixed embeddings.npy / metadata.json names; they are
+# still readable, but older readers reject format 2 instead of failing on a
+# missing embeddings.npy.
+INDEX_DIR = "product_index"
+LEGACY_PICKLE = "product_embeddings.pkl"
+MODEL_NAME = "all-MiniLM-L6-v2"
+FORMAT_VERSION = 2
+READABLE_FORMATS = (1, 2)
+# Indexes from before encoder backends were recorded were built with torch
+DEFAULT_BACKEND = "torch"
+
+MANIFEST_FILE = "manifest.json"
+EMBEDDINGS_FILE = "embeddings.npy"
+METADATA_FILE = "metadata.json"
+# Per-row sha256 (truncated) of model name + product_text, used to reuse vectors
+CONTENT_HASH_ARRAY = "content_hashes"
+# Rows folded into a canonical row by dedup.py: their hashes and vectors
+VARIANT_HASH_ARRAY = "variant_hashes"
+VARIANT_EMBEDDINGS_ARRAY = "variant_embeddings"
+
+
+def product_text(p):
+    # Create a rich representation for embedding / keyword indexing
+    # Title + Test Types + Description
+    text = p.get('name', '')
+
+    types = p.get('test_type', [])
+    if types:
+        text += " " + " ".join(types)
+
+    desc = p.get('description', '')
+    if desc:
+        text += " " + desc
+
+    return text
+
+
+def product_slug(p):
+    # Last path segment of the catalog URL, e.g. ".../view/net-mvc-new/" -> "net-mvc-new"
+    return p.get('url', '').split('?')[0].strip().rstrip('/').split('/')[-1].lower()
+
+
+def content_hash(p, model_name=MODEL_NAME):
+    text = product_text(p)
+    return hashlib.sha256(f"{model_name}\n{text}".encode("utf-8")).hexdigest()[:32]
+
+
+def content_hashes(products, model_name=MODEL_NAME):
+    return np.array([content_hash(p, model_name) for p in products], dtype="S32")
+
+
+def normalize_rows(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norm = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return np.ascontiguousarray(matrix / (norm + 1e-9), dtype=np.float32)
+
+
+def file_checksum(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def save_index(products, embeddings, model_name=MODEL_NAME, index_dir=INDEX_DIR, arrays=None, extra=None):
+    if len(products) != len(embeddings):
+        raise ValueError(f"Got {len(products)} products but {len(embeddings)} vectors.")
+
+    os.makedirs(index_dir, exist_ok=True)
+    matrix = normalize_rows(embeddings)
+    previous = _current_manifest(index_dir)
+
+    embeddings_file, checksum = _write_file(index_dir, "embeddings", ".npy", lambda path: np.save(path, matrix))
+
+    # Vectors live in the .npy file only; drop any copy carried on the records
+    records = [{k: v for k, v in p.items() if k != 'vector'} for p in products]
+
+    def write_records(path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(records, f, ensure_ascii=False, separators=(",", ":"))
+
+    metadata_file, _ = _write_file(index_dir, "metadata", ".json", write_records)
+
+    manifest = {
+        "format_version": FORMAT_VERSION,
+        "model_name": model_name,
+        "dimension": int(matrix.shape[1]) if matrix.ndim == 2 else 0,
+        "rows": int(matrix.shape[0]),
+        "dtype": "float32",
+        "normalized": True,
+        "checksum": checksum,
+        "files": {"embeddings": embeddings_file, "metadata": metadata_file},
+        "arrays": {},
+    }
+    manifest.update(extra or {})
+    for name, array in (arrays or {}).items():
+        manifest["arrays"][name] = _save_array(index_dir, name, array)
+    write_manifest(manifest, index_dir)
+    prune_files(index_dir, index_files(manifest) | (index_files(previous) if previous else set()))
+
+    return manifest
+
+
+def _write_file(index_dir, stem, ext, write):
+    # Write under a temp name, then rename to <stem>-<checksum prefix><ext>
+    tmp_path = os.path.join(index_dir, f".{stem}.{os.getpid()}.tmp{ext}")
+    write(tmp_path)
+    checksum = file_checksum(tmp_path)
+    name = f"{stem}-{checksum[:16]}{ext}"
+    os.replace(tmp_path, os.path.join(index_dir, name))
+    return name, "sha256:" + checksum
+
+
+def _save_array(index_dir, name, array):
+    array = np.ascontiguousarray(array)
+    file_name, checksum = _write_file(index_dir, name, ".npy", lambda path: np.save(path, array))
+    return {
+        "file": file_name,
+        "dtype": str(array.dtype),
+        "shape": list(array.shape),
+        "checksum": checksum,
+    }
+
+
+def _current_manifest(index_dir):
+    try:
+        return load_manifest(index_dir)
+    except (OSError, ValueError):
+        return None
+
+
+def index_files(manifest):
+    files = manifest.get("files", {})
+    names = {files.get("embeddings", EMBEDDINGS_FILE), files.get("metadata", METADATA_FILE)}
+    names.update(entry["file"] for entry in manifest.get("arrays", {}).values())
+    return names
+
+
+def prune_files(index_dir, keep):
+    # Remove data files no longer referenced; in-progress temp files start with "."
+    for name in os.listdir(index_dir):
+        if name == MANIFEST_FILE or name in keep or name.startswith("."):
+            continue
+        if name.endswith((".npy", ".json")):
+            os.remove(os.path.join(index_dir, name))
+
+
+def write_manifest(manifest, index_dir=INDEX_DIR):
+    # Write-then-rename so readers never observe a half-written manifest
+    path = os.path.join(index_dir, MANIFEST_FILE)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def add_arrays(arrays, index_dir=INDEX_DIR, extra=None):
+    # Attach auxiliary arrays to an existing index without re-encoding
+    manifest = load_manifest(index_dir)
+    keep = index_files(manifest)
+    manifest.setdefault("arrays", {})
+    for name, array in arrays.items():
+        manifest["arrays"][name] = _save_array(index_dir, name, array)
+    manifest.update(extra or {})
+    write_manifest(manifest, index_dir)
+    prune_files(index_dir, keep | index_files(manifest))
+    return manifest
+
+
+def load_array(name, index_dir=INDEX_DIR, manifest=None, mmap=True):
+    manifest = manifest or load_manifest(index_dir)
+    entry = manifest.get("arrays", {}).get(name)
+    if entry is None:
+        return None
+    return np.load(os.path.join(index_dir, entry["file"]), mmap_mode="r" if mmap else None)
+
+
+def load_manifest(index_dir=INDEX_DIR):
+    with open(os.path.join(index_dir, MANIFEST_FILE), "r") as f:
+        manifest = json.load(f)
+    if manifest.get("format_version") not in READABLE_FORMATS:
+        raise ValueError(
+            f"Unsupported index format {manifest.get('format_version')} in {index_dir} "
+            f"(expected {FORMAT_VERSION}). Re-run create_embeddings.py."
+        )
+    return manifest
+
+
+def index_version(manifest):
+    # Short id of one index build: every data file is content-addressed and
+    # named in the manifest, so any change to the index changes this
+    canonical = json.dumps(manifest, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:16]
+
+
+def load_index(index_dir=INDEX_DIR, mmap=True, verify=False):
+    # With mmap=True the matrix is a read-only view over the page cache, so
+    # nothing is copied at startup and processes on the same host share it.
+    manifest = load_manifest(index_dir)
+    files = manifest.get("files", {})
+    embeddings_path = os.path.join(index_dir, files.get("embeddings", EMBEDDINGS_FILE))
+
+    if verify:
+        checksum = "sha256:" + file_checksum(embeddings_path)
+        if checksum != manifest["checksum"]:
+            raise ValueError(f"Checksum mismatch for {embeddings_path}.")
+
+    embeddings = np.load(embeddings_path, mmap_mode="r" if mmap else None)
+    if embeddings.shape != (manifest["rows"], manifest["dimension"]):
+        raise ValueError(
+            f"Index shape {embeddings.shape} does not match manifest "
+            f"({manifest['rows']}, {manifest['dimension']})."
+        )
+
+    with open(os.path.join(index_dir, files.get("metadata", METADATA_FILE)), "r", encoding="utf-8") as f:
+        products = json.load(f)
+    if len(products) != manifest["rows"]:
+        raise ValueError(f"Metadata has {len(products)} rows, manifest says {manifest['rows']}.")
+
+    return products, embeddings, manifest
+
+
+def index_exists(index_dir=INDEX_DIR):
+    return os.path.exists(os.path.join(index_dir, MANIFEST_FILE))
+
+
+def reusable_vectors(index_dir=INDEX_DIR, model_name=MODEL_NAME, backend=None):
+    # {content hash: row} and the matrix of an existing index, for incremental
+    # rebuilds; empty when there is no index or it was built with another
+    # model or (if given) another encoder backend, whose vectors differ
+    if not index_exists(index_dir):
+        return {}, None, None
+    try:
+        products, embeddings, manifest = load_index(index_dir)
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable index in {index_dir}: {e}")
+        return {}, None, None
+    if manifest.get("model_name") != model_name:
+        return {}, None, manifest
+    if backend is not None and manifest.get("encoder_backend", DEFAULT_BACKEND) != backend:
+        print(f"Index in {index_dir} was encoded with {manifest.get('encoder_backend', DEFAULT_BACKEND)}, "
+              f"not {backend}; re-encoding everything.")
+        return {}, None, manifest
+    hashes = load_array(CONTENT_HASH_ARRAY, index_dir, manifest)
+    if hashes is None:
+        # Older indexes: recompute from the stored records
+        hashes = content_hashes(products, model_name)
+    known = {h: i for i, h in enumerate(hashes.tolist())}
+    variant_hashes = load_array(VARIANT_HASH_ARRAY, index_dir, manifest)
+    if variant_hashes is not None and len(variant_hashes):
+        # Vectors of deduplicated variants are reusable too; appending them
+        # copies the matrix into memory, which only dedup'd indexes pay for
+        offset = len(embeddings)
+        embeddings = np.concatenate([embeddings, load_array(VARIANT_EMBEDDINGS_ARRAY, index_dir, manifest)])
+        for i, h in enumerate(variant_hashes.tolist()):
+            known.setdefault(h, offset + i)
+    return known, embeddings, manifest
+
+
+def convert_legacy_pickle(pickle_path=LEGACY_PICKLE, index_dir=INDEX_DIR, model_name=MODEL_NAME):
+    # One-off migration from the old product_embeddings.pkl (list of dicts with 'vector')
+    with open(pickle_path, "rb") as f:
+        products = pickle.load(f)
+    embeddings = np.array([p['vector'] for p in products], dtype=np.float32)
+    return save_index(products, embeddings, model_name=model_name, index_dir=index_dir)
+
+
+if __name__ == "__main__":
+    # Usage: python index_store.py [legacy.pkl] [index_dir]
+    src = sys.argv[1] if len(sys.argv) > 1 else LEGACY_PICKLE
+    dst = sys.argv[2] if len(sys.argv) > 2 else INDEX_DIR
+    manifest = convert_legacy_pickle(src, dst)
+    print(f"Converted {src} -> {dst}: {manifest['rows']} rows x {manifest['dimension']} dims.")
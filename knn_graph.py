@@ -0,0 +1,83 @@
+import argparse
+
+import numpy as np
+
+from index_store import INDEX_DIR, add_arrays, load_array, load_index
+from retriever import top_k_indices
+
+# Product-to-product nearest neighbours, precomputed at index build time so
+# "assessments similar to X" is a row lookup instead of a scan. Stored next
+# to the vectors as:
+#   knn_ids (rows x neighbors int32, most similar first, the row itself excluded)
+#   knn_scores (rows x neighbors float16 cosine similarities)
+KNN_ARRAYS = ("knn_ids", "knn_scores")
+DEFAULT_NEIGHBORS = 50
+# Upper bound on one block of the all-pairs similarity matrix (float32
+# cells); rows per block shrink as the catalog grows so memory stays flat.
+BLOCK_CELLS = 1 << 26
+
+
+def build_knn(embeddings, neighbors=DEFAULT_NEIGHBORS, block_cells=BLOCK_CELLS):
+    # Blocked all-pairs GEMM: one (block x rows) slab of similarities at a
+    # time, reduced to its top neighbours before the next slab is computed.
+    n_rows = len(embeddings)
+    neighbors = max(0, min(neighbors, n_rows - 1))
+    ids = np.empty((n_rows, neighbors), dtype=np.int32)
+    scores = np.empty((n_rows, neighbors), dtype=np.float16)
+    block_rows = max(1, block_cells // max(n_rows, 1))
+    for start in range(0, n_rows, block_rows):
+        block = np.asarray(embeddings[start:start + block_rows], dtype=np.float32)
+        sims = block @ np.asarray(embeddings).T
+        # Never list a product as its own neighbour
+        sims[np.arange(len(block)), np.arange(start, start + len(block))] = -np.inf
+        top = top_k_indices(sims, neighbors)
+        ids[start:start + len(block)] = top
+        scores[start:start + len(block)] = np.take_along_axis(sims, top, axis=1)
+    return {"knn_ids": ids, "knn_scores": scores}
+
+
+def knn_manifest(arrays):
+    return {"knn": {"neighbors": int(arrays["knn_ids"].shape[1])}}
+
+
+class KnnGraph:
+    def __init__(self, ids, scores):
+        self.ids = ids
+        self.scores = scores
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        return cls(*(arrays[name] for name in KNN_ARRAYS))
+
+    @classmethod
+    def load(cls, index_dir=INDEX_DIR, manifest=None):
+        arrays = {name: load_array(name, index_dir, manifest) for name in KNN_ARRAYS}
+        if any(a is None for a in arrays.values()):
+            return None
+        return cls.from_arrays(arrays)
+
+    @property
+    def neighbors(self):
+        return self.ids.shape[1]
+
+    def lookup(self, row, rows=None):
+        # Stored neighbours of `row`, best first; with rows (sorted eligible
+        # ids, see filters.AttributeIndex.rows) only the eligible ones
+        ids = np.asarray(self.ids[row], dtype=np.intp)
+        if rows is not None and len(ids):
+            pos = np.minimum(np.searchsorted(rows, ids), max(len(rows) - 1, 0))
+            ids = ids[rows[pos] == ids] if len(rows) else ids[:0]
+        return ids
+
+
+if __name__ == "__main__":
+    # Build (or rebuild) the neighbour table for an existing index without re-encoding
+    parser = argparse.ArgumentParser(description="Precompute product-to-product nearest neighbours for a product index.")
+    parser.add_argument("index_dir", nargs="?", default=INDEX_DIR)
+    parser.add_argument("--neighbors", type=int, default=DEFAULT_NEIGHBORS)
+    args = parser.parse_args()
+
+    _, embeddings, _ = load_index(args.index_dir)
+    arrays = build_knn(embeddings, args.neighbors)
+    add_arrays(arrays, args.index_dir, extra=knn_manifest(arrays))
+    print(f"Built {arrays['knn_ids'].shape[1]} neighbours per row for {len(embeddings)} rows in {args.index_dir}/.")
@@ -0,0 +1,175 @@
+import argparse
+import re
+
+import numpy as np
+from scipy import sparse
+
+from index_store import INDEX_DIR, add_arrays, load_array, load_index, product_text
+
+# BM25 keyword index over name + test types + description, stored as
+# term-major postings (CSR rows = terms, columns = products) whose values are
+# precomputed BM25 term weights. Scoring a batch of queries is then one sparse
+# (queries x terms) @ (terms x products) product.
+BM25_ARRAYS = ("bm25_vocab", "bm25_indptr", "bm25_docs", "bm25_weights")
+BM25_K1 = 1.2
+BM25_B = 0.75
+RRF_K = 60
+
+# Keeps product codes and versions together: "opq32", "java", "8", "c++", ".net", "node.js"
+TOKEN_RE = re.compile(r"[a-z0-9+#]+(?:\.[a-z0-9+#]+)*|\.[a-z]+")
+# Mixed tokens also index their letter/digit runs, so "OPQ32" finds "OPQ32r"
+SUBTOKEN_RE = re.compile(r"[a-z]+|[0-9]+")
+
+
+def tokenize(text, expand=True):
+    tokens = TOKEN_RE.findall(str(text).lower())
+    if not expand:
+        return tokens
+    expanded = []
+    for token in tokens:
+        expanded.append(token)
+        parts = SUBTOKEN_RE.findall(token)
+        if len(parts) > 1:
+            expanded.extend(parts)
+    return expanded
+
+
+def normalize_name(text):
+    return " ".join(tokenize(text, expand=False))
+
+
+def build_bm25(products, k1=BM25_K1, b=BM25_B):
+    vocab = {}
+    doc_ids, term_ids, tfs, doc_lens = [], [], [], []
+    for doc, p in enumerate(products):
+        tokens = tokenize(product_text(p))
+        doc_lens.append(len(tokens))
+        counts = {}
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+        for token, tf in counts.items():
+            term_ids.append(vocab.setdefault(token, len(vocab)))
+            doc_ids.append(doc)
+            tfs.append(tf)
+
+    n_docs = len(products)
+    doc_ids = np.array(doc_ids, dtype=np.int32)
+    term_ids = np.array(term_ids, dtype=np.int64)
+    tfs = np.array(tfs, dtype=np.float32)
+    doc_lens = np.array(doc_lens, dtype=np.float32)
+
+    df = np.bincount(term_ids, minlength=len(vocab)).astype(np.float32)
+    idf = np.log1p((n_docs - df + 0.5) / (df + 0.5))
+    avgdl = doc_lens.mean() if n_docs else 1.0
+    norm = k1 * (1 - b + b * doc_lens[doc_ids] / max(avgdl, 1e-9))
+    weights = (idf[term_ids] * tfs * (k1 + 1) / (tfs + norm)).astype(np.float32)
+
+    postings = sparse.csr_matrix((weights, (term_ids, doc_ids)), shape=(len(vocab), n_docs))
+    postings.sort_indices()
+    terms = np.empty(len(vocab), dtype=object)
+    for token, i in vocab.items():
+        terms[i] = token
+    return {
+        "bm25_vocab": terms.astype(str),
+        "bm25_indptr": postings.indptr.astype(np.int64),
+        "bm25_docs": postings.indices.astype(np.int32),
+        "bm25_weights": postings.data.astype(np.float32),
+    }
+
+
+def bm25_manifest(arrays, k1=BM25_K1, b=BM25_B):
+    return {"bm25": {"terms": len(arrays["bm25_vocab"]), "k1": k1, "b": b}}
+
+
+def rrf_fuse(rankings, k, c=RRF_K):
+    # Reciprocal rank fusion: sum of 1 / (c + rank) over the input rankings
+    scores = {}
+    for ranking in rankings:
+        for rank, idx in enumerate(ranking):
+            scores[int(idx)] = scores.get(int(idx), 0.0) + 1.0 / (c + rank + 1)
+    fused = sorted(scores, key=scores.get, reverse=True)
+    return np.array(fused[:k], dtype=np.intp)
+
+
+def final_order(lexical, query, mode, k, dense_row=None, lexical_row=None, rows=None):
+    # Result order of one query in each mode, shared by the API and
+    # evaluate_sweep.py: dense order; in lexical and hybrid mode exact
+    # product-name matches (among `rows`) first, then BM25 order, or in hybrid
+    # mode without a name match the RRF of the dense and BM25 rankings
+    if mode == "dense":
+        return dense_row[:k]
+    exact = lexical.exact_match(query, rows)
+    if mode == "lexical" or len(exact):
+        return np.concatenate([exact, lexical_row[~np.isin(lexical_row, exact)]])[:k]
+    return rrf_fuse([dense_row, lexical_row], k)
+
+
+class LexicalIndex:
+    def __init__(self, arrays, products):
+        vocab = arrays["bm25_vocab"]
+        self.term_ids = {str(t): i for i, t in enumerate(vocab)}
+        self.postings = sparse.csr_matrix(
+            (arrays["bm25_weights"], arrays["bm25_docs"], arrays["bm25_indptr"]),
+            shape=(len(vocab), len(products)),
+        )
+        # Exact product-name lookup, used to answer "OPQ32"-style queries without the model
+        self.names = {}
+        for i, p in enumerate(products):
+            self.names.setdefault(normalize_name(p.get('name', '')), []).append(i)
+
+    @classmethod
+    def load(cls, products, index_dir=INDEX_DIR, manifest=None):
+        arrays = {name: load_array(name, index_dir, manifest) for name in BM25_ARRAYS}
+        if any(a is None for a in arrays.values()):
+            return None
+        return cls(arrays, products)
+
+    def exact_match(self, query, rows=None):
+        matches = self.names.get(normalize_name(query), [])
+        if rows is not None and matches:
+            allowed = set(rows.tolist())
+            matches = [i for i in matches if i in allowed]
+        return np.array(matches, dtype=np.intp)
+
+    def query_matrix(self, queries):
+        indptr, indices = [0], []
+        for query in queries:
+            ids = {self.term_ids[t] for t in tokenize(query) if t in self.term_ids}
+            indices.extend(sorted(ids))
+            indptr.append(len(indices))
+        data = np.ones(len(indices), dtype=np.float32)
+        return sparse.csr_matrix((data, indices, indptr), shape=(len(queries), self.postings.shape[0]))
+
+    def search(self, queries, k=10, rows=None):
+        # Returns one array of row ids per query, best first; only rows that
+        # share at least one term with the query (BM25 > 0) are returned.
+        scores = (self.query_matrix(queries) @ self.postings).tocsr()
+        eligible = None
+        if rows is not None:
+            eligible = np.zeros(scores.shape[1], dtype=bool)
+            eligible[rows] = True
+        results = []
+        for qi in range(len(queries)):
+            start, end = scores.indptr[qi], scores.indptr[qi + 1]
+            docs, doc_scores = scores.indices[start:end], scores.data[start:end]
+            if eligible is not None:
+                keep = eligible[docs]
+                docs, doc_scores = docs[keep], doc_scores[keep]
+            if len(docs) > k:
+                top = np.argpartition(-doc_scores, k - 1)[:k]
+                docs, doc_scores = docs[top], doc_scores[top]
+            order = np.argsort(-doc_scores, kind="stable")
+            results.append(docs[order].astype(np.intp))
+        return results
+
+
+if __name__ == "__main__":
+    # Build (or rebuild) the BM25 postings for an existing index without re-encoding
+    parser = argparse.ArgumentParser(description="Build a BM25 keyword index for an existing product index.")
+    parser.add_argument("index_dir", nargs="?", default=INDEX_DIR)
+    args = parser.parse_args()
+
+    products, _, _ = load_index(args.index_dir)
+    arrays = build_bm25(products)
+    add_arrays(arrays, args.index_dir, extra=bm25_manifest(arrays))
+    print(f"Built BM25 index with {len(arrays['bm25_vocab'])} terms for {len(products)} products in {args.index_dir}/.")
@@ -0,0 +1,237 @@
+import bisect
+import threading
+import time
+from contextvars import ContextVar
+
+# In-process metrics for the API, rendered in the Prometheus text format on
+# /metrics. Counters and histograms are lock-protected dicts keyed by label
+# values (no client library needed); callback gauges read their value when
+# scraped. stage() times one step of the request path into the stage
+# histogram and into the current request's timings, which MetricsMiddleware
+# can send back as a Server-Timing header.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+REGISTRY = []
+
+# Per-request {stage: seconds}, set by MetricsMiddleware
+_timings = ContextVar("request_timings", default=None)
+# Set by handler_done(); response start minus this is the serialization time
+HANDLER_DONE = "_handler_done"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def samples(self):
+        # [(sample name, [(label, value), ...], value)]
+        return []
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for name, pairs, value in self.samples():
+            lines.append(f"{name}{_format_labels(pairs)} {_format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self._values = {}
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        return [(self.name, list(zip(self.labels, key)), value) for key, value in sorted(values)]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS, labels=()):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+
+    def observe(self, value, *label_values):
+        # Bucket i counts values <= buckets[i]; the last slot is +Inf
+        slot = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][slot] += 1
+            series[1] += value
+            series[2] += 1
+
+    def samples(self):
+        with self._lock:
+            series = [(key, list(counts), total, count) for key, (counts, total, count) in self._series.items()]
+        samples = []
+        for key, counts, total, count in sorted(series):
+            pairs = list(zip(self.labels, key))
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                samples.append((f"{self.name}_bucket", pairs + [("le", _format_value(float(bound)))], cumulative))
+            samples.append((f"{self.name}_sum", pairs, total))
+            samples.append((f"{self.name}_count", pairs, count))
+        return samples
+
+
+class Gauge(Metric):
+    # Value read from fn() at scrape time: a number, None (no sample) or, with
+    # labels, a {label values tuple: number} dict. kind="counter" exposes a
+    # monotonic count kept elsewhere (e.g. the query cache's hits).
+    def __init__(self, name, help, fn, labels=(), kind="gauge"):
+        super().__init__(name, help, labels)
+        self.fn = fn
+        self.kind = kind
+
+    def samples(self):
+        value = self.fn()
+        if value is None:
+            return []
+        if not self.labels:
+            return [(self.name, [], value)]
+        return [(self.name, list(zip(self.labels, key)), v) for key, v in sorted(value.items()) if v is not None]
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+REQUESTS = Counter("recommender_http_requests_total", "HTTP requests by route and status.", ("route", "status"))
+REQUEST_SECONDS = Histogram("recommender_http_request_duration_seconds", "HTTP request latency by route.",
+                            labels=("route",))
+STAGE_SECONDS = Histogram("recommender_stage_duration_seconds",
+                          "Time spent in each stage of the request path (queue, encode, dot, topk, ...).",
+                          labels=("stage",))
+
+
+def current_timings():
+    return _timings.get()
+
+
+def observe_stage(name, seconds, timings=None):
+    STAGE_SECONDS.observe(seconds, name)
+    timings = timings if timings is not None else _timings.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + seconds
+
+
+class stage:
+    # with stage("encode"): ...
+    __slots__ = ("name", "started")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe_stage(self.name, time.perf_counter() - self.started)
+
+
+def collect_into(timings, fn, *args):
+    # Run fn with its stage timings added to `timings` (used on worker threads)
+    token = _timings.set(timings)
+    try:
+        return fn(*args)
+    finally:
+        _timings.reset(token)
+
+
+def merge_timings(timings, into):
+    if into is not None:
+        for name, seconds in timings.items():
+            into[name] = into.get(name, 0.0) + seconds
+
+
+def handler_done():
+    # Called by an endpoint right before it returns
+    timings = _timings.get()
+    if timings is not None:
+        timings[HANDLER_DONE] = time.perf_counter()
+
+
+def server_timing(timings, total):
+    parts = [f"{name};dur={seconds * 1000:.3f}" for name, seconds in timings.items() if name != HANDLER_DONE]
+    parts.append(f"total;dur={total * 1000:.3f}")
+    return ", ".join(parts)
+
+
+class MetricsMiddleware:
+    # Plain ASGI middleware: counts and times every HTTP request by route
+    # template, times response serialization (endpoint return -> response
+    # start) and, with server_timing=True, adds a Server-Timing header with
+    # the request's stage timings in milliseconds.
+    def __init__(self, app, server_timing=False):
+        self.app = app
+        self.server_timing = server_timing
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+        timings = {}
+        token = _timings.set(timings)
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                now = time.perf_counter()
+                done = timings.pop(HANDLER_DONE, None)
+                if done is not None:
+                    observe_stage("serialize", now - done, timings)
+                if self.server_timing:
+                    header = server_timing(timings, now - started).encode("latin-1")
+                    message = {**message, "headers": list(message.get("headers", [])) + [(b"server-timing", header)]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _timings.reset(token)
+            route = getattr(scope.get("route"), "path", None) or "other"
+            REQUESTS.inc(route, str(status))
+            REQUEST_SECONDS.observe(time.perf_counter() - started, route)
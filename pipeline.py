@@ -0,0 +1,307 @@
+import argparse
+import asyncio
+import json
+import os
+import queue
+import shutil
+import threading
+import time
+
+import numpy as np
+
+from create_embeddings import INPUT_FILE, embed_products, write_index
+from dedup import DUP_THRESHOLD
+from encoders import ENCODER_BACKEND, get_encoder
+from http_cache import CACHE_DIR, HTTPCache
+from index_store import INDEX_DIR, MODEL_NAME, content_hash, normalize_rows, product_text, reusable_vectors
+from quantize import QUANTIZED_DTYPES
+from scrape_catalog import CONCURRENCY, LIST_PARALLEL, SCRAPE_ORIGIN, Crawler
+
+# Streaming refresh: scrape -> JSONL -> encoder -> index in one run. Each
+# product is appended to products.jsonl as soon as its detail page is parsed
+# and handed to an encoder thread that batches products while scraping goes
+# on, so the refresh takes about max(scrape, encode) instead of their sum.
+# State directory:
+#   products.jsonl - completed products, one JSON object per line
+#   vectors.f32    - float32 rows appended by the encoder thread
+#   vectors.idx    - content hash of each vectors.f32 row, one per line
+#   spool.json     - model name and dimension of the spooled vectors
+# After a crash, re-running resumes from here: products already in
+# products.jsonl are not fetched again and spooled vectors are not re-encoded.
+# The directory is removed once the index has been written.
+STATE_DIR = "pipeline_state"
+BATCH_SIZE = 64
+BATCH_WAIT_S = 0.5
+# Products waiting for the encoder, in batches; when it falls behind, the
+# crawler waits instead of queueing the whole catalog in memory
+QUEUE_BATCHES = 8
+
+
+def _complete_lines(path):
+    # Lines up to the last newline; a crash can leave a partial final line,
+    # which is cut off so appends start on a clean line.
+    if not os.path.exists(path):
+        return []
+    with open(path, "rb") as f:
+        data = f.read()
+    end = data.rfind(b"\n") + 1
+    if end < len(data):
+        with open(path, "r+b") as f:
+            f.truncate(end)
+    return data[:end].decode("utf-8").splitlines()
+
+
+def read_products(path):
+    products = {}
+    for line in _complete_lines(path):
+        try:
+            product = json.loads(line)
+        except ValueError:
+            continue
+        products[product['url']] = product
+    return products
+
+
+class VectorSpool:
+    def __init__(self, state_dir, model_name=MODEL_NAME):
+        self.vectors_path = os.path.join(state_dir, "vectors.f32")
+        self.index_path = os.path.join(state_dir, "vectors.idx")
+        self.meta_path = os.path.join(state_dir, "spool.json")
+        self.model_name = model_name
+        self.dimension = None
+        self.rows = {}
+
+        meta = None
+        if os.path.exists(self.meta_path):
+            try:
+                with open(self.meta_path, "r") as f:
+                    meta = json.load(f)
+            except ValueError:
+                pass
+        if not meta or meta.get("model_name") != model_name:
+            for path in (self.vectors_path, self.index_path, self.meta_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            return
+
+        # Keep only rows that made it to both files
+        self.dimension = meta["dimension"]
+        hashes = _complete_lines(self.index_path)
+        size = os.path.getsize(self.vectors_path) if os.path.exists(self.vectors_path) else 0
+        n_rows = min(len(hashes), size // (4 * self.dimension))
+        with open(self.vectors_path, "ab") as f:
+            f.truncate(n_rows * 4 * self.dimension)
+        if n_rows < len(hashes):
+            with open(self.index_path, "w") as f:
+                f.writelines(h + "\n" for h in hashes[:n_rows])
+        self.rows = {h.encode("ascii"): i for i, h in enumerate(hashes[:n_rows])}
+
+    def append(self, hashes, vectors):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        # Vectors first, then their hashes: a row only counts once its hash is
+        # written. The meta comes last, so a spool that has one has both files.
+        with open(self.vectors_path, "ab") as f:
+            f.write(vectors.tobytes())
+        with open(self.index_path, "a") as f:
+            f.writelines(h.decode("ascii") + "\n" for h in hashes)
+        if self.dimension is None:
+            self.dimension = vectors.shape[1]
+            with open(self.meta_path + ".tmp", "w") as f:
+                json.dump({"model_name": self.model_name, "dimension": self.dimension}, f)
+            os.replace(self.meta_path + ".tmp", self.meta_path)
+        for h in hashes:
+            self.rows[h] = len(self.rows)
+
+    def matrix(self):
+        if self.dimension is None:
+            return None
+        return np.fromfile(self.vectors_path, dtype=np.float32).reshape(-1, self.dimension)[:len(self.rows)]
+
+
+class EncoderStage(threading.Thread):
+    # Consumer thread: batches queued products (up to batch_size, or whatever
+    # arrived within BATCH_WAIT_S) and spools their vectors. Hashes already in
+    # the spool or in the current index are skipped.
+    def __init__(self, spool, skip=(), batch_size=BATCH_SIZE, wait_s=BATCH_WAIT_S, queue_batches=QUEUE_BATCHES):
+        super().__init__(name="encoder", daemon=True)
+        self.spool = spool
+        self.skip = set(skip)
+        self.batch_size = batch_size
+        self.wait_s = wait_s
+        self.queue = queue.Queue(maxsize=batch_size * queue_batches)
+        self.model = None
+        self.backend = None
+        self.error = None
+        self.stats = {"encoded": 0, "batches": 0, "busy_s": 0.0}
+
+    def submit(self, product):
+        # Blocks while the queue is full; raises once the encoder thread has
+        # stopped on an error, which ends the crawl
+        while True:
+            if self.error is not None:
+                raise RuntimeError(f"Encoder stage failed: {self.error}") from self.error
+            try:
+                self.queue.put(product, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def close(self):
+        # A thread that already stopped on an error no longer drains the queue
+        while self.is_alive():
+            try:
+                self.queue.put(None, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def run(self):
+        try:
+            finished = False
+            while not finished:
+                batch = [self.queue.get()]
+                if batch[0] is None:
+                    break
+                deadline = time.monotonic() + self.wait_s
+                while len(batch) < self.batch_size:
+                    try:
+                        item = self.queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        finished = True
+                        break
+                    batch.append(item)
+                self.encode(batch)
+        except Exception as e:
+            self.error = e
+
+    def encode(self, products):
+        pending = {}
+        for p in products:
+            h = content_hash(p, MODEL_NAME).encode("ascii")
+            if h not in self.skip and h not in self.spool.rows:
+                pending[h] = product_text(p)
+        if not pending:
+            return
+        started = time.perf_counter()
+        if self.model is None:
+            self.model = get_encoder()
+            self.backend = self.model.backend
+        vectors = normalize_rows(self.model.encode(list(pending.values())))
+        self.spool.append(list(pending), vectors)
+        self.stats["encoded"] += len(pending)
+        self.stats["batches"] += 1
+        self.stats["busy_s"] += time.perf_counter() - started
+
+
+async def scrape_streaming(stage, state_dir, origin, concurrency, list_parallel, cache_dir):
+    products_path = os.path.join(state_dir, "products.jsonl")
+    done = read_products(products_path)
+    log = open(products_path, "a", encoding="utf-8")
+    log_lock = threading.Lock()
+
+    # stage.submit blocks while the encoder is behind, and the log is file
+    # I/O, so both run in worker threads instead of on the event loop
+    def submit_all(products):
+        for product in products:
+            stage.submit(product)
+
+    def record(product):
+        line = json.dumps(product, ensure_ascii=False) + "\n"
+        with log_lock:
+            if log.closed:
+                return
+            log.write(line)
+            log.flush()
+        stage.submit(product)
+
+    async def on_product(product, ok):
+        # Only completed detail fetches are logged and encoded; failed ones are
+        # retried on resume, or encoded from their list-page fields at the end
+        if ok:
+            await asyncio.to_thread(record, product)
+
+    # Resumed products may not have been encoded before the crash; they are
+    # queued while the crawl goes on
+    resumed = asyncio.create_task(asyncio.to_thread(submit_all, list(done.values())))
+    crawler = Crawler(origin, concurrency, cache=HTTPCache(cache_dir) if cache_dir else None)
+    try:
+        products = await crawler.scrape_list_pages(list_parallel)
+        pending = []
+        for product in products:
+            if product['url'] in done:
+                product.update(done[product['url']])
+            else:
+                pending.append(product)
+        print(f"Step 2: Fetching details for {len(pending)} products ({len(products) - len(pending)} resumed), "
+              f"encoding as they arrive...")
+        await crawler.fetch_all_details(pending, on_product)
+        await resumed
+    finally:
+        await crawler.close()
+        # Still queueing if the crawl failed; its own error is already raised
+        await asyncio.gather(resumed, return_exceptions=True)
+        with log_lock:
+            log.close()
+    return products, crawler.stats
+
+
+def run_pipeline(origin=SCRAPE_ORIGIN, concurrency=CONCURRENCY, list_parallel=LIST_PARALLEL, cache_dir=CACHE_DIR,
+                 state_dir=STATE_DIR, batch_size=BATCH_SIZE, ivf=False, ivf_lists=None, ivf_iters=20,
+                 quantize_dtype=None, knn_neighbors=0, dedup=False, dedup_threshold=DUP_THRESHOLD):
+    started = time.perf_counter()
+    os.makedirs(state_dir, exist_ok=True)
+    # Spooled vectors from a run with another backend are discarded on resume
+    spool = VectorSpool(state_dir, f"{MODEL_NAME}/{ENCODER_BACKEND}")
+    known, _, _ = reusable_vectors(INDEX_DIR, MODEL_NAME, ENCODER_BACKEND)
+    stage = EncoderStage(spool, skip=known, batch_size=batch_size)
+    stage.start()
+
+    try:
+        products, scrape_stats = asyncio.run(
+            scrape_streaming(stage, state_dir, origin, concurrency, list_parallel, cache_dir))
+    finally:
+        stage.close()
+        stage.join()
+    if stage.error:
+        raise stage.error
+    scraped_s = time.perf_counter() - started
+
+    with open(INPUT_FILE, "w") as f:
+        json.dump(products, f, indent=2)
+
+    # Finalize: spooled + reused vectors, anything still missing is encoded here
+    embeddings, hashes, backend, previous = embed_products(products, spooled=(spool.rows, spool.matrix()))
+    write_index(products, embeddings, hashes, stage.backend or backend, previous, ivf=ivf, ivf_lists=ivf_lists,
+                ivf_iters=ivf_iters, quantize_dtype=quantize_dtype, knn_neighbors=knn_neighbors,
+                dedup=dedup, dedup_threshold=dedup_threshold)
+    shutil.rmtree(state_dir)
+
+    print(f"Pipeline done in {time.perf_counter() - started:.1f}s: scrape finished at {scraped_s:.1f}s "
+          f"({scrape_stats['downloaded']} downloaded, {scrape_stats['not_modified']} unchanged), "
+          f"encoder busy {stage.stats['busy_s']:.1f}s for {stage.stats['encoded']} products "
+          f"in {stage.stats['batches']} batches.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scrape, encode and index the catalog in one streaming pass.")
+    parser.add_argument("--origin", default=SCRAPE_ORIGIN)
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    parser.add_argument("--list-parallel", type=int, default=LIST_PARALLEL)
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument("--state-dir", default=STATE_DIR, help="resumable intermediate state")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--ivf", action="store_true")
+    parser.add_argument("--ivf-lists", type=int, default=None)
+    parser.add_argument("--ivf-iters", type=int, default=20)
+    parser.add_argument("--quantize", choices=QUANTIZED_DTYPES, default=None)
+    parser.add_argument("--knn-neighbors", type=int, default=0)
+    parser.add_argument("--dedup", action="store_true")
+    parser.add_argument("--dedup-threshold", type=float, default=DUP_THRESHOLD)
+    args = parser.parse_args()
+    run_pipeline(args.origin, args.concurrency, args.list_parallel, None if args.no_cache else args.cache_dir,
+                 args.state_dir, args.batch_size, ivf=args.ivf, ivf_lists=args.ivf_lists, ivf_iters=args.ivf_iters,
+                 quantize_dtype=args.quantize, knn_neighbors=args.knn_neighbors,
+                 dedup=args.dedup, dedup_threshold=args.dedup_threshold)
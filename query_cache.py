@@ -0,0 +1,84 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+def normalize_query(text):
+    # "  Java   Developer " and "java developer" share one cache entry
+    return " ".join(str(text).lower().split())
+
+
+class LRUCache:
+    # Bounded, thread-safe LRU map with optional TTL (seconds) and counters.
+    # bind_version() drops every entry when the index artifact changes, so a
+    # cached ranking can never point at rows of a different catalog.
+    def __init__(self, max_size=1024, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.version = None
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        if self.max_size <= 0:
+            return None
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            value, stored_at = item
+            if self.ttl is not None and time.monotonic() - stored_at > self.ttl:
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._data[key] = (value, time.monotonic())
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def bind_version(self, version):
+        with self._lock:
+            if version == self.version:
+                return
+            if self._data:
+                self.invalidations += 1
+            self._data.clear()
+            self.version = version
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+            "index_version": self.version,
+        }
@@ -0,0 +1,84 @@
+import argparse
+import hashlib
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from http_cache import CACHE_DIR, HTTPCache
+from catalog_parser import SITE_URL
+
+# Local stand-in for the catalog site: serves the pages recorded in a scraper
+# HTTP cache (see http_cache.py) with ETag / Last-Modified validators, so the
+# crawler, its conditional GETs and its retries can be exercised offline:
+#   python scrape_catalog.py                       # record (fills scrape_cache/)
+#   python replay_server.py --port 8765            # serve the recording
+#   python scrape_catalog.py --origin http://127.0.0.1:8765 --cache-dir /tmp/c
+# --fail-rate injects 503s (with Retry-After: --retry-after, default 0) and
+# --latency-ms adds delay. --port 0 picks a free port; the startup line shows it.
+
+
+def load_pages(cache_dir):
+    pages = {}
+    for entry in HTTPCache(cache_dir).entries():
+        url = entry["url"]
+        path = url[len(SITE_URL):] if url.startswith(SITE_URL) else url
+        body = entry["body"].encode("utf-8")
+        etag = entry.get("etag") or '"%s"' % hashlib.sha256(body).hexdigest()[:16]
+        pages[path] = (body, etag, entry.get("last_modified"))
+    return pages
+
+
+def make_handler(pages, fail_rate=0.0, latency_ms=0, retry_after=0):
+    class ReplayHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            if latency_ms:
+                time.sleep(latency_ms / 1000)
+            if fail_rate and random.random() < fail_rate:
+                return self.reply(503, b"", {"Retry-After": str(retry_after)})
+            page = pages.get(self.path)
+            if page is None:
+                return self.reply(404, b"Not recorded", {})
+            body, etag, last_modified = page
+            headers = {"ETag": etag, "Content-Type": "text/html; charset=utf-8"}
+            if last_modified:
+                headers["Last-Modified"] = last_modified
+            if self.headers.get("If-None-Match") == etag:
+                return self.reply(304, b"", headers)
+            return self.reply(200, body, headers)
+
+        def reply(self, status, body, headers):
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            if body:
+                self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return ReplayHandler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve recorded catalog pages from a scraper HTTP cache.")
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="fraction of requests answered with 503")
+    parser.add_argument("--latency-ms", type=int, default=0, help="delay added to every response")
+    parser.add_argument("--retry-after", type=int, default=0, help="Retry-After seconds sent with injected 503s")
+    args = parser.parse_args()
+
+    pages = load_pages(args.cache_dir)
+    handler = make_handler(pages, args.fail_rate, args.latency_ms, args.retry_after)
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    host, port = server.server_address[:2]
+    print(f"Replaying {len(pages)} recorded pages on http://{host}:{port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,118 @@
+import numpy as np
+
+from filters import AttributeIndex
+from index_store import INDEX_DIR, load_index
+from metrics import stage
+
+
+def normalize_queries(query_vecs):
+    query_vecs = np.atleast_2d(np.asarray(query_vecs, dtype=np.float32))
+    norm = np.linalg.norm(query_vecs, axis=1, keepdims=True)
+    return query_vecs / (norm + 1e-9)
+
+
+def encode_queries(model, queries, return_truncated=False):
+    # One encode call for the whole list, returns (n_queries, dim) unit vectors
+    # (and, with return_truncated, which queries were cut to the token budget)
+    if return_truncated:
+        vectors, truncated = model.encode(list(queries), convert_to_numpy=True, return_truncated=True)
+        return normalize_queries(vectors), truncated
+    return normalize_queries(model.encode(list(queries), convert_to_numpy=True))
+
+
+def top_k_indices(scores, k):
+    # scores: (n_queries, n_rows). argpartition is O(n) per row; only the k
+    # survivors get sorted, so we never pay for a full O(n log n) argsort.
+    n_rows = scores.shape[1]
+    k = min(k, n_rows)
+    if k <= 0:
+        return np.empty((scores.shape[0], 0), dtype=np.intp)
+    if k < n_rows:
+        candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        candidates = np.tile(np.arange(n_rows), (scores.shape[0], 1))
+    candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+    order = np.argsort(-candidate_scores, axis=1, kind="stable")
+    return np.take_along_axis(candidates, order, axis=1)
+
+
+class Retriever:
+    def __init__(self, embeddings, products, manifest=None, ivf=None, nprobe=None,
+                 quantized=None, rerank_depth=None):
+        # embeddings are expected L2-normalized (index_store guarantees it).
+        # With an IVF index and nprobe > 0, search() scans only the probed lists.
+        # With a quantized matrix, the full scan runs on it and only the top
+        # `rerank_depth` rows are re-scored at full precision.
+        self.embeddings = embeddings
+        self.products = products
+        self.manifest = manifest or {}
+        self.ivf = ivf
+        self.nprobe = nprobe
+        self.quantized = quantized
+        self.rerank_depth = rerank_depth
+        self.attributes = AttributeIndex(products)
+        self.lexical = None
+        self.knn = None
+
+    @classmethod
+    def from_index(cls, index_dir=INDEX_DIR, mmap=True, nprobe=None, use_quantized=True, rerank_depth=None):
+        # local imports: ann_index and quantize depend on this module
+        from ann_index import IVFIndex
+        from knn_graph import KnnGraph
+        from lexical_index import LexicalIndex, build_bm25
+        from quantize import QuantizedMatrix
+
+        products, embeddings, manifest = load_index(index_dir, mmap=mmap)
+        ivf = IVFIndex.load(index_dir, manifest)
+        quantized = QuantizedMatrix.load(index_dir, manifest) if use_quantized else None
+        retriever = cls(embeddings, products, manifest, ivf=ivf, nprobe=nprobe,
+                        quantized=quantized, rerank_depth=rerank_depth)
+        # Indexes built before BM25 support get their postings built in memory
+        retriever.lexical = LexicalIndex.load(products, index_dir, manifest) or LexicalIndex(build_bm25(products), products)
+        retriever.knn = KnnGraph.load(index_dir, manifest)
+        return retriever
+
+    def __len__(self):
+        return len(self.products)
+
+    def search(self, query_vecs, k=10, nprobe=None, rows=None):
+        # query_vecs: (n_queries, dim) or (dim,), already normalized.
+        # rows: optional eligible row ids (see filters.AttributeIndex.rows);
+        # only those rows are scored, exactly, so top-k always fills from them.
+        # Returns (indices, scores), both shaped (n_queries, min(k, eligible)).
+        query_vecs = np.atleast_2d(query_vecs)
+        if rows is not None:
+            with stage("dot"):
+                scores = query_vecs @ np.asarray(self.embeddings[rows]).T
+            with stage("topk"):
+                top = top_k_indices(scores, k)
+            return rows[top], np.take_along_axis(scores, top, axis=1)
+        nprobe = self.nprobe if nprobe is None else nprobe
+        if self.ivf is not None and nprobe:
+            with stage("ivf_search"):
+                return self.ivf.search(query_vecs, self.embeddings, k=k, nprobe=nprobe)
+        if self.quantized is not None:
+            with stage("quantized_search"):
+                if self.rerank_depth:
+                    return self.quantized.search(query_vecs, self.embeddings, k=k, rerank_depth=self.rerank_depth)
+                return self.quantized.search(query_vecs, self.embeddings, k=k)
+        with stage("dot"):
+            scores = query_vecs @ self.embeddings.T
+        with stage("topk"):
+            indices = top_k_indices(scores, k)
+        return indices, np.take_along_axis(scores, indices, axis=1)
+
+    def similar(self, row, k=10, rows=None):
+        # Products most similar to product `row`, itself excluded. Read from
+        # the precomputed neighbour table when it has k eligible entries;
+        # otherwise (no table, or a filter that leaves too few of the stored
+        # neighbours) one exact scan over the eligible rows.
+        if self.knn is not None:
+            with stage("knn"):
+                ids = self.knn.lookup(row, rows)
+            if len(ids) >= k:
+                return ids[:k]
+        query_vec = np.asarray(self.embeddings[row], dtype=np.float32)
+        indices, _ = self.search(query_vec, k=k + 1, nprobe=0, rows=rows)
+        indices = indices[0]
+        return indices[indices != row][:k]
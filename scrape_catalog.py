@@ -1,194 +1,190 @@
-
-import requests
-from bs4 import BeautifulSoup
+import argparse
+import asyncio
 import json
-import re
+import os
+import random
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
 
-BASE_URL = "https://www.shl.com/solutions/products/product-catalog/"
+import httpx
+
+from catalog_parser import SITE_URL, parse_list_page, parse_product_page
+from http_cache import CACHE_DIR, HTTPCache
+
+# Product URLs keep the canonical SITE_URL origin whatever we fetch from
+CATALOG_PATH = "/solutions/products/product-catalog/"
+BASE_URL = SITE_URL + CATALOG_PATH
 OUTPUT_FILE = "shl_products.json"
 HEADERS = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
 }
 
-def scrape_list_pages():
-    products = []
-    start = 0
-    type_param = 1 # Individual Test Solutions
-    
-    print("Step 1: Scraping Catalog List...")
-    
-    while True:
+# Where requests actually go; point at replay_server.py for a local stand-in
+SCRAPE_ORIGIN = os.environ.get("SCRAPE_ORIGIN", SITE_URL)
+CONCURRENCY = int(os.environ.get("SCRAPE_CONCURRENCY", "10"))
+# List pages fetched speculatively per wave; the first empty page ends the walk
+LIST_PARALLEL = int(os.environ.get("SCRAPE_LIST_PARALLEL", "4"))
+PAGE_SIZE = 12
+RETRIES = 3
+BACKOFF_S = 0.5
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+TIMEOUT_S = 10
+
+class Crawler:
+    # One pooled keep-alive client for the whole run; a semaphore bounds the
+    # number of requests in flight.
+    def __init__(self, origin=SCRAPE_ORIGIN, concurrency=CONCURRENCY, cache=None, retries=RETRIES):
+        self.origin = origin.rstrip('/')
+        self.cache = cache
+        self.retries = retries
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.client = httpx.AsyncClient(
+            headers=HEADERS,
+            timeout=TIMEOUT_S,
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency),
+        )
+        self.stats = {"downloaded": 0, "not_modified": 0, "retries": 0, "failed": 0}
+
+    async def close(self):
+        await self.client.aclose()
+
+    def fetch_url(self, url):
+        # Canonical shl.com URL -> URL on the configured origin
+        if url.startswith(SITE_URL):
+            return self.origin + url[len(SITE_URL):]
+        return url
+
+    async def fetch(self, url):
+        # Returns (status, html); html is None unless the page is available.
+        # A 304 answer to a conditional GET returns the cached body.
+        entry = self.cache.get(url) if self.cache else None
+        headers = HTTPCache.validators(entry)
+        error = None
+        for attempt in range(self.retries + 1):
+            retry_after = None
+            try:
+                async with self.semaphore:
+                    resp = await self.client.get(self.fetch_url(url), headers=headers)
+            except httpx.TransportError as e:
+                error = f"{type(e).__name__}: {e}"
+            else:
+                if resp.status_code == 304 and entry:
+                    self.stats["not_modified"] += 1
+                    return 200, entry["body"]
+                if resp.status_code == 200:
+                    self.stats["downloaded"] += 1
+                    if self.cache:
+                        self.cache.put(url, resp.text, resp.headers)
+                    return 200, resp.text
+                if resp.status_code not in RETRY_STATUSES:
+                    return resp.status_code, None
+                error = f"HTTP {resp.status_code}"
+                retry_after = resp.headers.get("retry-after")
+            if attempt < self.retries:
+                self.stats["retries"] += 1
+                # Exponential backoff with jitter; honour a numeric Retry-After
+                delay = BACKOFF_S * (2 ** attempt) * (0.5 + random.random())
+                if retry_after and retry_after.isdigit():
+                    delay = max(delay, int(retry_after))
+                await asyncio.sleep(delay)
+        self.stats["failed"] += 1
+        print(f"  Giving up on {url}: {error}")
+        return None, None
+
+    async def fetch_list_page(self, start, type_param=1):
         url = f"{BASE_URL}?start={start}&type={type_param}"
-        print(f"  Fetching {url}...")
+        status, html = await self.fetch(url)
+        if html is None:
+            if status is not None:
+                print(f"  Failed: {status} for {url}")
+            return None
+        return await asyncio.to_thread(parse_list_page, html)
+
+    async def scrape_list_pages(self, parallel=LIST_PARALLEL):
+        products = []
+        start = 0
         
-        try:
-            resp = requests.get(url, headers=HEADERS, timeout=10)
-            if resp.status_code != 200:
-                print(f"  Failed: {resp.status_code}")
-                break
-                
-            soup = BeautifulSoup(resp.text, 'html.parser')
-            rows = soup.find_all('tr', attrs={'data-entity-id': True})
-            
-            if not rows:
-                print("  No more rows found.")
+        print("Step 1: Scraping Catalog List...")
+        
+        # Fetch `parallel` pages at a time past the last known page; results
+        # are used in page order up to the first empty (or failed) page
+        while True:
+            starts = [start + i * PAGE_SIZE for i in range(parallel)]
+            pages = await asyncio.gather(*(self.fetch_list_page(s) for s in starts))
+            done = False
+            for page_start, rows in zip(starts, pages):
+                if not rows:
+                    print(f"  No more rows found at start={page_start}.")
+                    done = True
+                    break
+                products.extend(rows)
+            if done:
                 break
+            start += parallel * PAGE_SIZE
                 
-            for row in rows:
-                # 1. Title & URL
-                title_td = row.find('td', class_='custom__table-heading__title')
-                if not title_td: continue
-                link = title_td.find('a')
-                if not link: continue
-                
-                title = link.get_text(strip=True)
-                href = link['href']
-                if not href.startswith('http'):
-                    href = "https://www.shl.com" + href
-                
-                # 2. Remote Support (2nd column, index 1)
-                cells = row.find_all('td')
-                remote_support = "No"
-                if len(cells) > 1:
-                    circle = cells[1].find('span', class_='catalogue__circle -yes')
-                    if circle:
-                        remote_support = "Yes"
-
-                # 3. Adaptive Support (3rd column, index 2)
-                adaptive_support = "No"
-                if len(cells) > 2:
-                    circle = cells[2].find('span', class_='catalogue__circle -yes')
-                    if circle:
-                        adaptive_support = "Yes"
-                
-                # 4. Test Types
-                test_types = []
-                keys_td = row.find('td', class_='product-catalogue__keys')
-                if keys_td:
-                    keys = keys_td.find_all('span', class_='product-catalogue__key')
-                    test_types = [k.get_text(strip=True) for k in keys if k.get_text(strip=True)]
-                
-                # Check mapping for Types to Full Names
-                # A=Ability, B=Behavior, C=Competency, P=Personality, K=Knowledge, S=Simulations
-                type_map = {
-                    "A": "Ability & Aptitude",
-                    "B": "Biodata & Situational Judgement",
-                    "C": "Competencies",
-                    "D": "Development & 360",
-                    "E": "Assessment Exercises",
-                    "K": "Knowledge & Skills",
-                    "P": "Personality & Behavior",
-                    "S": "Simulations"
-                }
-                full_test_types = [type_map.get(t, t) for t in test_types]
-
-                products.append({
-                    "name": title,
-                    "url": href,
-                    "remote_support": remote_support,
-                    "adaptive_support": adaptive_support,
-                    "test_type": full_test_types,
-                    "description": "", # To be filled
-                    "duration": 0      # To be filled
-                })
-            
-            start += 12
-            # Safety break
-            # if len(products) > 20: break 
-            
+        print(f"  Collected {len(products)} products initial info.")
+        return products
+
+    async def fetch_product_details(self, product):
+        # Returns True when the detail page was fetched and parsed
+        _, html = await self.fetch(product['url'])
+        if html is None:
+            return False
+        try:
+            await asyncio.to_thread(parse_product_page, html, product)
         except Exception as e:
-            print(f"  Error on list page: {e}")
-            break
-            
-    print(f"  Collected {len(products)} products initial info.")
-    return products
-
-def fetch_product_details(product):
-    url = product['url']
-    try:
-        resp = requests.get(url, headers=HEADERS, timeout=10)
-        if resp.status_code == 200:
-            soup = BeautifulSoup(resp.text, 'html.parser')
-            
-            # Duration
-            # H4 sibling logic or text search
-            duration = 0
-            text_body = soup.get_text()
-            
-            # Try specific structure first
-            # <h4>Assessment length</h4> <p>... 49 ...</p>
-            h4_dur = soup.find('h4', string=re.compile(r'Assessment length|Time', re.I))
-            if h4_dur:
-                p_next = h4_dur.find_next_sibling('p')
-                if p_next:
-                    dur_text = p_next.get_text(strip=True)
-                    match = re.search(r'(\d+)', dur_text)
-                    if match:
-                        duration = int(match.group(1))
-            
-            if duration == 0:
-                # Fallback to regex in full text
-                match = re.search(r'(?:Time|Duration).*?(\d+)\s*(?:min|minute)', text_body, re.I)
-                if match:
-                    duration = int(match.group(1))
-            
-            product['duration'] = duration
-            
-            # Description
-            # <h4>Description</h4> <p>...</p>
-            desc = ""
-            h4_desc = soup.find('h4', string=re.compile(r'Description', re.I))
-            if h4_desc:
-                p_next = h4_desc.find_next_sibling('p')
-                if p_next:
-                    desc = p_next.get_text(strip=True)
-            
-            if not desc:
-                # Fallback to .product-catalogue-training-calendar__row typ p (first paragraph)
-                container = soup.find('div', class_='product-catalogue-training-calendar__row typ')
-                if container:
-                    p_tag = container.find('p')
-                    if p_tag:
-                         desc = p_tag.get_text(strip=True)
-
-            if not desc:
-                # Fallback to meta description
-                meta = soup.find('meta', attrs={'name': 'description'})
-                if meta:
-                    desc = meta.get('content', '')
-            
-            product['description'] = desc
-            
-    except Exception as e:
-        print(f"Error fetching {url}: {e}")
-    
-    return product
+            print(f"Error parsing {product['url']}: {e}")
+            return False
+        return True
 
-def main():
-    products = scrape_list_pages()
-    
-    # Filter duplicates just in case
-    # Remove Pre-packaged if they slipped in (though we used type=1)
-    
-    print("Step 2: Fetching details for all products (Threaded)...")
-    
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        future_to_prod = {executor.submit(fetch_product_details, p): p for p in products}
-        
+    async def fetch_all_details(self, products, on_product=None):
+        # on_product(product, ok) is awaited as each product completes; it runs
+        # on the event loop, so blocking work belongs in a thread
         completed = 0
-        forfuture = as_completed(future_to_prod)
-        for future in forfuture:
+
+        async def one(product):
+            nonlocal completed
+            ok = await self.fetch_product_details(product)
+            if on_product:
+                await on_product(product, ok)
             completed += 1
             if completed % 20 == 0:
                 print(f"  Processed {completed}/{len(products)}...")
+
+        await asyncio.gather(*(one(p) for p in products))
+        return products
+
+async def crawl(origin=SCRAPE_ORIGIN, concurrency=CONCURRENCY, list_parallel=LIST_PARALLEL, cache_dir=CACHE_DIR):
+    crawler = Crawler(origin, concurrency, cache=HTTPCache(cache_dir) if cache_dir else None)
+    try:
+        products = await crawler.scrape_list_pages(list_parallel)
+        print(f"Step 2: Fetching details for all products ({concurrency} concurrent)...")
+        await crawler.fetch_all_details(products)
+    finally:
+        await crawler.close()
+    return products, crawler.stats
+
+def main():
+    parser = argparse.ArgumentParser(description="Scrape the SHL product catalog into shl_products.json.")
+    parser.add_argument("--origin", default=SCRAPE_ORIGIN, help="site to fetch from, e.g. a replay_server.py address")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    parser.add_argument("--list-parallel", type=int, default=LIST_PARALLEL, help="list pages fetched per wave")
+    parser.add_argument("--cache-dir", default=CACHE_DIR, help="HTTP cache for conditional re-scrapes")
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument("--output", default=OUTPUT_FILE)
+    args = parser.parse_args()
+    
+    started = time.perf_counter()
+    products, stats = asyncio.run(crawl(args.origin, args.concurrency, args.list_parallel,
+                                        None if args.no_cache else args.cache_dir))
                 
     # Save
-    with open(OUTPUT_FILE, "w") as f:
+    with open(args.output, "w") as f:
         json.dump(products, f, indent=2)
         
-    print(f"Done. Saved {len(products)} enriched products to {OUTPUT_FILE}.")
+    print(f"Done. Saved {len(products)} enriched products to {args.output} in {time.perf_counter() - started:.1f}s "
+          f"({stats['downloaded']} downloaded, {stats['not_modified']} unchanged, "
+          f"{stats['retries']} retries, {stats['failed']} failed).")
 
 if __name__ == "__main__":
     main()
@@ -2,11 +2,26 @@
 import streamlit as st
 import requests
 import pandas as pd
-import pickle
-import numpy as np
-from sentence_transformers import SentenceTransformer
 import os
 
+from requests.adapters import HTTPAdapter
+
+# Client mode: with RECOMMEND_API_URL set (e.g. http://recommender:8000) the UI
+# only calls the API and never loads the model or the index, so UI replicas
+# stay small and scale separately from the inference tier. Without it the app
+# searches a local product_index/ as before.
+API_URL = os.environ.get("RECOMMEND_API_URL", "").rstrip("/")
+API_TIMEOUT_S = float(os.environ.get("RECOMMEND_API_TIMEOUT", "10"))
+# How long a query's results are reused (the API may hot-reload its index)
+RESULT_TTL_S = int(os.environ.get("RECOMMEND_UI_CACHE_TTL", "300"))
+# /recommend always returns 10 items; deeper lists go through /recommend/batch
+API_SINGLE_K = 10
+
+class ApiWarmingUp(Exception):
+    def __init__(self, detail, retry_after):
+        super().__init__(detail)
+        self.retry_after = retry_after
+
 # Set page configuration
 st.set_page_config(
     page_title="SHL Smart Recommender",
@@ -82,22 +97,93 @@ st.markdown("""
 # Load Resources (Cached)
 @st.cache_resource
 def load_resources():
-    model = SentenceTransformer('all-MiniLM-L6-v2')
-    with open("product_embeddings.pkl", "rb") as f:
-        products = pickle.load(f)
-    embeddings = np.array([p['vector'] for p in products])
-    # Normalize
-    norm = np.linalg.norm(embeddings, axis=1, keepdims=True)
-    embeddings = embeddings / (norm + 1e-9)
-    return model, products, embeddings
-
-try:
-    model, products, embeddings_matrix = load_resources()
-    st.sidebar.success("Models Loaded Successfully! ✅")
-    st.sidebar.info(f"Database contains {len(products)} assessments.")
-except Exception as e:
-    st.error(f"Error loading resources: {e}. Please ensure data pipeline has run.")
-    st.stop()
+    from encoders import get_encoder
+    from index_store import INDEX_DIR
+    from retriever import Retriever
+    
+    model = get_encoder()
+    retriever = Retriever.from_index(INDEX_DIR)
+    return model, retriever
+
+@st.cache_resource
+def api_session():
+    # One keep-alive connection pool shared by every browser session of this process
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=32)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def api_post(path, payload):
+    response = api_session().post(f"{API_URL}{path}", json=payload, timeout=API_TIMEOUT_S)
+    if response.status_code == 503:
+        # Model or index still loading (see /health/ready); not cached, so the next click retries
+        detail = response.json().get("detail", "The recommender is starting up.")
+        raise ApiWarmingUp(detail, response.headers.get("Retry-After", "5"))
+    response.raise_for_status()
+    return response.json()
+
+def to_product(item):
+    # API items use the response field names ("remote support", "test type", ...)
+    return {
+        "name": item.get("name"),
+        "url": item.get("url"),
+        "description": item.get("description"),
+        "duration": item.get("duration", 0),
+        "remote_support": item.get("remote support", "N/A"),
+        "adaptive_support": item.get("adaptive support", "N/A"),
+        "test_type": item.get("test type", []),
+    }
+
+@st.cache_data(ttl=RESULT_TTL_S, max_entries=1024, show_spinner=False)
+def api_recommend(query, top_k):
+    # Cached per (query, top_k); warm-up and connection errors raise and are not cached
+    if top_k <= API_SINGLE_K:
+        items = api_post("/recommend", {"query": query})["recommended assessments"][:top_k]
+    else:
+        items = api_post("/recommend/batch", {"queries": [{"query": query, "k": top_k}]})["results"][0]["recommended assessments"]
+    return [to_product(item) for item in items]
+
+@st.cache_data(ttl=5, show_spinner=False)
+def api_status():
+    try:
+        response = api_session().get(f"{API_URL}/health/ready", timeout=API_TIMEOUT_S)
+        return response.json()
+    except (requests.RequestException, ValueError) as e:
+        return {"ready": False, "stage": "unreachable", "error": str(e)}
+
+def local_search(query, top_k):
+    from retriever import encode_queries
+    
+    # Encode
+    # Truncation of this query only; the cached model is shared by every session
+    query_vecs, truncated = encode_queries(model, [query], return_truncated=True)
+    if truncated[0]:
+        st.warning("Your text is longer than the model's token budget; only the beginning was used for matching.")
+    
+    # Similarity
+    top_indices, top_scores = retriever.search(query_vecs, k=top_k)
+    return [{"product": retriever.products[idx], "score": score} for idx, score in zip(top_indices[0], top_scores[0])]
+
+if API_URL:
+    status = api_status()
+    if status.get("ready"):
+        st.sidebar.success("Recommender API is ready ✅")
+        st.sidebar.info(f"Database contains {status.get('items', 0)} assessments.")
+    elif status.get("stage") == "unreachable":
+        st.sidebar.error(f"Cannot reach the recommender API at {API_URL}.")
+    elif status.get("stage") == "failed":
+        st.sidebar.error(f"Recommender API failed to start: {status.get('error')}")
+    else:
+        st.sidebar.warning(f"Recommender API is starting up ({status.get('stage')}).")
+else:
+    try:
+        model, retriever = load_resources()
+        st.sidebar.success("Models Loaded Successfully! ✅")
+        st.sidebar.info(f"Database contains {len(retriever)} assessments.")
+    except Exception as e:
+        st.error(f"Error loading resources: {e}. Please ensure data pipeline has run.")
+        st.stop()
 
 # Input Section
 col1, col2 = st.columns([2, 1])
@@ -121,20 +207,18 @@ with col2:
 # Search Logic
 if search_clicked and query:
     with st.spinner("Analyzing requirements..."):
-        # Encode
-        query_vec = model.encode([query])[0]
-        query_vec = query_vec / (np.linalg.norm(query_vec) + 1e-9)
-        
-        # Similarity
-        scores = np.dot(embeddings_matrix, query_vec)
-        top_indices = np.argsort(scores)[::-1][:top_k]
-        
-        results = []
-        for idx in top_indices:
-            results.append({
-                "product": products[idx],
-                "score": scores[idx]
-            })
+        if API_URL:
+            try:
+                # The API returns ranked items without scores
+                results = [{"product": p, "score": None} for p in api_recommend(query, top_k)]
+            except ApiWarmingUp as e:
+                st.info(f"The recommender is still starting up. Please try again in {e.retry_after} seconds. ({e})")
+                st.stop()
+            except requests.RequestException as e:
+                st.error(f"Could not reach the recommender API: {e}")
+                st.stop()
+        else:
+            results = local_search(query, top_k)
             
     # Display Results
     st.markdown(f"### Top {top_k} Recommendations")
@@ -158,7 +242,11 @@ if search_clicked and query:
             desc_display = desc
         
         # Determine Card Color based on score
-        border_color = "#28a745" if score > 0.5 else "#ffc107"
+        if score is None:
+            border_color = "#007bff"
+        else:
+            border_color = "#28a745" if score > 0.5 else "#ffc107"
+        score_html = "" if score is None else f'<p style="color: #6c757d; font-size: 0.9rem;">Relevance Score: <strong>{score:.2f}</strong></p>'
         
         types = p.get('test_type', p.get('test_types', []))
         types_html = "".join([f"<span class='metric-badge'>{t}</span>" for t in types])
@@ -168,7 +256,7 @@ if search_clicked and query:
         st.markdown(f"""
         <div class="card" style="border-left: 5px solid {border_color};">
             <h3>{name}</h3>
-            <p style="color: #6c757d; font-size: 0.9rem;">Relevance Score: <strong>{score:.2f}</strong></p>
+            {score_html}
             <p>{desc_display}</p>
             <div class="meta-info">
                 <strong>Duration:</strong> {duration_display} | 
@@ -0,0 +1,122 @@
+import asyncio
+import os
+import re
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip("httpx")
+pytest.importorskip("bs4")
+
+import scrape_catalog
+from catalog_parser import SITE_URL
+from http_cache import HTTPCache
+from scrape_catalog import BASE_URL, PAGE_SIZE, Crawler
+
+# Crawls a recording served by replay_server.py (run as its own process, as
+# the README describes) and checks retries, Retry-After and conditional GETs.
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+N_PRODUCTS = 30
+RETRY_AFTER_S = 3
+
+
+def list_page(start):
+    rows = "".join(
+        f'<tr data-entity-id="{i}">'
+        f'<td class="custom__table-heading__title"><a href="/products/product-catalog/view/test-{i}/">Test {i}</a></td>'
+        f'<td><span class="catalogue__circle -yes"></span></td><td></td>'
+        f'<td class="product-catalogue__keys"><span class="product-catalogue__key">K</span></td></tr>'
+        for i in range(start, min(start + PAGE_SIZE, N_PRODUCTS)))
+    return f"<html><body><table>{rows}</table></body></html>"
+
+
+def product_page(i):
+    return (f"<html><body><h1>Test {i}</h1><h4>Description</h4><p>Measures skill {i}.</p>"
+            f"<h4>Assessment length</h4><p>Approximate Completion Time in minutes = {10 + i}</p></body></html>")
+
+
+@pytest.fixture
+def recording(tmp_path):
+    cache = HTTPCache(str(tmp_path / "recording"))
+    # One empty list page past the end, as the live site serves
+    for start in range(0, N_PRODUCTS + PAGE_SIZE, PAGE_SIZE):
+        cache.put(f"{BASE_URL}?start={start}&type=1", list_page(start))
+    for i in range(N_PRODUCTS):
+        cache.put(f"{SITE_URL}/products/product-catalog/view/test-{i}/", product_page(i))
+    return cache.cache_dir
+
+
+@pytest.fixture
+def replay(recording):
+    servers = []
+
+    def start(fail_rate=0.0, retry_after=0):
+        process = subprocess.Popen(
+            [sys.executable, os.path.join(REPO_DIR, "replay_server.py"), "--cache-dir", recording, "--port", "0",
+             "--fail-rate", str(fail_rate), "--retry-after", str(retry_after)],
+            stdout=subprocess.PIPE, text=True, cwd=REPO_DIR)
+        servers.append(process)
+        match = re.search(r"http://\S+", process.stdout.readline())
+        assert match, "replay_server.py did not start"
+        return match.group(0)
+
+    yield start
+    for process in servers:
+        process.terminate()
+        process.wait()
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    # Record the crawler's backoff delays instead of waiting them out
+    delays = []
+    real_sleep = asyncio.sleep
+
+    async def sleep(delay, *args, **kwargs):
+        delays.append(delay)
+        return await real_sleep(0)
+
+    monkeypatch.setattr(scrape_catalog.asyncio, "sleep", sleep)
+    return delays
+
+
+def crawl(origin, cache_dir, retries=scrape_catalog.RETRIES):
+    async def run():
+        crawler = Crawler(origin, concurrency=4, cache=HTTPCache(cache_dir), retries=retries)
+        try:
+            products = await crawler.scrape_list_pages(parallel=2)
+            await crawler.fetch_all_details(products)
+        finally:
+            await crawler.close()
+        return products, crawler.stats
+
+    return asyncio.run(run())
+
+
+def test_retries_honour_retry_after(replay, sleeps, tmp_path):
+    origin = replay(fail_rate=0.3, retry_after=RETRY_AFTER_S)
+    # Enough retries that a 30% failure rate never exhausts them
+    products, stats = crawl(origin, str(tmp_path / "cache"), retries=12)
+
+    assert len(products) == N_PRODUCTS
+    assert all(p["description"] and p["duration"] for p in products)
+    assert stats["failed"] == 0
+    assert stats["retries"] > 0
+    # Every retry waited at least the server's Retry-After
+    backoffs = [d for d in sleeps if d >= RETRY_AFTER_S]
+    assert len(backoffs) == stats["retries"]
+
+
+def test_conditional_get_reuses_cached_pages(replay, sleeps, tmp_path):
+    origin = replay()
+    cache_dir = str(tmp_path / "cache")
+    first, stats = crawl(origin, cache_dir)
+    pages = stats["downloaded"]
+    assert pages > N_PRODUCTS and stats["not_modified"] == 0
+
+    # Same pages again: every request is answered 304 from the cached ETag
+    second, stats = crawl(origin, cache_dir)
+    assert stats["downloaded"] == 0
+    assert stats["not_modified"] == pages
+    assert second == first
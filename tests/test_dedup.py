@@ -0,0 +1,38 @@
+import numpy as np
+
+from dedup import collapse_duplicates, find_duplicates
+from index_store import VARIANT_EMBEDDINGS_ARRAY, VARIANT_HASH_ARRAY, content_hashes, normalize_rows
+
+
+def catalog(names):
+    return [{'name': name, 'url': f"https://example.com/view/{name.lower().replace(' ', '-')}/"} for name in names]
+
+
+def test_collapse_without_duplicates():
+    products = catalog(["Java 8", "Python", "Verbal Reasoning"])
+    embeddings = normalize_rows(np.eye(3, 8, dtype=np.float32))
+    hashes = content_hashes(products)
+
+    clusters = find_duplicates(products, embeddings)
+    assert clusters == []
+    collapsed, matrix, kept_hashes, arrays = collapse_duplicates(products, embeddings, hashes, clusters)
+    assert collapsed == products
+    assert np.array_equal(matrix, embeddings)
+    assert np.array_equal(kept_hashes, hashes)
+    assert arrays[VARIANT_EMBEDDINGS_ARRAY].shape == (0, 8)
+    assert arrays[VARIANT_HASH_ARRAY].shape == (0,)
+
+
+def test_collapse_folds_variants():
+    products = catalog(["Java 8", "Java 8 New", "Python"])
+    embeddings = normalize_rows(np.array([[1, 0, 0], [1, 0.01, 0], [0, 1, 0]], dtype=np.float32))
+    hashes = content_hashes(products)
+
+    clusters = find_duplicates(products, embeddings)
+    assert sorted(map(sorted, clusters)) == [[0, 1]]
+    collapsed, matrix, kept_hashes, arrays = collapse_duplicates(products, embeddings, hashes, clusters)
+    assert len(collapsed) == len(matrix) == len(kept_hashes) == 2
+    # The "(New)" edition stays canonical
+    assert collapsed[0]['name'] == "Java 8 New"
+    assert [v['name'] for v in collapsed[0]['variants']] == ["Java 8"]
+    assert arrays[VARIANT_EMBEDDINGS_ARRAY].shape == (1, 3)
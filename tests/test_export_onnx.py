@@ -0,0 +1,34 @@
+import os
+
+import pytest
+
+pytest.importorskip("onnxruntime")
+pytest.importorskip("onnx")
+pytest.importorskip("sentence_transformers")
+
+from export_onnx import PARITY_THRESHOLDS, check_parity, export
+from index_store import INDEX_DIR, MODEL_NAME
+
+# Exports the encoder and runs the torch vs ONNX Runtime parity check on the
+# shipped index's product texts. PARITY_MODEL picks another
+# sentence-transformers model name or local path (default: the index's model).
+PARITY_MODEL = os.environ.get("PARITY_MODEL", MODEL_NAME)
+REPO_INDEX = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), INDEX_DIR)
+
+
+@pytest.fixture(scope="module")
+def exported(tmp_path_factory):
+    out_dir = str(tmp_path_factory.mktemp("onnx_model"))
+    try:
+        export(PARITY_MODEL, out_dir)
+    except OSError as e:
+        # Not cached locally and no network to download it
+        pytest.skip(f"{PARITY_MODEL} is not available: {e}")
+    return out_dir
+
+
+def test_parity(exported):
+    results = check_parity(exported, REPO_INDEX)
+    assert set(results) == set(PARITY_THRESHOLDS)
+    for backend, result in results.items():
+        assert result["passed"], f"{backend}: min cosine {result['min_cosine']} < {result['threshold']}"
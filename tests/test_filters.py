@@ -0,0 +1,25 @@
+from filters import AttributeIndex, filter_key
+
+
+def test_collapsed_row_shows_the_variant_that_passed():
+    products = [
+        {'name': "A", 'duration': 30, 'remote_support': "No",
+         'variants': [{'name': "A UK", 'duration': 10, 'remote_support': "Yes"},
+                      {'name': "A US", 'duration': 5, 'remote_support': "No"}]},
+        {'name': "B", 'duration': 5},
+        {'name': "C", 'duration': 50},
+    ]
+    attributes = AttributeIndex(products)
+
+    # Canonical record passes: shown as itself
+    key = filter_key(max_duration=40)
+    assert attributes.rows(key).tolist() == [0, 1]
+    assert attributes.shown_variants(key) == {}
+    # Only variants pass: the first one that does is shown
+    key = filter_key(max_duration=20)
+    assert attributes.rows(key).tolist() == [0, 1]
+    assert attributes.shown_variants(key) == {0: 0}
+    key = filter_key(remote_support=False, max_duration=20)
+    assert attributes.rows(key).tolist() == [0]
+    assert attributes.shown_variants(key) == {0: 1}
+    assert attributes.shown_variants(None) == {}
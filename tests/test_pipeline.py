@@ -0,0 +1,28 @@
+import json
+
+import numpy as np
+
+from pipeline import VectorSpool
+
+
+def test_spool_resumes_after_crash_before_first_vectors(tmp_path):
+    # Meta left behind without vectors.f32 (older spools wrote it first)
+    (tmp_path / "spool.json").write_text(json.dumps({"model_name": "m", "dimension": 4}))
+    spool = VectorSpool(str(tmp_path), "m")
+    assert spool.rows == {}
+
+    spool.append([b"a" * 32, b"b" * 32], np.ones((2, 4)))
+    assert VectorSpool(str(tmp_path), "m").matrix().shape == (2, 4)
+
+
+def test_spool_drops_rows_without_meta(tmp_path):
+    # Crash after the first vectors, before the meta was written
+    (tmp_path / "vectors.f32").write_bytes(np.ones(4, dtype=np.float32).tobytes())
+    (tmp_path / "spool.json.tmp").write_text('{"model')
+    spool = VectorSpool(str(tmp_path), "m")
+    assert spool.rows == {} and spool.matrix() is None
+
+    spool.append([b"c" * 32], np.full((1, 4), 2.0))
+    resumed = VectorSpool(str(tmp_path), "m")
+    assert list(resumed.rows) == [b"c" * 32]
+    assert np.array_equal(resumed.matrix(), np.full((1, 4), 2.0, dtype=np.float32))